@@ -0,0 +1,221 @@
+# api_server.py
+"""
+Headless HTTP JSON API for the travel planner.
+
+Exposes each wizard stage plus a one-shot "plan this trip" endpoint on top of the
+UI-independent planning core (planner.py). All LLM calls are non-blocking, so a
+single worker process serves many concurrent requests, and it shares the
+llm_handler response cache with everything else in the process.
+
+While the LLM circuit breaker is open, stages answer with stale or fallback results
+where there are any; such responses carry a "degraded" list of notes. Stages with
+nothing to fall back on answer 503 with a Retry-After header.
+
+Token usage is charged to the client, keyed by its address (not by anything the
+client sends, so omitting or rotating headers does not reset its budget), and to the
+process-wide budget (see token_budget.py); over budget, stages without a cached or
+local result answer 429. Behind a reverse proxy, set TRAVEL_AI_TRUST_FORWARDED_FOR=1
+to key clients by the address the proxy puts first in X-Forwarded-For.
+
+Run with:
+    GEMINI_API_KEY=... python api_server.py --host 0.0.0.0 --port 8080
+
+Every endpoint takes a JSON object with the same keys as the app's user inputs
+(dates as ISO strings), e.g.:
+    {"starting_destination": "London, UK", "budget": 2000,
+     "time_frame_start": "2025-06-01", "time_frame_end": "2025-06-07",
+     "num_adults": 2, "num_children": 0, "trip_type_description": "Food tour"}
+"""
+import argparse
+import json
+import logging
+import os
+
+from aiohttp import web
+
+import planner
+import plan_edits
+import token_budget
+import warm_index
+from llm_handler import (
+    get_routing_telemetry, collect_degraded_notes, get_circuit_breaker_stats, get_llm_backend_stats, CIRCUIT_CLOSED
+)
+
+
+# Only enable behind a proxy that sets X-Forwarded-For; clients can forge it otherwise.
+TRUST_FORWARDED_FOR = os.environ.get("TRAVEL_AI_TRUST_FORWARDED_FOR", "0") == "1"
+
+
+def _client_key(request):
+    """Token budget session of the client making the request, derived from its address."""
+    address = request.remote
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+        address = forwarded or address
+    return f"client:{address or 'unknown'}"
+
+def _error(status, message, **extra):
+    return web.json_response({"error": message, **extra}, status=status)
+
+def _bad_request(message):
+    return web.HTTPBadRequest(text=json.dumps({"error": message}), content_type="application/json")
+
+async def _read_inputs(request):
+    """
+    Parses the request body into normalized user inputs, and binds the request to the
+    client's token budget session. Raises web.HTTPBadRequest on bad input.
+    """
+    token_budget.bind_session(_client_key(request))
+    try:
+        body = await request.json()
+    except ValueError:
+        raise _bad_request("Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise _bad_request("Request body must be a JSON object.")
+    try:
+        return body, planner.normalize_user_inputs(body)
+    except (TypeError, ValueError) as e:
+        raise _bad_request(f"Invalid trip inputs: {e}")
+
+def _stage_error(message, **extra):
+    """
+    502 for a failed stage, 429 once the token budget is spent, or 503 with Retry-After
+    while the circuit breaker is open.
+    """
+    if token_budget.current_level() == token_budget.LEVEL_REFUSED:
+        return _error(429, message, token_budget=token_budget.get_session_budget_stats(), **extra)
+    breaker = get_circuit_breaker_stats()
+    if breaker["state"] == CIRCUIT_CLOSED:
+        return _error(502, message, **extra)
+    response = _error(503, message, circuit_breaker=breaker["state"], **extra)
+    response.headers["Retry-After"] = str(max(1, round(breaker["retry_in_s"])))
+    return response
+
+async def _run_stage(stage, ui, **extra):
+    """Runs a stage. Returns (result, notes on any degraded results served)."""
+    with collect_degraded_notes() as notes:
+        result = await planner.arun_stage(stage, ui, **extra)
+    return result, notes
+
+def _stage_response(payload, notes):
+    if notes:
+        payload["degraded"] = notes
+    return web.json_response(payload)
+
+def _require(ui, *keys):
+    missing = [k for k in keys if not ui.get(k)]
+    if missing:
+        raise _bad_request(f"Missing required fields: {', '.join(missing)}")
+
+
+# --- Stage endpoints ---
+async def handle_trip_types(request):
+    _, ui = await _read_inputs(request)
+    _require(ui, "starting_destination")
+    trip_types, notes = await _run_stage(planner.STAGE_TRIP_TYPES, ui)
+    if trip_types is None:
+        return _stage_error("Could not get trip type suggestions.")
+    return _stage_response({"trip_types": trip_types}, notes)
+
+async def handle_cities(request):
+    _, ui = await _read_inputs(request)
+    _require(ui, "starting_destination", "selected_trip_type")
+    cities, notes = await _run_stage(planner.STAGE_CITIES, ui)
+    if cities is None:
+        return _stage_error("Could not get city suggestions.")
+    return _stage_response({"cities": cities, "city_options": planner.collect_city_options(ui, cities)}, notes)
+
+async def handle_attractions(request):
+    _, ui = await _read_inputs(request)
+    _require(ui, "selected_trip_type", "selected_cities")
+    attractions, notes = await _run_stage(planner.STAGE_ATTRACTIONS, ui)
+    if attractions is None:
+        return _stage_error("Could not get attraction suggestions.")
+    return _stage_response({"attractions": attractions}, notes)
+
+async def handle_restaurants(request):
+    _, ui = await _read_inputs(request)
+    _require(ui, "selected_trip_type", "selected_cities")
+    restaurants, notes = await _run_stage(planner.STAGE_RESTAURANTS, ui)
+    if restaurants is None:
+        return _stage_error("Could not get restaurant suggestions.")
+    return _stage_response({"restaurants": restaurants}, notes)
+
+async def handle_itinerary(request):
+    _, ui = await _read_inputs(request)
+    _require(ui, "selected_trip_type", "selected_cities")
+    travel_plan, notes = await _run_stage(planner.STAGE_ITINERARY, ui)
+    fallback_used = travel_plan is None
+    if fallback_used:
+        travel_plan = planner.build_fallback_plan(ui)
+        notes.append("The itinerary could not be structured by the AI service; showing a basic outline instead.")
+    return _stage_response({"travel_plan": travel_plan, "fallback_used": fallback_used}, notes)
+
+async def handle_adjust(request):
+    body, ui = await _read_inputs(request)
+    current_plan = body.get("travel_plan")
+    user_request = body.get("user_request")
+    if not isinstance(current_plan, dict) or not isinstance(user_request, str) or not user_request.strip():
+        return _error(400, "Both 'travel_plan' (object) and 'user_request' (string) are required.")
+    days = current_plan.get("itinerary_days")
+    if not isinstance(days, list) or not all(isinstance(day, dict) for day in days):
+        return _error(400, "'travel_plan.itinerary_days' must be a list of objects.")
+    user_request = user_request.strip()
+    local_edit = plan_edits.try_local_edit(current_plan, user_request)
+    if local_edit:
+        return web.json_response({"travel_plan": local_edit.plan, "fast_path": True, "edit": local_edit.description})
+    adjusted_plan, notes = await _run_stage(planner.STAGE_ADJUST, ui,
+                                            current_plan=current_plan, user_request=user_request)
+    if adjusted_plan is None:
+        return _stage_error("AI could not adjust the plan as requested.")
+    return _stage_response({"travel_plan": adjusted_plan, "fast_path": False}, notes)
+
+async def handle_plan(request):
+    body, ui = await _read_inputs(request)
+    _require(ui, "starting_destination")
+    max_cities = body.get("max_cities", 3)
+    if isinstance(max_cities, bool) or not isinstance(max_cities, int) or max_cities < 1:
+        raise _bad_request("'max_cities' must be a positive integer.")
+    try:
+        result = await planner.plan_trip(body, max_cities=max_cities)
+    except planner.PlanningError as e:
+        return _stage_error(str(e), stage=e.stage)
+    return web.json_response(result)
+
+async def handle_health(request):
+    return web.json_response({"status": "ok"})
+
+async def handle_metrics(request):
+    return web.json_response({
+        "routing": get_routing_telemetry(),
+        "warm_index": warm_index.get_warm_index_stats(),
+        "adjust_fast_path": plan_edits.get_fast_path_stats(),
+        "circuit_breaker": get_circuit_breaker_stats(),
+        "token_budget": token_budget.get_budget_stats(),
+        "llm_backend": get_llm_backend_stats(),
+    })
+
+
+def create_app():
+    warm_index.get_warm_index() # Map the precomputed suggestion index once per worker
+    app = web.Application()
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_post("/api/trip-types", handle_trip_types)
+    app.router.add_post("/api/cities", handle_cities)
+    app.router.add_post("/api/attractions", handle_attractions)
+    app.router.add_post("/api/restaurants", handle_restaurants)
+    app.router.add_post("/api/itinerary", handle_itinerary)
+    app.router.add_post("/api/adjust", handle_adjust)
+    app.router.add_post("/api/plan", handle_plan)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the AI Travel Agent HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -1,40 +1,62 @@
 import streamlit as st
 from datetime import date, timedelta
-import json # For displaying plan structure if needed
+import time
+import uuid
 
 # Import functions from other files
-from llm_handler import get_gemini_response
-from prompts import (
-    TRIP_TYPE_PROMPT, CITIES_PROMPT, ATTRACTIONS_PROMPT,
-    RESTAURANTS_PROMPT, ITINERARY_STRUCTURE_PROMPT, ADJUST_PLAN_PROMPT
+from llm_handler import (
+    get_gemini_response, get_routing_telemetry, collect_degraded_notes,
+    get_circuit_breaker_state, get_circuit_breaker_stats, CircuitOpenError, BudgetExceededError, CIRCUIT_CLOSED
 )
+import planner
+from planner import calculate_num_days
+from plan_history import PlanHistory
+import entities
+import plan_edits
+import session_memory
+import speculation
+import token_budget
+import warm_index
+from job_runner import get_job_runner, JOB_DONE, JOB_FAILED, JOB_TIMED_OUT
 
 # --- Page Configuration ---
 st.set_page_config(page_title="AI Travel Agent", layout="wide", initial_sidebar_state="expanded")
 
+# Map the precomputed suggestion index (if one has been built) once per process
+warm_index.get_warm_index()
+
+# Background jobs (see job_runner.py): deadlines per planner stage and how often a
+# running job's progress is polled.
+JOB_TIMEOUT_S = {planner.STAGE_ITINERARY: 120, planner.STAGE_ADJUST: 120}
+JOB_POLL_INTERVAL_S = 0.5
+
+# Wizard stages in order, and the wizard stage each planner stage belongs to.
+# Jobs for a wizard stage become stale when the user goes back to it or before it.
+APP_STAGE_ORDER = ["initial_input", "suggest_trip_type", "suggest_cities",
+                   "suggest_attractions", "suggest_restaurants", "generate_plan"]
+JOB_APP_STAGES = {
+    planner.STAGE_TRIP_TYPES: "suggest_trip_type", planner.STAGE_CITIES: "suggest_cities",
+    planner.STAGE_ATTRACTIONS: "suggest_attractions", planner.STAGE_RESTAURANTS: "suggest_restaurants",
+    planner.STAGE_ITINERARY: "generate_plan", planner.STAGE_ADJUST: "generate_plan",
+}
+
 # --- Initialize Session State ---
 # This function ensures all necessary keys are in session_state
 def initialize_session_state():
-    default_trip_type_description = "e.g., Relaxing beach holiday for a couple"
+    default_trip_type_description = planner.DEFAULT_TRIP_TYPE_PLACEHOLDER
     default_values = {
         "stage": "initial_input",
-        "user_inputs": {
-            "starting_destination": "", "budget": 1000.0,
-            "time_frame_start": date.today(),
-            "time_frame_end": date.today() + timedelta(days=7),
-            "num_adults": 1, "num_children": 0,
-            "trip_type_description": default_trip_type_description, # Default placeholder
-            "cities_to_visit_initial": "", "attractions_to_visit_initial": "",
-            "selected_trip_type": None, "selected_cities": [],
-            "selected_attractions": {}, "include_restaurants": False,
-            "selected_restaurants": {}
-        },
+        "session_id": uuid.uuid4().hex, # Keys this session's background jobs
+        "user_inputs": planner.default_user_inputs(),
         "llm_suggestions": {
             "trip_types": [], "cities": [], "attractions": {}, "restaurants": {}
         },
         "travel_plan_raw": None, # For the structured itinerary from LLM
+        "plan_history": None, # PlanHistory of travel_plan_raw versions (undo/redo)
+        "pending_adjustment_request": "", # Adjustment text of the running adjust job
         "travel_plan_text_adjustment": "", # For user text input to adjust plan
         "error_message": None,
+        "degraded_notices": {}, # Stage -> notes on stale or fallback results shown while the AI was unavailable
         "show_debug": False, # Toggle for showing debug info
         "default_trip_type_placeholder": default_trip_type_description # Store placeholder for comparison
     }
@@ -54,9 +76,27 @@ def initialize_session_state():
 
 initialize_session_state()
 
+# Keep per-session state small: suggestions are held by reference in a process-wide
+# store and payloads the current stage can no longer reach are dropped
+if session_memory.COMPACT_SESSION_STATE:
+    session_memory.compact_session_state(st.session_state)
+
+# Charge this run's model calls (and the background jobs it submits) to this session's token budget
+token_budget.bind_session(st.session_state.session_id)
+
 # --- Helper Functions ---
+def cancel_stale_jobs(stage_name):
+    """Cancels this session's background jobs for stage_name and every later stage."""
+    target = APP_STAGE_ORDER.index(stage_name) if stage_name in APP_STAGE_ORDER else 0
+    stale = [job_stage for job_stage, app_stage in JOB_APP_STAGES.items()
+             if APP_STAGE_ORDER.index(app_stage) >= target]
+    get_job_runner().cancel(st.session_state.session_id, stale)
+    if target <= APP_STAGE_ORDER.index("suggest_cities"):
+        speculation.cancel_city_speculation(st.session_state.session_id)
+
 def reset_to_stage(stage_name):
     """Resets relevant parts of session state when going back to a previous stage."""
+    cancel_stale_jobs(stage_name)
     st.session_state.stage = stage_name
     if stage_name == "initial_input":
         # Preserve some initial inputs if desired, or full reset:
@@ -75,6 +115,7 @@ def reset_to_stage(stage_name):
         st.session_state.llm_suggestions['restaurants'] = {}
         st.session_state.user_inputs['selected_restaurants'] = {}
         st.session_state.travel_plan_raw = None
+        st.session_state.plan_history = None
     elif stage_name == "suggest_cities":
         st.session_state.llm_suggestions['cities'] = []
         st.session_state.user_inputs['selected_cities'] = []
@@ -83,12 +124,41 @@ def reset_to_stage(stage_name):
         st.session_state.llm_suggestions['restaurants'] = {}
         st.session_state.user_inputs['selected_restaurants'] = {}
         st.session_state.travel_plan_raw = None
+        st.session_state.plan_history = None
     # Add more specific resets if needed for other stages
 
-def calculate_num_days(start_date, end_date):
-    if start_date and end_date and start_date <= end_date:
-        return (end_date - start_date).days + 1
-    return 0
+def show_job_progress(job, message):
+    """Shows a running job's progress. Returns True if the user asked to cancel it."""
+    timeout = JOB_TIMEOUT_S.get(job.stage)
+    if job.is_queued():
+        fraction = 0.0 # Other sessions' jobs hold every worker; the deadline has not started
+    else:
+        fraction = min(job.run_time / timeout, 0.95) if timeout else 0.5
+    st.progress(fraction, text=f"{message} {job.progress} ({job.elapsed:.0f}s)")
+    return st.button("⏹️ Cancel", key=f"cancel_job_{job.id}")
+
+def fetch_suggestions(stage, ui):
+    """Runs a suggestion stage, remembering any degraded-result notes for show_degraded_notices."""
+    with collect_degraded_notes() as notes:
+        suggestions = planner.run_stage(stage, ui, get_gemini_response)
+    st.session_state.degraded_notices[stage] = notes
+    return suggestions
+
+def show_degraded_notices(stage):
+    for note in st.session_state.degraded_notices.get(stage, []):
+        st.warning(f"⚠️ {note}")
+
+def show_job_error(job):
+    """Reports why a finished job produced no result."""
+    if isinstance(job.error, (CircuitOpenError, BudgetExceededError)):
+        st.warning(str(job.error))
+    elif job.status == JOB_FAILED:
+        st.error(str(job.error))
+        if getattr(job.error, "raw_output", None) is not None:
+            st.caption("Cleaned LLM output that failed to parse:")
+            st.code(job.error.raw_output, language="text")
+    elif job.status == JOB_TIMED_OUT:
+        st.warning(f"The AI did not finish within {JOB_TIMEOUT_S.get(job.stage)} seconds.")
 
 # --- Sidebar for Navigation/Debug ---
 with st.sidebar:
@@ -107,9 +177,35 @@ with st.sidebar:
         st.write("User Inputs:", st.session_state.user_inputs)
         # st.write("LLM Suggestions:", st.session_state.llm_suggestions) # Can be verbose
         st.write("Travel Plan Raw:", st.session_state.travel_plan_raw)
+        with st.expander("Model Routing"):
+            st.write(get_routing_telemetry())
+        with st.expander("Warm Index"):
+            st.write(warm_index.get_warm_index_stats())
+        with st.expander("Background Jobs"):
+            st.write(get_job_runner().stats())
+        with st.expander("Adjustment Fast Path"):
+            st.write(plan_edits.get_fast_path_stats())
+        with st.expander("Session Memory"):
+            st.write("This session:", session_memory.session_memory_report(st.session_state))
+            st.write("Shared suggestion store:", session_memory.get_shared_store().stats())
+        with st.expander("Circuit Breaker"):
+            st.write(get_circuit_breaker_stats())
+        with st.expander("Speculative Cities"):
+            st.write(speculation.get_speculation_stats())
+        with st.expander("Token Budget"):
+            st.write("This session:", token_budget.get_session_budget_stats())
+            st.write("Process:", token_budget.get_budget_stats())
+
+if get_circuit_breaker_state() != CIRCUIT_CLOSED:
+    st.warning("⚠️ The AI service is having trouble right now. Some results below may be saved from earlier "
+               "trips or a basic outline; they are marked as such.")
+elif token_budget.current_level() >= token_budget.LEVEL_LOCAL_FIRST:
+    st.warning("⚠️ This session is close to its AI usage limit. Suggestions saved from earlier trips are used "
+               "where possible; they are marked as such.")
 
 
 # --- Main Application Logic ---
+poll_for_jobs = False # Set when a background job is running and the page should refresh
 
 # Stage 0: Initial User Inputs
 if st.session_state.stage == "initial_input":
@@ -171,7 +267,7 @@ if st.session_state.stage == "initial_input":
         else:
             user_provided_trip_type = st.session_state.user_inputs['trip_type_description']
             # Check if user provided a specific trip type (not empty and not the placeholder)
-            if user_provided_trip_type and user_provided_trip_type.strip() != "" and user_provided_trip_type != st.session_state.default_trip_type_placeholder:
+            if planner.has_custom_trip_type(st.session_state.user_inputs):
                 st.session_state.user_inputs['selected_trip_type'] = user_provided_trip_type
                 st.session_state.stage = "suggest_cities" # Skip to city suggestions
                 st.session_state.llm_suggestions['cities'] = [] # Clear previous city suggestions
@@ -188,22 +284,20 @@ elif st.session_state.stage == "suggest_trip_type":
     ui = st.session_state.user_inputs
 
     if not st.session_state.llm_suggestions.get('trip_types'): # Fetch only if not already fetched
-        prompt = TRIP_TYPE_PROMPT.format(
-            budget=ui['budget'], start_date=ui['time_frame_start'].isoformat(),
-            end_date=ui['time_frame_end'].isoformat(), adults=ui['num_adults'],
-            children=ui['num_children'], trip_idea=ui.get('trip_type_description', 'any'), # Use 'any' if it was placeholder
-            start_dest=ui['starting_destination']
-        )
         with st.spinner("AI is brainstorming trip types..."):
-            suggestions = get_gemini_response(prompt, expect_json=True)
-        if suggestions and isinstance(suggestions, list) and len(suggestions) > 0:
+            suggestions = fetch_suggestions(planner.STAGE_TRIP_TYPES, ui)
+        if suggestions:
             st.session_state.llm_suggestions['trip_types'] = suggestions
         else:
             st.error("Could not get trip type suggestions. Please try adjusting your inputs or try again later.")
             if st.button("Try Again to Get Trip Types"): st.rerun() # Allow retry
+    show_degraded_notices(planner.STAGE_TRIP_TYPES)
 
     trip_type_suggestions = st.session_state.llm_suggestions.get('trip_types', [])
     if trip_type_suggestions:
+        # Optionally start on the city suggestions for every trip type while the user decides
+        speculation.start_city_speculation(st.session_state.session_id, ui,
+                                           [tt['name'] for tt in trip_type_suggestions])
         options = [f"{tt['name']} – {tt['explanation']}" for tt in trip_type_suggestions]
         
         # Determine current selection for radio button
@@ -233,6 +327,8 @@ elif st.session_state.stage == "suggest_trip_type":
         # Enable "Next" button if suggestions are loaded and a selection is made
         if trip_type_suggestions and st.session_state.user_inputs.get('selected_trip_type'):
             if st.button("Next: Suggest Cities ➡️"):
+                speculation.cancel_city_speculation(st.session_state.session_id,
+                                                    keep=st.session_state.user_inputs['selected_trip_type'])
                 st.session_state.stage = "suggest_cities"
                 st.session_state.llm_suggestions['cities'] = [] # Clear previous city suggestions
                 st.rerun()
@@ -255,45 +351,49 @@ elif st.session_state.stage == "suggest_cities":
     st.info(f"Selected trip type: **{ui['selected_trip_type']}**")
 
 
+    cities_pending = False # A speculative city request for this trip type is still running
     if not st.session_state.llm_suggestions.get('cities'):
-        prompt = CITIES_PROMPT.format(
-            budget=ui['budget'], start_date=ui['time_frame_start'].isoformat(),
-            end_date=ui['time_frame_end'].isoformat(), adults=ui['num_adults'],
-            children=ui['num_children'], start_dest=ui['starting_destination'],
-            selected_trip_type=ui['selected_trip_type'],
-            initial_cities=ui.get('cities_to_visit_initial', 'None')
-        )
-        with st.spinner(f"AI is finding cities for a {ui['selected_trip_type'].lower()}..."):
-            suggestions = get_gemini_response(prompt, expect_json=True)
-        if suggestions and isinstance(suggestions, list):
-            st.session_state.llm_suggestions['cities'] = suggestions
+        spec_job = speculation.get_city_speculation(st.session_state.session_id, ui['selected_trip_type'])
+        if spec_job is not None and spec_job.is_running():
+            if show_job_progress(spec_job, f"AI is finding cities for a {ui['selected_trip_type'].lower()}..."):
+                speculation.cancel_city_speculation(st.session_state.session_id)
+                st.rerun()
+            st.session_state.waited_for_speculation = True
+            cities_pending = poll_for_jobs = True
         else:
-            st.error("Could not get city suggestions. Please try again later.")
+            suggestions = None
+            if spec_job is not None:
+                suggestions = speculation.use_city_speculation(
+                    spec_job, waited=st.session_state.pop("waited_for_speculation", False))
+                st.session_state.degraded_notices[planner.STAGE_CITIES] = list(spec_job.notices)
+            if not suggestions:
+                with st.spinner(f"AI is finding cities for a {ui['selected_trip_type'].lower()}..."):
+                    suggestions = fetch_suggestions(planner.STAGE_CITIES, ui)
+            if suggestions:
+                st.session_state.llm_suggestions['cities'] = suggestions
+            else:
+                st.error("Could not get city suggestions. Please try again later.")
+    show_degraded_notices(planner.STAGE_CITIES)
 
     city_suggestions = st.session_state.llm_suggestions.get('cities', [])
-    all_city_options = []
-    # Add initially specified cities first
-    if ui.get('cities_to_visit_initial'):
-        initial_cities_list = [city.strip() for city in ui['cities_to_visit_initial'].split(',') if city.strip()]
-        all_city_options.extend(initial_cities_list)
+    # Initially specified cities first, then AI suggestions (unique options for multiselect)
+    all_city_options = planner.collect_city_options(ui, city_suggestions)
 
     if city_suggestions:
         st.write("AI suggests these additional cities based on your preferences:")
         for city_sugg in city_suggestions:
             st.markdown(f"- **{city_sugg['city_name']}**: {city_sugg['reason']}")
-            if city_sugg['city_name'] not in all_city_options: # Avoid duplicates
-                 all_city_options.append(city_sugg['city_name'])
-    elif not all_city_options: # Only show this if no initial cities AND no AI suggestions
+    elif not all_city_options and not cities_pending: # Only show this if no initial cities AND no AI suggestions
         st.write("No additional cities suggested by AI. You can proceed with your initial list if any.")
 
-    if not all_city_options:
+    if cities_pending and not all_city_options:
+        pass # The options appear when the running request finishes
+    elif not all_city_options:
         st.warning("No cities to select. Please provide initial cities or let the AI suggest some if the previous step was skipped.")
     else:
-        # Ensure unique options for multiselect
-        unique_all_city_options = list(dict.fromkeys(all_city_options))
         st.session_state.user_inputs['selected_cities'] = st.multiselect(
             "Select the cities you'd like to include in your plan:",
-            options=unique_all_city_options,
+            options=all_city_options,
             default=st.session_state.user_inputs.get('selected_cities', [])
         )
 
@@ -344,20 +444,15 @@ elif st.session_state.stage == "suggest_attractions":
                                set(st.session_state.llm_suggestions.get('attractions', {}).keys()) != set(ui.get('selected_cities',[]))
 
     if should_fetch_attractions:
-        prompt = ATTRACTIONS_PROMPT.format(
-            selected_trip_type=ui['selected_trip_type'],
-            selected_cities_list=ui['selected_cities'],
-            adults=ui['num_adults'], children=ui['num_children'],
-            initial_attractions=ui.get('attractions_to_visit_initial', 'None')
-        )
         with st.spinner("AI is finding attractions..."):
-            suggestions = get_gemini_response(prompt, expect_json=True)
+            suggestions = fetch_suggestions(planner.STAGE_ATTRACTIONS, ui)
 
-        if suggestions and isinstance(suggestions, dict):
+        if suggestions:
             st.session_state.llm_suggestions['attractions'] = suggestions
         else:
             st.error("Could not get attraction suggestions. Please try again later.")
             st.session_state.llm_suggestions['attractions'] = {} # Ensure it's a dict
+    show_degraded_notices(planner.STAGE_ATTRACTIONS)
 
     attraction_suggestions_by_city = st.session_state.llm_suggestions.get('attractions', {})
     current_selected_attractions = ui.get('selected_attractions', {})
@@ -367,26 +462,19 @@ elif st.session_state.stage == "suggest_attractions":
         if city_name not in current_selected_attractions:
             current_selected_attractions[city_name] = []
 
-    initial_attractions_list = [att.strip() for att in ui.get('attractions_to_visit_initial', '').split(',') if att.strip()]
+    initial_attractions_list = planner.split_comma_list(ui.get('attractions_to_visit_initial'))
 
     for city_name in ui['selected_cities']:
         st.subheader(f"Attractions in {city_name}:")
-        city_attraction_options = []
+        # User's initial attractions are offered for every city (a more complex app might
+        # parse city-specific initial attractions), followed by the AI suggestions.
+        city_attraction_suggestions = attraction_suggestions_by_city.get(city_name)
+        city_attraction_options = planner.collect_attraction_options(initial_attractions_list, city_attraction_suggestions, city_name)
 
-        # Add user's initial attractions as options
-        # This simple version adds all initial attractions to all cities' options.
-        # A more complex app might parse city-specific initial attractions.
-        for init_att in initial_attractions_list:
-            if init_att not in city_attraction_options:
-                 city_attraction_options.append(init_att)
-
-        # Add AI suggested attractions
-        if city_name in attraction_suggestions_by_city and attraction_suggestions_by_city[city_name]:
+        if city_attraction_suggestions:
             st.write(f"AI suggests for {city_name}:")
-            for attr_sugg in attraction_suggestions_by_city[city_name]:
+            for attr_sugg in city_attraction_suggestions:
                 st.markdown(f"- **{attr_sugg['attraction_name']}**: {attr_sugg['description']}")
-                if attr_sugg['attraction_name'] not in city_attraction_options:
-                    city_attraction_options.append(attr_sugg['attraction_name'])
         elif not initial_attractions_list : # Only show this if no AI suggestions AND no initial ones for options
             st.write(f"No specific AI suggestions for {city_name}, or suggestions failed.")
 
@@ -394,13 +482,11 @@ elif st.session_state.stage == "suggest_attractions":
             st.write(f"No attraction options available for {city_name}.")
             current_selected_attractions[city_name] = []
         else:
-            # Ensure unique options
-            unique_city_attraction_options = list(dict.fromkeys(city_attraction_options))
             current_selected_attractions[city_name] = st.multiselect(
                 f"Select attractions for {city_name}:",
-                options=unique_city_attraction_options,
+                options=city_attraction_options,
                 default=current_selected_attractions.get(city_name, []),
-                key=f"attractions_{city_name.replace(' ','_')}" # Ensure key is valid
+                key=f"attractions_{entities.city_id(city_name)}" # Same key for every spelling of the city
             )
     st.session_state.user_inputs['selected_attractions'] = current_selected_attractions
 
@@ -443,18 +529,14 @@ elif st.session_state.stage == "suggest_restaurants":
                                    set(st.session_state.llm_suggestions.get('restaurants', {}).keys()) != set(ui.get('selected_cities',[]))
 
         if should_fetch_restaurants:
-            prompt = RESTAURANTS_PROMPT.format(
-                selected_cities_list=ui['selected_cities'],
-                selected_trip_type=ui['selected_trip_type'],
-                budget=ui['budget'], adults=ui['num_adults'], children=ui['num_children']
-            )
             with st.spinner("AI is looking up restaurants..."):
-                suggestions = get_gemini_response(prompt, expect_json=True)
-            if suggestions and isinstance(suggestions, dict):
+                suggestions = fetch_suggestions(planner.STAGE_RESTAURANTS, ui)
+            if suggestions:
                 st.session_state.llm_suggestions['restaurants'] = suggestions
             else:
                 st.error("Could not get restaurant suggestions.")
                 st.session_state.llm_suggestions['restaurants'] = {}
+        show_degraded_notices(planner.STAGE_RESTAURANTS)
 
         restaurant_suggestions_by_city = st.session_state.llm_suggestions.get('restaurants', {})
         current_selected_restaurants = ui.get('selected_restaurants', {})
@@ -471,7 +553,7 @@ elif st.session_state.stage == "suggest_restaurants":
             if city_name in restaurant_suggestions_by_city and restaurant_suggestions_by_city[city_name]:
                 st.write(f"AI suggests for {city_name}:")
                 for rest_sugg in restaurant_suggestions_by_city[city_name]:
-                    option_label = f"{rest_sugg['restaurant_name']} ({rest_sugg['cuisine_type']}, {rest_sugg['price_range']}) – {rest_sugg['description']}"
+                    option_label = planner.restaurant_option_label(rest_sugg)
                     city_restaurant_options.append(option_label)
                     city_restaurant_details_map[option_label] = rest_sugg # Store full object
             else:
@@ -486,17 +568,17 @@ elif st.session_state.stage == "suggest_restaurants":
                 if current_selected_restaurants.get(city_name):
                     for label in city_restaurant_options:
                         # Assuming stored value is the restaurant name
-                        if label.split(" (")[0] in current_selected_restaurants[city_name]:
+                        if planner.restaurant_name_from_label(label) in current_selected_restaurants[city_name]:
                             default_selection_labels.append(label)
                 
                 selected_labels = st.multiselect(
                     f"Select restaurants for {city_name}:",
                     options=city_restaurant_options,
                     default=default_selection_labels,
-                    key=f"restaurants_{city_name.replace(' ','_')}"
+                    key=f"restaurants_{entities.city_id(city_name)}"
                 )
                 # Store the selected restaurant names (or full objects if you prefer more detail later)
-                current_selected_restaurants[city_name] = [label.split(" (")[0] for label in selected_labels]
+                current_selected_restaurants[city_name] = [planner.restaurant_name_from_label(label) for label in selected_labels]
         st.session_state.user_inputs['selected_restaurants'] = current_selected_restaurants
 
     col1, col2 = st.columns([1,1])
@@ -508,6 +590,7 @@ elif st.session_state.stage == "suggest_restaurants":
         if st.button("Generate Travel Plan ✨➡️"):
             st.session_state.stage = "generate_plan"
             st.session_state.travel_plan_raw = None # Clear previous plan
+            get_job_runner().cancel(st.session_state.session_id, [planner.STAGE_ITINERARY, planner.STAGE_ADJUST])
             st.rerun()
 
 
@@ -523,54 +606,44 @@ elif st.session_state.stage == "generate_plan":
         st.stop()
 
 
-    if not st.session_state.travel_plan_raw: # Generate plan only once per this stage entry
-        attractions_data_for_prompt = {}
-        for city, attrs in ui.get('selected_attractions', {}).items():
-            if attrs and city in ui.get('selected_cities', []): # Ensure city is still selected
-                attractions_data_for_prompt[city] = [{"attraction_name": attr, "description": "User selected"} for attr in attrs]
-
-        restaurants_data_for_prompt = {}
-        if ui.get('include_restaurants', False):
-            for city, rests in ui.get('selected_restaurants', {}).items():
-                if rests and city in ui.get('selected_cities', []):
-                     restaurants_data_for_prompt[city] = [{"restaurant_name": r, "description": "User selected"} for r in rests]
-
-        prompt = ITINERARY_STRUCTURE_PROMPT.format(
-            num_days=num_days,
-            start_date=ui['time_frame_start'].isoformat(),
-            end_date=ui['time_frame_end'].isoformat(),
-            selected_cities_list_str=str(ui['selected_cities']),
-            attractions_data_str=json.dumps(attractions_data_for_prompt),
-            restaurants_data_str=json.dumps(restaurants_data_for_prompt),
-            selected_trip_type=ui['selected_trip_type'],
-            adults=ui['num_adults'], children=ui['num_children']
-        )
-        with st.spinner("AI is structuring your itinerary... This might take a moment."):
-            plan_output = get_gemini_response(prompt, expect_json=True)
+    runner = get_job_runner()
+    session_id = st.session_state.session_id
 
-        if plan_output and isinstance(plan_output, dict) and "itinerary_days" in plan_output:
-            st.session_state.travel_plan_raw = plan_output
-        else:
-            st.error("Could not structure the itinerary with AI. Displaying a basic summary of your selections.")
-            fallback_plan = {"general_notes": "AI structuring failed. Here's a summary of your selections:", "itinerary_days": []}
-            # Create a very basic fallback based on selected items
-            for city_idx, city_name in enumerate(ui.get('selected_cities', [])):
-                day_entry = {
-                    "day_number": f"Focus on {city_name}",
-                    "location": city_name,
-                    "morning_activity": "Explore attractions: " + ", ".join(ui.get('selected_attractions', {}).get(city_name, ["Not specified"])),
-                    "afternoon_activity": "Further exploration or leisure",
-                    "evening_meal": "Try local restaurants" + (": " + ", ".join(ui.get('selected_restaurants', {}).get(city_name, [])) if ui.get('include_restaurants') and ui.get('selected_restaurants', {}).get(city_name) else ""),
-                    "notes": "This is a basic outline. Adjust as needed."
-                }
-                fallback_plan["itinerary_days"].append(day_entry)
-            if not fallback_plan["itinerary_days"]:
-                 fallback_plan["general_notes"] = "No items selected to display in the plan."
-            st.session_state.travel_plan_raw = fallback_plan
+    if not st.session_state.travel_plan_raw: # Generate plan only once per this stage entry
+        # The itinerary is generated in the background so the page stays responsive
+        job = runner.get_for(session_id, planner.STAGE_ITINERARY)
+        if job is None:
+            job = runner.submit(session_id, planner.STAGE_ITINERARY, planner.run_stage_job,
+                                planner.STAGE_ITINERARY, dict(ui), timeout=JOB_TIMEOUT_S[planner.STAGE_ITINERARY])
+
+        plan_ready = not job.is_running()
+        if not plan_ready:
+            if show_job_progress(job, "AI is structuring your itinerary... This might take a moment."):
+                job.cancel()
+                plan_ready = True
+            else:
+                poll_for_jobs = True
+
+        if plan_ready:
+            runner.discard(job)
+            plan_output = job.result if job.status == JOB_DONE else None
+            notices = list(job.notices)
+            if plan_output:
+                st.session_state.travel_plan_raw = plan_output
+            else:
+                show_job_error(job)
+                st.error("Could not structure the itinerary with AI. Displaying a basic summary of your selections.")
+                # Create a very basic fallback based on selected items
+                st.session_state.travel_plan_raw = planner.build_fallback_plan(ui)
+                notices.append("This is a basic outline of your selections, not an AI-structured itinerary.")
+            st.session_state.degraded_notices[planner.STAGE_ITINERARY] = notices
+            st.session_state.plan_history = PlanHistory()
+            st.session_state.plan_history.commit(st.session_state.travel_plan_raw, label="Generated plan")
 
 
     plan_data = st.session_state.travel_plan_raw
     if plan_data:
+        show_degraded_notices(planner.STAGE_ITINERARY)
         st.subheader("Trip Overview")
         st.markdown(f"**Trip Type:** {ui.get('selected_trip_type', 'N/A')}")
         st.markdown(f"**Duration:** {num_days} days ({ui['time_frame_start'].strftime('%B %d, %Y')} to {ui['time_frame_end'].strftime('%B %d, %Y')})")
@@ -599,26 +672,70 @@ elif st.session_state.stage == "generate_plan":
             value=st.session_state.get('travel_plan_text_adjustment', ""), height=100,
             key="plan_adjustment_input"
         )
-        if st.button("🤖 Ask AI to Adjust Plan"):
+        adjust_job = runner.get_for(session_id, planner.STAGE_ADJUST)
+        if st.button("🤖 Ask AI to Adjust Plan", disabled=adjust_job is not None):
             if st.session_state.travel_plan_text_adjustment and st.session_state.travel_plan_raw:
-                adjustment_prompt = ADJUST_PLAN_PROMPT.format(
-                    current_plan_json=json.dumps(st.session_state.travel_plan_raw),
-                    user_request=st.session_state.travel_plan_text_adjustment
-                )
-                with st.spinner("AI is attempting to adjust your plan..."):
-                    adjusted_plan_output = get_gemini_response(adjustment_prompt, expect_json=True)
-
-                if adjusted_plan_output and isinstance(adjusted_plan_output, dict) and "itinerary_days" in adjusted_plan_output:
-                    st.session_state.travel_plan_raw = adjusted_plan_output
+                # Simple structural edits (swap days, remove/move an activity, free time) are applied locally
+                local_edit = plan_edits.try_local_edit(st.session_state.travel_plan_raw, st.session_state.travel_plan_text_adjustment)
+                if local_edit:
+                    st.session_state.plan_history.commit_edit(local_edit.day_updates, label=f"{local_edit.description} (instant)")
+                    st.session_state.travel_plan_raw = local_edit.plan
                     st.session_state.travel_plan_text_adjustment = "" # Clear input
-                    st.success("Plan adjusted by AI!")
+                    st.toast(f"⚡ {local_edit.description}")
                     st.rerun()
-                else:
-                    st.error("AI could not adjust the plan as requested, or the response was not in the expected format. Please try rephrasing your request or make manual notes.")
+                st.session_state.pending_adjustment_request = st.session_state.travel_plan_text_adjustment
+                runner.submit(session_id, planner.STAGE_ADJUST, planner.run_stage_job,
+                              planner.STAGE_ADJUST, dict(ui), timeout=JOB_TIMEOUT_S[planner.STAGE_ADJUST],
+                              current_plan=st.session_state.travel_plan_raw,
+                              user_request=st.session_state.travel_plan_text_adjustment)
+                st.rerun()
             elif not st.session_state.travel_plan_text_adjustment:
                 st.warning("Please enter an adjustment request.")
             elif not st.session_state.travel_plan_raw:
                 st.warning("No current plan to adjust. Please generate a plan first.")
+
+        if adjust_job is not None:
+            if adjust_job.is_running():
+                if show_job_progress(adjust_job, "AI is attempting to adjust your plan..."):
+                    runner.cancel(session_id, [planner.STAGE_ADJUST])
+                    st.rerun()
+                poll_for_jobs = True
+            else:
+                runner.discard(adjust_job)
+                if adjust_job.status == JOB_DONE and adjust_job.result:
+                    st.session_state.plan_history.commit(adjust_job.result, label=st.session_state.pending_adjustment_request)
+                    st.session_state.travel_plan_raw = adjust_job.result
+                    st.session_state.travel_plan_text_adjustment = "" # Clear input
+                    st.session_state.degraded_notices[planner.STAGE_ITINERARY] = list(adjust_job.notices)
+                    st.success("Plan adjusted by AI!")
+                    st.rerun()
+                else:
+                    show_job_error(adjust_job)
+                    st.error("AI could not adjust the plan as requested, or the response was not in the expected format. Please try rephrasing your request or make manual notes.")
+
+        # Undo/redo between plan versions without another AI call
+        history = st.session_state.plan_history
+        if history and len(history) > 1:
+            undo_col, redo_col = st.columns([1,1])
+            with undo_col:
+                if st.button("↩️ Undo Adjustment", disabled=not history.can_undo()):
+                    st.session_state.travel_plan_raw = history.undo()
+                    st.rerun()
+            with redo_col:
+                if st.button("↪️ Redo Adjustment", disabled=not history.can_redo()):
+                    st.session_state.travel_plan_raw = history.redo()
+                    st.rerun()
+            with st.expander(f"Plan versions ({history.cursor + 1} of {len(history)})"):
+                for i, label in enumerate(history.labels()):
+                    marker = "➡️ " if i == history.cursor else ""
+                    st.markdown(f"{marker}{i + 1}. {label or 'Unnamed version'}")
+                if history.cursor > 0:
+                    changed_days = history.diff()
+                    st.caption(f"Changes from the previous version: {len(changed_days)} day(s)")
+                    for change in changed_days:
+                        before = (change['before'] or {}).get('day_number', 'removed')
+                        after = (change['after'] or {}).get('day_number', 'removed')
+                        st.markdown(f"- Position {change['index'] + 1}: {before} → {after}")
     else:
         st.info("Your travel plan is being generated or was not successfully created.")
 
@@ -639,5 +756,10 @@ else:
     reset_to_stage("initial_input")
     st.rerun()
 
+# Refresh while a background job is running so its progress and result show up
+if poll_for_jobs:
+    time.sleep(JOB_POLL_INTERVAL_S)
+    st.rerun()
+
 
 
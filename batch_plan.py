@@ -0,0 +1,211 @@
+# batch_plan.py
+"""
+Bulk, non-interactive trip planning over a JSONL file of trip specs.
+
+Each input line is a JSON object using the app's user-input keys (or the short
+aliases in SPEC_ALIASES) plus an optional "id":
+    {"id": "promo-001", "origin": "London, UK", "destination": "Paris, Rome",
+     "budget": 2500, "start_date": "2025-06-01", "end_date": "2025-06-07",
+     "adults": 2, "children": 1, "trip_type": "Food and culture"}
+
+Every spec runs through the full prompt pipeline (planner.plan_trip) with bounded
+concurrency and a requests-per-minute limit on LLM calls. Results are appended to
+the output JSONL as they complete and flushed immediately; the output file doubles
+as the checkpoint, so re-running the same command after a crash skips specs that
+already have an "ok" record and retries the rest. Plans that only came back degraded
+(the fallback outline, or stale/local results while the AI was unavailable or the
+token budget was degrading) are written with status "degraded" and retried too, as
+are input lines that are not valid JSON objects (status "error"). Each spec is its own
+token budget session ("batch:<id>", see token_budget.py), so one runaway spec cannot
+use more than a session's budget.
+
+Usage:
+    GEMINI_API_KEY=... python batch_plan.py specs.jsonl plans.jsonl --concurrency 8 --rpm 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import planner
+import token_budget
+from llm_handler import get_gemini_response_async
+from perf_utils import summarize_latencies
+
+# Short field names accepted in trip specs, mapped to the user-input keys.
+SPEC_ALIASES = {
+    "origin": "starting_destination",
+    "destination": "cities_to_visit_initial",
+    "destinations": "cities_to_visit_initial",
+    "start_date": "time_frame_start",
+    "end_date": "time_frame_end",
+    "adults": "num_adults",
+    "children": "num_children",
+    "trip_type": "trip_type_description",
+    "attractions": "attractions_to_visit_initial",
+}
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `per_minute` start in any minute (0 disables the limit)."""
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def spec_to_inputs(spec):
+    """Maps a trip spec to planner user inputs, resolving aliases and list-valued fields."""
+    inputs = {}
+    for key, value in spec.items():
+        key = SPEC_ALIASES.get(key, key)
+        if key in ("cities_to_visit_initial", "attractions_to_visit_initial") and isinstance(value, list):
+            value = ", ".join(value)
+        inputs[key] = value
+    inputs.pop("id", None)
+    return inputs
+
+def read_specs(path):
+    """
+    Yields (spec_id, spec) pairs. Specs without an "id" are keyed by their line number.
+    A line that is not a JSON object yields its line key with an error message as the spec.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield f"line-{line_number}", f"Invalid JSON: {e}"
+                continue
+            if not isinstance(spec, dict):
+                yield f"line-{line_number}", "Invalid trip spec: not a JSON object"
+                continue
+            yield str(spec.get("id", f"line-{line_number}")), spec
+
+def load_completed_ids(output_path):
+    """Reads the output file (the checkpoint) and returns the ids that already have an "ok" result."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # Partially written last line after a crash
+            if record.get("status") == "ok":
+                completed.add(record.get("id"))
+    return completed
+
+def _start_on_new_line(output_path):
+    """Ends a partially written last line (after a crash) so the next record starts on its own line."""
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+async def run_batch(input_path, output_path, concurrency=4, rpm=60, max_cities=3, llm_call=None, progress_every=25):
+    """
+    Plans every pending spec in `input_path`, appending results to `output_path`.
+
+    Returns:
+        dict: The run report (counts, throughput in plans per minute and per-stage latency percentiles).
+    """
+    llm_call = llm_call or get_gemini_response_async
+    limiter = RateLimiter(rpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    completed_ids = load_completed_ids(output_path)
+    pending = [(spec_id, spec) for spec_id, spec in read_specs(input_path) if spec_id not in completed_ids]
+
+    stage_latencies = {}
+    plan_latencies = []
+    counts = {"ok": 0, "degraded": 0, "error": 0, "skipped": len(completed_ids)}
+
+    async def limited_llm_call(prompt, **kwargs):
+        await limiter.wait()
+        return await llm_call(prompt, **kwargs)
+
+    async def plan_one(spec_id, spec, out):
+        async with semaphore:
+            started = time.perf_counter()
+            token_budget.bind_session(f"batch:{spec_id}") # Each gathered task has its own context
+            try:
+                if isinstance(spec, str):
+                    raise ValueError(spec) # Unreadable input line (see read_specs)
+                result = await planner.plan_trip(spec_to_inputs(spec), llm_call=limited_llm_call, max_cities=max_cities)
+                # Degraded plans are kept for inspection but retried on the next run.
+                status = "degraded" if result.get("fallback_used") or result.get("degraded") else "ok"
+                record = {"id": spec_id, "status": status, **result}
+            except planner.PlanningError as e:
+                record = {"id": spec_id, "status": "error", "stage": e.stage, "error": str(e)}
+            except (TypeError, ValueError) as e:
+                message = str(e) if isinstance(spec, str) else f"Invalid trip spec: {e}"
+                record = {"id": spec_id, "status": "error", "stage": None, "error": message}
+            except Exception as e: # Keep the batch going; the spec is retried on the next run
+                record = {"id": spec_id, "status": "error", "stage": None, "error": f"Unexpected error: {e}"}
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        record["elapsed_ms"] = round(elapsed_ms, 1)
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+        counts[record["status"]] += 1
+        if record["status"] == "ok":
+            plan_latencies.append(elapsed_ms)
+            for stage, latency in record["stage_latency_ms"].items():
+                stage_latencies.setdefault(stage, []).append(latency)
+        done = counts["ok"] + counts["degraded"] + counts["error"]
+        if progress_every and done % progress_every == 0:
+            print(f"[batch] {done}/{len(pending)} done ({counts['degraded']} degraded, {counts['error']} errors)",
+                  file=sys.stderr)
+
+    started = time.perf_counter()
+    _start_on_new_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as out:
+        await asyncio.gather(*(plan_one(spec_id, spec, out) for spec_id, spec in pending))
+    elapsed_s = time.perf_counter() - started
+
+    return {
+        "specs_pending": len(pending),
+        **counts,
+        "elapsed_s": round(elapsed_s, 2),
+        "plans_per_minute": round(counts["ok"] / elapsed_s * 60, 2) if elapsed_s > 0 else None,
+        "plan_latency_ms": summarize_latencies(plan_latencies),
+        "stage_latency_ms": {stage: summarize_latencies(values) for stage, values in stage_latencies.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate travel plans for a JSONL file of trip specs.")
+    parser.add_argument("input", help="JSONL file of trip specs")
+    parser.add_argument("output", help="JSONL file to append results to (also used as the resume checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of trips planned at once")
+    parser.add_argument("--rpm", type=int, default=60, help="Maximum LLM requests per minute (0 = unlimited)")
+    parser.add_argument("--max-cities", type=int, default=3, help="Cities selected per trip")
+    parser.add_argument("--report", help="Optional path to write the JSON run report to")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_batch(args.input, args.output, concurrency=args.concurrency,
+                                   rpm=args.rpm, max_cities=args.max_cities))
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
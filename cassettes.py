@@ -0,0 +1,362 @@
+# cassettes.py
+"""
+Record and replay LLM traffic, for deterministic performance comparisons.
+
+RecordingBackend wraps a real backend (Gemini by default) and appends every completed
+model call to a cassette: the prompt, the raw response text (malformed output
+included) or the error and its class, the latency and the token usage. ReplayBackend serves a
+cassette offline: the same prompt gets the same response, optionally after the
+recorded latency, so two versions of the app can be compared on identical model
+output without network access.
+
+A prompt that is not in the cassette is reported as prompt drift: the closest
+recorded prompt, its similarity and a short diff are logged, kept in stats() and,
+if TRAVEL_AI_CASSETTE_DRIFT_LOG is set, appended to that file as JSON lines.
+Unless the replay is strict, the closest recording's response is served so the run
+can continue.
+
+A cassette is a gzip-compressed JSON-lines file, one call per line. Select a mode with
+TRAVEL_AI_LLM_BACKEND (see llm_handler.get_llm_backend):
+
+    TRAVEL_AI_LLM_BACKEND=record TRAVEL_AI_CASSETTE=run.jsonl.gz streamlit run app.py
+    TRAVEL_AI_LLM_BACKEND=replay TRAVEL_AI_CASSETTE=run.jsonl.gz streamlit run app.py
+
+Other environment variables:
+    TRAVEL_AI_RECORD_BACKEND       backend to record: "gemini" (default) or "fake"
+    TRAVEL_AI_REPLAY_LATENCY       1 to replay the recorded latencies (default 0)
+    TRAVEL_AI_REPLAY_LATENCY_SCALE multiplier for replayed latencies (default 1)
+    TRAVEL_AI_REPLAY_STRICT        1 to fail calls whose prompt is not in the cassette
+    TRAVEL_AI_CASSETTE_DRIFT_LOG   file to append prompt drift reports to
+
+Summarize a cassette with:
+    python cassettes.py run.jsonl.gz
+"""
+import argparse
+import asyncio
+import atexit
+import difflib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+from llm_handler import GeminiBackend, LLMCancelled, LLMError, LLMResponseError, clean_json_string
+from perf_utils import summarize_latencies
+
+logger = logging.getLogger(__name__)
+
+# Drifted prompts below this similarity to every recording get no closest-match response.
+DRIFT_MIN_SIMILARITY = 0.5
+
+# Diff lines kept per drift report.
+DRIFT_DIFF_LINES = 12
+
+# How often a replayed latency is interrupted to check for cancellation.
+_CANCEL_POLL_S = 0.05
+
+# Recorded errors are replayed as the same LLMError subclass, so the breaker and the
+# fallbacks react as they did live. Other exception types replay as a plain LLMError,
+# which is what llm_handler wraps them in anyway.
+_REPLAYED_ERRORS = {cls.__name__: cls for cls in (LLMError, LLMResponseError, LLMCancelled)}
+
+# Compressed bytes decoded at a time when reading a cassette; a corrupt chunk is
+# re-decoded byte by byte to keep everything before the damage.
+_READ_CHUNK = 64 * 1024
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+
+
+def prompt_key(prompt_text, expect_json):
+    """Cassette key of a prompt: the model and route are not part of it."""
+    return hashlib.sha256(f"{int(bool(expect_json))}:{prompt_text}".encode("utf-8")).hexdigest()
+
+def _decompress_member(data, pos):
+    """
+    Decompresses the gzip member starting at `pos`. Returns (bytes, end position), with
+    end None if the member is cut short or corrupt; the bytes decoded before the damage
+    are still returned.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    output = []
+    for start in range(pos, len(data), _READ_CHUNK):
+        chunk = data[start:start + _READ_CHUNK]
+        checkpoint = decompressor.copy()
+        try:
+            output.append(decompressor.decompress(chunk))
+        except zlib.error:
+            decompressor = checkpoint
+            for i in range(len(chunk)):
+                try:
+                    output.append(decompressor.decompress(chunk[i:i + 1]))
+                except zlib.error:
+                    break
+            return b"".join(output), None
+        if decompressor.eof:
+            return b"".join(output), start + len(chunk) - len(decompressor.unused_data)
+    return b"".join(output), None
+
+def read_cassette(path):
+    """
+    Returns the recorded calls of a cassette, in order. A recording killed before it
+    was closed leaves a gzip member without a trailer (and, if recording was resumed
+    into the same file, another member appended after it): its complete lines are
+    kept and reading resumes at the next member.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    entries, damaged, pos = [], 0, 0
+    while pos < len(data):
+        text, end = _decompress_member(data, pos)
+        for line in text.decode("utf-8", errors="replace").splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                damaged += 1
+        if end is None:
+            damaged += 1
+            end = data.find(_GZIP_MAGIC, pos + 1)
+            if end < 0:
+                break
+        pos = end
+    if damaged:
+        logger.warning("Cassette %s has incomplete or corrupt records; read the %d complete ones.", path, len(entries))
+    return entries
+
+
+# --- Recording ---
+class RecordingBackend:
+    """Passes calls to `inner` and appends each completed call to the cassette at `path`."""
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.name = f"record:{inner.name}"
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.recorded = 0
+        atexit.register(self.close)
+
+    def configure(self):
+        self.inner.configure()
+
+    def _write(self, model_name, prompt_text, expect_json, started, usage, response=None, error=None):
+        """Appends one call; `error` is the exception the call raised, if any."""
+        entry = {
+            "key": prompt_key(prompt_text, expect_json),
+            "model": model_name,
+            "expect_json": bool(expect_json),
+            "prompt": prompt_text,
+            "response": response,
+            "error": None if error is None else str(error),
+            "error_type": None if error is None else type(error).__name__,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "usage": dict(usage or {}),
+            "recorded_at": round(time.time(), 3),
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._file.flush() # Readable even if the process is killed
+            self.recorded += 1
+
+    def generate(self, model_name, prompt_text, expect_json, route, cancel_check=None, usage=None):
+        usage = {} if usage is None else usage
+        started = time.perf_counter()
+        try:
+            response = self.inner.generate(model_name, prompt_text, expect_json, route, cancel_check, usage=usage)
+        except LLMCancelled:
+            raise # Cut short by the caller; nothing worth replaying
+        except Exception as e:
+            self._write(model_name, prompt_text, expect_json, started, usage, error=e)
+            raise
+        self._write(model_name, prompt_text, expect_json, started, usage, response=response)
+        return response
+
+    async def generate_async(self, model_name, prompt_text, expect_json, route, usage=None):
+        usage = {} if usage is None else usage
+        started = time.perf_counter()
+        try:
+            response = await self.inner.generate_async(model_name, prompt_text, expect_json, route, usage=usage)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._write(model_name, prompt_text, expect_json, started, usage, error=e)
+            raise
+        self._write(model_name, prompt_text, expect_json, started, usage, response=response)
+        return response
+
+    def stats(self):
+        return {"cassette": self.path, "recorded": self.recorded}
+
+    def close(self):
+        with self._lock:
+            self._file.close() # Writes the gzip trailer; a no-op when already closed
+
+
+# --- Replay ---
+class ReplayBackend:
+    """Serves recorded responses by prompt. Repeated prompts replay their recordings in order."""
+    name = "replay"
+
+    def __init__(self, path, keep_latency=False, latency_scale=1.0, strict=False, drift_log=None):
+        self.path = path
+        self.keep_latency = keep_latency
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.drift_log = drift_log
+        self._by_key = defaultdict(list) # prompt key -> recorded calls
+        for entry in read_cassette(path):
+            self._by_key[entry["key"]].append(entry)
+        self._next = defaultdict(int) # prompt key -> index of the next recording to serve
+        self._closest = {} # drifted prompt key -> (closest key or None, similarity)
+        self._drift = []
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "drifted": 0, "served_closest": 0, "errors_replayed": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ["TRAVEL_AI_CASSETTE"],
+                   keep_latency=os.environ.get("TRAVEL_AI_REPLAY_LATENCY", "0") == "1",
+                   latency_scale=float(os.environ.get("TRAVEL_AI_REPLAY_LATENCY_SCALE", 1)),
+                   strict=os.environ.get("TRAVEL_AI_REPLAY_STRICT", "0") == "1",
+                   drift_log=os.environ.get("TRAVEL_AI_CASSETTE_DRIFT_LOG"))
+
+    def configure(self):
+        pass # Offline; no API key needed
+
+    def _find_closest(self, prompt_text, expect_json):
+        best_key, best_ratio = None, 0.0
+        for key, entries in self._by_key.items():
+            recorded = entries[0]
+            if recorded["expect_json"] != bool(expect_json):
+                continue
+            matcher = difflib.SequenceMatcher(None, recorded["prompt"], prompt_text, autojunk=False)
+            if matcher.real_quick_ratio() <= best_ratio or matcher.quick_ratio() <= best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                best_key, best_ratio = key, ratio
+        return best_key, best_ratio
+
+    def _report_drift(self, key, prompt_text, expect_json):
+        """Records a prompt missing from the cassette. Returns the key to serve instead, or None."""
+        with self._lock:
+            known = self._closest.get(key)
+        if known is None:
+            closest_key, similarity = self._find_closest(prompt_text, expect_json)
+            report = {"key": key, "closest_key": closest_key, "similarity": round(similarity, 3),
+                      "prompt_head": prompt_text.strip()[:120]}
+            if closest_key is not None:
+                recorded = self._by_key[closest_key][0]["prompt"]
+                diff = difflib.unified_diff(recorded.splitlines(), prompt_text.splitlines(), "recorded", "current", n=0, lineterm="")
+                report["diff"] = [line for line in diff if not line.startswith(("---", "+++"))][:DRIFT_DIFF_LINES]
+            logger.warning("Prompt drift: no recording for prompt %s (closest %s, similarity %.2f)",
+                           key[:12], (closest_key or "none")[:12], similarity)
+            with self._lock:
+                known = self._closest.setdefault(key, (closest_key, similarity))
+                self._drift.append(report)
+            if self.drift_log:
+                with open(self.drift_log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(report) + "\n")
+        with self._lock:
+            self._counts["drifted"] += 1
+        closest_key, similarity = known
+        if self.strict or closest_key is None or similarity < DRIFT_MIN_SIMILARITY:
+            return None
+        return closest_key
+
+    def _lookup(self, prompt_text, expect_json):
+        """Returns the recording to serve. Raises LLMError for unservable drift."""
+        key = prompt_key(prompt_text, expect_json)
+        if key not in self._by_key:
+            key = self._report_drift(key, prompt_text, expect_json)
+            if key is None:
+                raise LLMError("Replay: prompt not found in the cassette (prompt drift).")
+            with self._lock:
+                self._counts["served_closest"] += 1
+        with self._lock:
+            entries = self._by_key[key]
+            entry = entries[self._next[key] % len(entries)]
+            self._next[key] += 1
+            self._counts["hits"] += 1
+            if entry["error"] is not None:
+                self._counts["errors_replayed"] += 1
+        return entry
+
+    def _delay(self, entry):
+        return entry["latency_ms"] / 1000 * self.latency_scale if self.keep_latency else 0.0
+
+    @staticmethod
+    def _result(entry, usage):
+        if usage is not None:
+            usage.update(entry["usage"])
+        if entry["error"] is not None:
+            error_class = _REPLAYED_ERRORS.get(entry.get("error_type"), LLMError) # Older cassettes have no error_type
+            raise error_class(f"Replayed error: {entry['error']}")
+        return entry["response"]
+
+    def generate(self, model_name, prompt_text, expect_json, route, cancel_check=None, usage=None):
+        entry = self._lookup(prompt_text, expect_json)
+        deadline = time.monotonic() + self._delay(entry)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._result(entry, usage)
+            if cancel_check is not None and cancel_check():
+                raise LLMCancelled("Gemini call cancelled.")
+            time.sleep(min(remaining, _CANCEL_POLL_S))
+
+    async def generate_async(self, model_name, prompt_text, expect_json, route, usage=None):
+        entry = self._lookup(prompt_text, expect_json)
+        await asyncio.sleep(self._delay(entry))
+        return self._result(entry, usage)
+
+    def stats(self):
+        with self._lock:
+            return {"cassette": self.path, "recorded_prompts": len(self._by_key), **self._counts,
+                    "drift": list(self._drift)}
+
+
+def backend_from_env(mode):
+    """The recording ("record") or replaying ("replay") backend configured by the environment."""
+    if mode == "replay":
+        return ReplayBackend.from_env()
+    if os.environ.get("TRAVEL_AI_RECORD_BACKEND", "gemini") == "fake":
+        import fake_llm
+        inner = fake_llm.FakeLLMBackend.from_env()
+    else:
+        inner = GeminiBackend()
+    return RecordingBackend(inner, os.environ["TRAVEL_AI_CASSETTE"])
+
+
+# --- Summary ---
+def summarize_cassette(path):
+    """Call count, distinct prompts, errors, malformed JSON responses and latency per cassette."""
+    entries = read_cassette(path)
+    malformed = 0
+    for entry in entries:
+        if entry["expect_json"] and entry["error"] is None:
+            try:
+                json.loads(clean_json_string(entry["response"]))
+            except (json.JSONDecodeError, TypeError):
+                malformed += 1
+    return {
+        "calls": len(entries),
+        "distinct_prompts": len({entry["key"] for entry in entries}),
+        "errors": sum(entry["error"] is not None for entry in entries),
+        "malformed_json": malformed,
+        "prompt_tokens": sum(entry["usage"].get("prompt_tokens", 0) for entry in entries),
+        "output_tokens": sum(entry["usage"].get("output_tokens", 0) for entry in entries),
+        "latency_ms": summarize_latencies([entry["latency_ms"] for entry in entries]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a recorded LLM cassette.")
+    parser.add_argument("cassette", help="Path to a .jsonl.gz cassette")
+    args = parser.parse_args()
+    print(json.dumps(summarize_cassette(args.cassette), indent=2))
@@ -0,0 +1,292 @@
+# entities.py
+"""
+Canonicalization index for city and attraction names.
+
+"Paris", "paris", "Paris, France", "Paris (France)" and "Pariss" all resolve to one
+entity with a stable canonical ID ("city:paris"), so the wizard offers one option per
+place, prompts list each place once, and widget keys and cache keys do not change
+with the spelling. Resolution order:
+
+    1. normalization   casefold, accents and punctuation removed, leading "the"
+                       dropped; for cities, a ", Country/Region" qualifier is split off
+                       and normalized through COUNTRY_ALIASES ("Österreich" == "Austria")
+    2. alias table     known alternative names (CITY_ALIASES, ATTRACTION_ALIASES)
+    3. curated names   KNOWN_CITIES and the alias targets
+    4. fuzzy lookup    trigram match against the curated names only; the best candidate
+                       with a Dice similarity of at least FUZZY_MATCH_THRESHOLD among
+                       names with as many words and at most FUZZY_MAX_LENGTH_DIFF
+                       characters more or fewer (typos only: "Central Park Zoo" is not
+                       "Central Park")
+    5. own key         any other name is its own entity, keyed by its normalized spelling
+
+A city qualifier that names the curated city's country is dropped ("Paris, France" is
+"Paris"). Any other qualifier, and any qualifier on a city that is not curated, is kept
+in the key ("Paris, Texas" is "city:paris-texas"), so an unqualified name never resolves
+to a qualified entity or the other way round.
+
+IDs and curated display names depend only on the name, never on what other sessions
+resolved before, so they are the same in every process. Names that are not curated
+are displayed as first spelled (title-cased if typed in lower case); spellings that
+share a key differ only in case, accents or punctuation. Attractions are resolved per
+city (the same name in two cities is two entities).
+"""
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+# Minimum trigram Dice similarity for a fuzzy match, and the shortest key it applies to
+# (short names differ by too few trigrams to compare reliably; aliases cover those).
+FUZZY_MATCH_THRESHOLD = 0.75
+FUZZY_MIN_LENGTH = 5
+
+# Fuzzy matches are limited to typo-sized differences: same word count, and at most this
+# many characters longer or shorter.
+FUZZY_MAX_LENGTH_DIFF = 2
+
+# Display names remembered per index for names that are not curated (they still get an ID).
+ENTITY_INDEX_MAX_ENTRIES = 50000
+
+# Curated cities (canonical display name -> country), the targets of fuzzy matching.
+KNOWN_CITIES = {
+    "Paris": "France", "Lyon": "France", "Nice": "France", "Marseille": "France",
+    "London": "United Kingdom", "Edinburgh": "United Kingdom", "Manchester": "United Kingdom",
+    "Rome": "Italy", "Florence": "Italy", "Venice": "Italy", "Naples": "Italy", "Milan": "Italy",
+    "Turin": "Italy", "Bologna": "Italy", "Madrid": "Spain", "Barcelona": "Spain", "Seville": "Spain",
+    "Valencia": "Spain", "Granada": "Spain", "Lisbon": "Portugal", "Porto": "Portugal",
+    "Berlin": "Germany", "Munich": "Germany", "Cologne": "Germany", "Hamburg": "Germany",
+    "Vienna": "Austria", "Salzburg": "Austria", "Prague": "Czech Republic", "Budapest": "Hungary",
+    "Amsterdam": "Netherlands", "The Hague": "Netherlands", "Brussels": "Belgium", "Bruges": "Belgium",
+    "Copenhagen": "Denmark", "Stockholm": "Sweden", "Oslo": "Norway", "Helsinki": "Finland",
+    "Zurich": "Switzerland", "Geneva": "Switzerland", "Dublin": "Ireland", "Athens": "Greece",
+    "Warsaw": "Poland", "Krakow": "Poland", "Istanbul": "Turkey", "New York": "United States",
+    "Los Angeles": "United States", "San Francisco": "United States", "Chicago": "United States",
+    "Boston": "United States", "Tokyo": "Japan", "Kyoto": "Japan", "Beijing": "China",
+    "Mumbai": "India", "Bangkok": "Thailand", "Ho Chi Minh City": "Vietnam", "Singapore": "Singapore",
+    "Sydney": "Australia", "Mexico City": "Mexico",
+}
+
+# Alternative name (normalized) -> canonical display name.
+CITY_ALIASES = {
+    "nyc": "New York", "new york city": "New York", "ny": "New York",
+    "la": "Los Angeles", "sf": "San Francisco", "san fran": "San Francisco",
+    "roma": "Rome", "firenze": "Florence", "venezia": "Venice", "napoli": "Naples",
+    "milano": "Milan", "torino": "Turin", "wien": "Vienna", "praha": "Prague",
+    "munchen": "Munich", "muenchen": "Munich", "koln": "Cologne", "lisboa": "Lisbon",
+    "sevilla": "Seville", "kobenhavn": "Copenhagen", "den haag": "The Hague",
+    "bruxelles": "Brussels", "brussel": "Brussels", "athina": "Athens", "warszawa": "Warsaw",
+    "krakow": "Krakow", "bombay": "Mumbai", "peking": "Beijing", "saigon": "Ho Chi Minh City",
+}
+ATTRACTION_ALIASES = {
+    "louvre": "Louvre Museum", "musee du louvre": "Louvre Museum",
+    "eiffel tower": "Eiffel Tower", "tour eiffel": "Eiffel Tower",
+    "colosseum": "Colosseum", "colosseo": "Colosseum", "coliseum": "Colosseum",
+    "sagrada familia": "Sagrada Familia", "la sagrada familia": "Sagrada Familia",
+    "british museum": "British Museum", "uffizi": "Uffizi Gallery", "galleria degli uffizi": "Uffizi Gallery",
+}
+
+# Country name or abbreviation (normalized) -> canonical country, for city qualifiers.
+COUNTRY_ALIASES = {
+    "uk": "United Kingdom", "u k": "United Kingdom", "gb": "United Kingdom", "great britain": "United Kingdom",
+    "britain": "United Kingdom", "england": "United Kingdom", "scotland": "United Kingdom",
+    "us": "United States", "u s": "United States", "usa": "United States", "u s a": "United States",
+    "united states of america": "United States", "america": "United States",
+    "osterreich": "Austria", "deutschland": "Germany", "espana": "Spain", "italia": "Italy",
+    "nederland": "Netherlands", "holland": "Netherlands", "czechia": "Czech Republic", "cesko": "Czech Republic",
+    "schweiz": "Switzerland", "suisse": "Switzerland", "svizzera": "Switzerland", "polska": "Poland",
+    "magyarorszag": "Hungary", "hellas": "Greece", "ellada": "Greece", "danmark": "Denmark",
+    "belgie": "Belgium", "belgique": "Belgium", "eire": "Ireland", "turkiye": "Turkey", "nippon": "Japan",
+}
+
+CITY = "city"
+ATTRACTION = "attraction"
+
+
+class Entity:
+    """A canonical place: stable ID plus the display name used in options and prompts."""
+    __slots__ = ("id", "name")
+
+    def __init__(self, entity_id, name):
+        self.id = entity_id
+        self.name = name
+
+    def __repr__(self):
+        return f"Entity({self.id!r}, {self.name!r})"
+
+
+# --- Normalization ---
+def normalize_name(text):
+    """Matching form of a name: casefolded, accents and punctuation removed, no leading "the"."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = " ".join(re.sub(r"[^\w\s]", " ", text).split())
+    return re.sub(r"^the\s+", "", text)
+
+def _split_city(name):
+    # "Paris, France" and "Paris (France)" -> ("Paris", "France"); "Paris" -> ("Paris", "").
+    parts = re.split(r"[,(]", str(name or ""), maxsplit=1)
+    return parts[0], (parts[1].strip(" )") if len(parts) > 1 else "")
+
+def _display_name(name):
+    name = " ".join(str(name).split())
+    return name.title() if name.islower() else name
+
+_COUNTRIES = {normalize_name(country): country for country in KNOWN_CITIES.values()}
+_COUNTRIES.update({alias: _COUNTRIES.get(normalize_name(country), country) for alias, country in COUNTRY_ALIASES.items()})
+
+def _region(text):
+    """(key, display name) of a city qualifier, through COUNTRY_ALIASES; ("", "") for none."""
+    key = normalize_name(text)
+    if not key:
+        return "", ""
+    country = _COUNTRIES.get(key)
+    if country is not None:
+        return normalize_name(country), country
+    return key, _display_name(text)
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _slug(key):
+    return key.replace(" ", "-")
+
+
+# --- Index ---
+class EntityIndex:
+    """
+    Thread-safe, process-wide index of one kind of entity, optionally scoped (e.g. per
+    city). `curated` maps the canonical display names aliases and fuzzy matches resolve to
+    onto their country (None for kinds without regions).
+    """
+    def __init__(self, kind, aliases, curated):
+        self.kind = kind
+        self._aliases = aliases
+        self._curated = {normalize_name(name): (name, country) for name, country in curated.items()}
+        self._grams = defaultdict(set) # trigram -> curated keys
+        for key in self._curated:
+            for gram in _trigrams(key):
+                self._grams[gram].add(key)
+        self._names = {} # (scope, key) -> display name of a name that is not curated
+        self._lock = threading.Lock()
+        self.stats = {"exact": 0, "alias": 0, "fuzzy": 0, "new": 0, "qualified": 0}
+
+    def _entity_id(self, scope, key):
+        return f"{self.kind}:{scope}/{_slug(key)}" if scope else f"{self.kind}:{_slug(key)}"
+
+    def _fuzzy(self, key):
+        grams = _trigrams(key)
+        words = len(key.split())
+        counts = defaultdict(int)
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                counts[candidate] += 1
+        counts = {candidate: shared for candidate, shared in counts.items()
+                  if len(candidate.split()) == words and abs(len(candidate) - len(key)) <= FUZZY_MAX_LENGTH_DIFF}
+        if not counts:
+            return None
+        score, best = max((2 * shared / (len(grams) + len(_trigrams(candidate))), candidate)
+                          for candidate, shared in counts.items())
+        return best if score >= FUZZY_MATCH_THRESHOLD else None
+
+    def canonical_key(self, name):
+        """
+        (key, curated display name or None, country or None, how it matched) for a name
+        without a qualifier. Needs no lock and registers nothing.
+        """
+        key = normalize_name(name)
+        alias = self._aliases.get(key)
+        if alias is not None:
+            key = normalize_name(alias)
+            curated = self._curated.get(key, (alias, None))
+            return key, curated[0], curated[1], "alias"
+        if key in self._curated:
+            return key, *self._curated[key], "exact"
+        if len(key) >= FUZZY_MIN_LENGTH and (match := self._fuzzy(key)) is not None:
+            return match, *self._curated[match], "fuzzy"
+        return key, None, None, "new"
+
+    @staticmethod
+    def _qualify(key, country, region_text):
+        # (key, region display or None): the qualifier is kept unless it names the curated city's country.
+        region_key, region_display = _region(region_text)
+        if region_key and (country is None or normalize_name(country) != region_key):
+            return f"{key} {region_key}", region_display
+        return key, None
+
+    def key_for(self, name, region_text=""):
+        """The entity key of `name` with its qualifier. Needs no lock and registers nothing."""
+        key, _, country, _ = self.canonical_key(name)
+        return self._qualify(key, country, region_text)[0]
+
+    def resolve(self, name, scope="", region_text=""):
+        """Returns the Entity for `name` (within `scope`, with an optional region qualifier)."""
+        base_key, display, country, how = self.canonical_key(name)
+        key, region_display = self._qualify(base_key, country, region_text)
+        if region_display:
+            how = "qualified"
+        with self._lock:
+            self.stats[how] += 1
+            if display is None:
+                # Not curated: the first spelling of the unqualified name is its display name.
+                display = self._names.get((scope, base_key))
+                if display is None:
+                    display = _display_name(name)
+                    if len(self._names) < ENTITY_INDEX_MAX_ENTRIES:
+                        self._names[(scope, base_key)] = display
+        if region_display:
+            display = f"{display}, {region_display}"
+        return Entity(self._entity_id(scope, key), display)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._names)
+
+
+_city_index = EntityIndex(CITY, CITY_ALIASES, KNOWN_CITIES)
+_attraction_index = EntityIndex(ATTRACTION, ATTRACTION_ALIASES,
+                                dict.fromkeys(set(ATTRACTION_ALIASES.values())))
+
+
+# --- Public helpers ---
+def city(name):
+    """The canonical Entity for a city name (optionally qualified: "Paris, Texas")."""
+    base, region = _split_city(name)
+    return _city_index.resolve(base if normalize_name(base) else name, region_text=region)
+
+def attraction(name, city_name=""):
+    """The canonical Entity for an attraction, scoped to its city."""
+    scope = city(city_name).id.split(":", 1)[1] if city_name else ""
+    return _attraction_index.resolve(name, scope)
+
+def city_id(name):
+    return city(name).id
+
+def city_key(name):
+    """
+    Normalized canonical city key, without registration, so it is the same in every
+    process (for keys that are persisted, e.g. the warm index).
+    """
+    base, region = _split_city(name)
+    return _city_index.key_for(base if normalize_name(base) else name, region)
+
+def unique_cities(names):
+    """Canonical display names of `names`, first occurrence wins, duplicates dropped."""
+    return list({entity.id: entity.name for entity in map(city, names)}.values())
+
+def unique_attractions(names, city_name=""):
+    return list({entity.id: entity.name for entity in (attraction(name, city_name) for name in names)}.values())
+
+def canonical_per_city(items_by_city):
+    """
+    Re-keys a {city name: [items]} mapping (e.g. an LLM response) by canonical city name,
+    merging the lists of spellings that name the same city.
+    """
+    merged = {}
+    for city_name, items in items_by_city.items():
+        merged.setdefault(city(city_name).name, []).extend(items)
+    return merged
+
+def get_entity_index_stats():
+    return {kind: {"names_remembered": len(index), **index.stats}
+            for kind, index in ((CITY, _city_index), (ATTRACTION, _attraction_index))}
@@ -0,0 +1,185 @@
+# fake_llm.py
+"""
+Offline stand-in for the Gemini API, for load tests and running the app without a key.
+
+FakeLLMBackend plugs into llm_handler (llm_handler.set_llm_backend, or
+TRAVEL_AI_LLM_BACKEND=fake) and answers every planner prompt with plausible,
+well-formed JSON after a configurable delay. The response is derived from the
+prompt (selected cities, attractions, trip length), so the whole wizard can be
+walked through. Like a streamed Gemini call, a fake call honours cancel_check, and
+it reports estimated token usage (token_budget.estimate_tokens) like usage_metadata.
+
+Environment variables read by FakeLLMBackend.from_env():
+    TRAVEL_AI_FAKE_LATENCY_MS       suggestion stages (default 800)
+    TRAVEL_AI_FAKE_PLAN_LATENCY_MS  itinerary and adjustment (default 3x the above)
+    TRAVEL_AI_FAKE_JITTER           +/- fraction of the latency (default 0.25)
+    TRAVEL_AI_FAKE_ERROR_RATE       share of calls that fail (default 0)
+"""
+import ast
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import token_budget
+from llm_handler import LLMCancelled, LLMError
+
+CITY_POOL = ["Lisbon", "Porto", "Seville", "Barcelona", "Rome", "Florence", "Vienna", "Prague",
+             "Budapest", "Krakow", "Amsterdam", "Copenhagen", "Edinburgh", "Dubrovnik", "Athens", "Kyoto"]
+TRIP_TYPE_POOL = ["Cultural City Exploration", "Relaxing Beach Getaway", "Food and Wine Tour",
+                  "Historical Heritage Trail", "Outdoor Adventure Trek", "Family Fun Holiday"]
+ATTRACTION_KINDS = ["Old Town Walk", "National Museum", "Cathedral", "Central Market", "Castle", "Botanical Garden"]
+RESTAURANT_KINDS = [("Bistro", "Local", "$$"), ("Trattoria", "Italian", "$$"), ("Seafood House", "Seafood", "$$$")]
+
+# How often the sleep is interrupted to check for cancellation.
+_CANCEL_POLL_S = 0.05
+
+
+def _pick(pool, seed_text, count):
+    """`count` distinct items from `pool`, deterministic for the same seed text."""
+    seed = int.from_bytes(hashlib.blake2b(seed_text.encode("utf-8"), digest_size=8).digest(), "little")
+    return random.Random(seed).sample(pool, min(count, len(pool)))
+
+def _field(prompt, label):
+    """The value after "- <label>:" in a prompt, or ""."""
+    match = re.search(rf"^- {re.escape(label)}:\s*(.*)$", prompt, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+def _city_list(prompt, label):
+    try:
+        cities = ast.literal_eval(_field(prompt, label))
+    except (ValueError, SyntaxError):
+        return []
+    return [str(city) for city in cities] if isinstance(cities, (list, tuple)) else []
+
+
+# --- Canned responses ---
+def _trip_types(prompt):
+    return [{"name": name, "explanation": f"A good fit for travelling from {_field(prompt, 'Starting destination')}."}
+            for name in _pick(TRIP_TYPE_POOL, prompt, 3)]
+
+def _cities(prompt):
+    trip_type = _field(prompt, "Confirmed trip type").strip('"')
+    return [{"city_name": city, "reason": f"Well suited to a '{trip_type}'."}
+            for city in _pick(CITY_POOL, prompt, 4)]
+
+def _attractions(prompt):
+    return {city: [{"attraction_name": f"{city} {kind}", "description": f"A highlight of {city}."}
+                   for kind in _pick(ATTRACTION_KINDS, city, 3)]
+            for city in _city_list(prompt, "Selected cities for the trip")}
+
+def _restaurants(prompt):
+    return {city: [{"restaurant_name": f"{city} {kind}", "cuisine_type": cuisine, "price_range": price,
+                    "description": f"Popular with visitors to {city}."}
+                   for kind, cuisine, price in RESTAURANT_KINDS[:2]]
+            for city in _city_list(prompt, "Selected cities for the trip")}
+
+def _itinerary(prompt):
+    num_days = int(re.search(r"Trip Duration: (\d+) days", prompt).group(1))
+    cities = _city_list(prompt, "Selected Cities") or ["Your destination"]
+    try:
+        attractions = json.loads(_field(prompt, "Selected Attractions per city"))
+    except json.JSONDecodeError:
+        attractions = {}
+    days = []
+    for i in range(num_days):
+        city = cities[i * len(cities) // num_days]
+        names = [a.get("attraction_name", "") for a in attractions.get(city, [])] or [f"Explore {city}"]
+        days.append({
+            "day_number": f"Day {i + 1}",
+            "location": city,
+            "morning_activity": names[(2 * i) % len(names)],
+            "afternoon_activity": names[(2 * i + 1) % len(names)],
+            "evening_meal": "Local dining exploration",
+            "notes": "",
+        })
+    return {"general_notes": "Generated offline by the fake LLM backend.", "itinerary_days": days}
+
+def _adjusted_plan(prompt):
+    plan = json.loads(prompt.split("(in JSON format):\n", 1)[1].split("\n\nThe user wants", 1)[0])
+    request = prompt.split("adjustment:\n", 1)[1].split("\n", 1)[0].strip('"')
+    plan["general_notes"] = f"{plan.get('general_notes', '')} Adjusted: {request}".strip()
+    return plan
+
+# (marker in the prompt, response builder, is a plan stage)
+_RESPONDERS = [
+    ("distinct types of trips", _trip_types, False),
+    ("additional cities", _cities, False),
+    ("relevant attractions", _attractions, False),
+    ("restaurant options", _restaurants, False),
+    ("Create a suggested day-by-day itinerary", _itinerary, True),
+    ("Here is the current travel plan", _adjusted_plan, True),
+]
+
+
+class FakeLLMBackend:
+    """LLM backend that answers planner prompts locally after a simulated delay."""
+    name = "fake"
+
+    def __init__(self, latency_s=0.8, plan_latency_s=None, jitter=0.25, error_rate=0.0, seed=None):
+        self.latency_s = latency_s
+        self.plan_latency_s = plan_latency_s if plan_latency_s is not None else 3 * latency_s
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls):
+        latency_ms = float(os.environ.get("TRAVEL_AI_FAKE_LATENCY_MS", 800))
+        plan_latency_ms = os.environ.get("TRAVEL_AI_FAKE_PLAN_LATENCY_MS")
+        return cls(latency_s=latency_ms / 1000,
+                   plan_latency_s=float(plan_latency_ms) / 1000 if plan_latency_ms else None,
+                   jitter=float(os.environ.get("TRAVEL_AI_FAKE_JITTER", 0.25)),
+                   error_rate=float(os.environ.get("TRAVEL_AI_FAKE_ERROR_RATE", 0)))
+
+    def configure(self):
+        pass # Nothing to configure; no API key needed
+
+    def _prepare(self, prompt_text):
+        """Returns (delay in seconds, response text), or raises LLMError for a simulated failure."""
+        for marker, respond, is_plan in _RESPONDERS:
+            if marker in prompt_text:
+                break
+        else:
+            respond, is_plan = (lambda prompt: "OK"), False
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            delay = (self.plan_latency_s if is_plan else self.latency_s) * (1 + self._random.uniform(-self.jitter, self.jitter))
+        if failed:
+            raise LLMError("Fake LLM backend: simulated failure.")
+        response = respond(prompt_text)
+        return max(delay, 0.0), response if isinstance(response, str) else json.dumps(response)
+
+    @staticmethod
+    def _fill_usage(usage, prompt_text, text, done=1.0):
+        if usage is not None:
+            usage["prompt_tokens"] = token_budget.estimate_tokens(prompt_text)
+            usage["output_tokens"] = int(token_budget.estimate_tokens(text) * done)
+
+    def generate(self, model_name, prompt_text, expect_json, route, cancel_check=None, usage=None):
+        delay, text = self._prepare(prompt_text)
+        started = time.monotonic()
+        deadline = started + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._fill_usage(usage, prompt_text, text)
+                return text
+            if cancel_check is not None and cancel_check():
+                # Like an abandoned stream: output generated so far is still billed
+                self._fill_usage(usage, prompt_text, text, done=1 - remaining / delay)
+                raise LLMCancelled("Gemini call cancelled.")
+            time.sleep(min(remaining, _CANCEL_POLL_S))
+
+    async def generate_async(self, model_name, prompt_text, expect_json, route, usage=None):
+        delay, text = self._prepare(prompt_text)
+        await asyncio.sleep(delay)
+        self._fill_usage(usage, prompt_text, text)
+        return text
@@ -0,0 +1,198 @@
+# job_runner.py
+"""
+Per-process background job runner for long LLM stages.
+
+Jobs run on a shared thread pool, keyed by (session id, stage), so the Streamlit
+script thread only polls for progress instead of blocking on the model. Each job
+has a deadline and a cancel flag that the job body checks cooperatively (the LLM
+call polls it while the response streams in), so work abandoned by "Back" or
+"Start Over" stops costing tokens and frees its worker thread. The deadline runs
+from when a worker picks the job up; until then the job reports "Queued".
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads shared by all sessions in the process. Jobs mostly wait on the LLM,
+# so size this for the number of concurrent itinerary/adjust jobs expected.
+JOB_WORKERS = int(os.environ.get("TRAVEL_AI_JOB_WORKERS", 8))
+
+# Finished jobs nobody collected are dropped after this many seconds.
+JOB_RETENTION_S = 600
+
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_TIMED_OUT = "timed_out"
+
+
+class JobCancelled(Exception):
+    """Raised by Job.check() inside a job body once the job is cancelled or past its deadline."""
+
+
+class Job:
+    """
+    A unit of background work. Read `status`, `progress`, `result`, `error` and
+    `notices` (user-facing notes about degraded results) from any thread.
+    """
+    def __init__(self, session_id, stage, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.stage = stage
+        self.status = JOB_RUNNING
+        self.progress = "Queued, waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.notices = []
+        self.timeout = timeout
+        self.submitted_at = time.monotonic()
+        self.started_at = None # Set when a worker picks the job up
+        self.finished_at = None
+        self.deadline = None
+        self._cancel_event = threading.Event()
+
+    def start(self):
+        """Marks the job as picked up by a worker; its deadline runs from here."""
+        self.started_at = time.monotonic()
+        if self.timeout:
+            self.deadline = self.started_at + self.timeout
+        self.progress = "Starting..."
+
+    @property
+    def elapsed(self):
+        """Seconds since submission, including time spent queued."""
+        return (self.finished_at or time.monotonic()) - self.submitted_at
+
+    @property
+    def run_time(self):
+        """Seconds since a worker picked the job up (0 while queued)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def is_running(self):
+        return self.status == JOB_RUNNING
+
+    def is_queued(self):
+        return self.status == JOB_RUNNING and self.started_at is None
+
+    def past_deadline(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def is_cancelled(self):
+        """True once the job was cancelled or ran past its deadline (usable as an LLM cancel_check)."""
+        return self._cancel_event.is_set() or self.past_deadline()
+
+    def check(self):
+        if self.is_cancelled():
+            raise JobCancelled(self.id)
+
+    def report(self, message):
+        self.progress = message
+
+    def cancel(self):
+        self._cancel_event.set()
+
+
+class JobRunner:
+    def __init__(self, max_workers=JOB_WORKERS, thread_name_prefix="travel-ai-job"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._jobs = {} # job id -> Job
+        self._by_key = {} # (session id, stage) -> job id
+        self._lock = threading.Lock()
+        self._counts = {JOB_DONE: 0, JOB_FAILED: 0, JOB_CANCELLED: 0, JOB_TIMED_OUT: 0}
+
+    def submit(self, session_id, stage, fn, *args, timeout=None, **kwargs):
+        """
+        Starts fn(job, *args, **kwargs) in the background and returns the Job.
+        Any job already running for the same session and stage is cancelled first.
+        The caller's context variables are carried into the worker thread.
+        """
+        job = Job(session_id, stage, timeout)
+        with self._lock:
+            self._prune()
+            previous = self._jobs.get(self._by_key.get((session_id, stage)))
+            if previous is not None:
+                previous.cancel()
+            self._jobs[job.id] = job
+            self._by_key[(session_id, stage)] = job.id
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check() # Cancelled while queued
+            job.start()
+            result = fn(job, *args, **kwargs)
+            job.check()
+            job.result = result
+            status = JOB_DONE
+        except Exception as e:
+            if job.is_cancelled():
+                status = JOB_TIMED_OUT if job.past_deadline() and not job._cancel_event.is_set() else JOB_CANCELLED
+            else:
+                job.error = e
+                status = JOB_FAILED
+        job.finished_at = time.monotonic()
+        job.status = status
+        with self._lock:
+            self._counts[status] += 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_for(self, session_id, stage):
+        """The latest job for a session and stage, or None."""
+        with self._lock:
+            return self._jobs.get(self._by_key.get((session_id, stage)))
+
+    def discard(self, job):
+        """Forgets a finished job once its result has been consumed."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if self._by_key.get((job.session_id, job.stage)) == job.id:
+                del self._by_key[(job.session_id, job.stage)]
+
+    def cancel(self, session_id, stages=None):
+        """Cancels and forgets the session's jobs (all of them, or only those for `stages`). Returns the count."""
+        with self._lock:
+            doomed = [job for job in self._jobs.values()
+                      if job.session_id == session_id and (stages is None or job.stage in stages)]
+        for job in doomed:
+            job.cancel()
+            self.discard(job)
+        return len(doomed)
+
+    def _prune(self):
+        # Caller holds the lock.
+        now = time.monotonic()
+        for job in [j for j in self._jobs.values() if j.finished_at and now - j.finished_at > JOB_RETENTION_S]:
+            self._jobs.pop(job.id, None)
+            if self._by_key.get((job.session_id, job.stage)) == job.id:
+                del self._by_key[(job.session_id, job.stage)]
+
+    def stats(self):
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.is_queued())
+            running = sum(1 for job in self._jobs.values() if job.is_running()) - queued
+            return {"workers": self.max_workers, "running": running, "queued": queued,
+                    "tracked": len(self._jobs), **self._counts}
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+def get_job_runner():
+    """The process-wide JobRunner, shared by all sessions."""
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner()
+        return _job_runner
@@ -2,6 +2,20 @@ import streamlit as st
 import google.generativeai as genai
 import json
 import re # For more robust JSON cleaning
+import os
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+import random
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager
+
+import token_budget
+from perf_utils import percentile
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 # Model name can be adjusted based on availability and desired capability/cost.
@@ -27,20 +41,174 @@ DEFAULT_GENERATION_CONFIG = genai.types.GenerationConfig(
     response_mime_type="application/json" # Crucial for asking for JSON output
 )
 
+# --- Per-stage Model Routing ---
+# Each planner stage (see planner.STAGE_*) maps to a primary model, a fallback chain,
+# a per-call timeout in seconds and a max_output_tokens cap. Small list-style stages
+# go to the lighter model; the itinerary stages get the full model and a large output
+# budget. "p95_threshold_s" is the rolling p95 latency above which the adaptive policy
+# moves the stage's traffic to the fastest healthy fallback.
+FAST_MODEL_NAME = "gemini-2.0-flash-lite"
+
+STAGE_ROUTES = {
+    "trip_types":  {"model": FAST_MODEL_NAME, "fallbacks": [DEFAULT_MODEL_NAME], "timeout": 20, "max_output_tokens": 1024, "p95_threshold_s": 6},
+    "cities":      {"model": FAST_MODEL_NAME, "fallbacks": [DEFAULT_MODEL_NAME], "timeout": 20, "max_output_tokens": 1024, "p95_threshold_s": 6},
+    "attractions": {"model": DEFAULT_MODEL_NAME, "fallbacks": [FAST_MODEL_NAME], "timeout": 30, "max_output_tokens": 2048, "p95_threshold_s": 10},
+    "restaurants": {"model": DEFAULT_MODEL_NAME, "fallbacks": [FAST_MODEL_NAME], "timeout": 30, "max_output_tokens": 2048, "p95_threshold_s": 10},
+    "itinerary":   {"model": DEFAULT_MODEL_NAME, "fallbacks": [FAST_MODEL_NAME], "timeout": 90, "max_output_tokens": 8192, "p95_threshold_s": 30},
+    "adjust":      {"model": DEFAULT_MODEL_NAME, "fallbacks": [FAST_MODEL_NAME], "timeout": 90, "max_output_tokens": 8192, "p95_threshold_s": 30},
+}
+
+# Adaptive policy: health is tracked per (stage, model) over the last ROUTING_WINDOW_SIZE
+# calls and only acted on once ROUTING_MIN_SAMPLES calls have been seen. While the primary
+# is degraded, ROUTING_PROBE_FRACTION of the traffic still goes to it so it can recover.
+ROUTING_WINDOW_SIZE = 50
+ROUTING_MIN_SAMPLES = 10
+ROUTING_ERROR_RATE_THRESHOLD = 0.25
+ROUTING_PROBE_FRACTION = 0.1
+
+# Maximum number of parsed responses kept in the process-wide response cache.
+# The cache is shared by the Streamlit app, the HTTP API and any other caller in
+# the same process, so repeated identical prompts (e.g. after "Back" and "Next")
+# are served without another API call.
+RESPONSE_CACHE_MAX_ENTRIES = 512
+
+# Cached responses are served as fresh for this many seconds. Older entries are
+# refetched, but are kept (until evicted) to be served as stale, flagged as degraded,
+# when the refetch fails or the circuit breaker is open. TRAVEL_AI_RESPONSE_CACHE_TTL_S=0
+# makes every call reach the backend (e.g. for replayed load tests).
+RESPONSE_CACHE_TTL_S = float(os.environ.get("TRAVEL_AI_RESPONSE_CACHE_TTL_S", 3600))
+
+# --- Circuit Breaker ---
+# The breaker opens when more than BREAKER_ERROR_RATE_THRESHOLD of the last
+# BREAKER_WINDOW_SIZE calls (at least BREAKER_MIN_CALLS) failed after exhausting
+# their fallback chain. Only transport/API errors (timeouts, 5xx, quota) count; an
+# unusable answer (LLMResponseError) does not. While open, calls fail fast with CircuitOpenError. After
+# BREAKER_OPEN_S it lets up to BREAKER_HALF_OPEN_MAX_PROBES calls through at a time
+# (half-open); BREAKER_CLOSE_AFTER_PROBES successes in a row close it again, and any
+# failed probe re-opens it.
+BREAKER_WINDOW_SIZE = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_ERROR_RATE_THRESHOLD = 0.5
+BREAKER_OPEN_S = 30
+BREAKER_HALF_OPEN_MAX_PROBES = 1
+BREAKER_CLOSE_AFTER_PROBES = 2
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class LLMError(Exception):
+    """
+    Raised by the UI-independent helpers when a Gemini call fails.
+    `raw_output` holds the cleaned model output when the failure was a JSON parse error.
+    """
+    def __init__(self, message, raw_output=None):
+        super().__init__(message)
+        self.raw_output = raw_output
+
+
+class LLMResponseError(LLMError):
+    """
+    Raised when the model answered but the answer is unusable (malformed or truncated
+    JSON, no candidates). Counts against the model in the routing health stats, but not
+    toward the circuit breaker, which tracks whether the service is reachable.
+    """
+
+
+class LLMCancelled(LLMError):
+    """Raised when a call is abandoned because its cancel_check returned True."""
+
+
+class BudgetExceededError(LLMError):
+    """Raised without calling the model once the session's or the process's token budget is spent."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the model while the circuit breaker is open."""
+    def __init__(self, message, retry_in_s=None):
+        super().__init__(message)
+        self.retry_in_s = retry_in_s
+
+
+# --- Response Cache ---
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _cache_key(prompt_text, cache_scope, expect_json):
+    digest = hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+    return (cache_scope, expect_json, digest)
+
+def get_cached_response(prompt_text, cache_scope=DEFAULT_MODEL_NAME, expect_json=True, max_age_s=RESPONSE_CACHE_TTL_S):
+    """
+    Returns the cached response for this prompt, or None if it is not cached or is
+    older than max_age_s (None accepts any age).
+    `cache_scope` is the model name for explicit-model calls or "stage:<name>" for routed calls.
+    """
+    key = _cache_key(prompt_text, cache_scope, expect_json)
+    with _response_cache_lock:
+        if key not in _response_cache:
+            return None
+        result, stored_at = _response_cache[key]
+        if max_age_s is not None and time.monotonic() - stored_at > max_age_s:
+            return None
+        _response_cache.move_to_end(key)
+        return result
+
+def _store_cached_response(prompt_text, cache_scope, expect_json, result):
+    key = _cache_key(prompt_text, cache_scope, expect_json)
+    with _response_cache_lock:
+        _response_cache[key] = (result, time.monotonic())
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+
+def clear_response_cache():
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
+# --- API Configuration ---
+_configured_api_key = None
+_configure_lock = threading.Lock()
+
+def get_api_key():
+    """
+    Returns the Gemini API key, preferring the GEMINI_API_KEY environment variable
+    (for headless deployments) over Streamlit secrets. Returns None if neither is set.
+    """
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if api_key:
+        return api_key
+    try:
+        return st.secrets["GEMINI_API_KEY"] or None
+    except Exception:
+        return None
+
+def ensure_gemini_configured():
+    """
+    Configures the Gemini API once per process without touching the Streamlit UI.
+    Raises LLMError if no API key is available.
+    """
+    global _configured_api_key
+    api_key = get_api_key()
+    if not api_key:
+        raise LLMError("GEMINI_API_KEY is not set. Add it to .streamlit/secrets.toml or the environment.")
+    with _configure_lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+
 def configure_gemini():
     """
-    Configures the Gemini API with the API key from Streamlit secrets.
+    Configures the LLM backend (for Gemini, the API key from Streamlit secrets).
     Returns True if configuration is successful, False otherwise.
     """
     try:
-        api_key = st.secrets["GEMINI_API_KEY"]
-        if not api_key:
-            st.error("GEMINI_API_KEY is not set in Streamlit secrets. Please add it to .streamlit/secrets.toml")
-            return False
-        genai.configure(api_key=api_key)
+        get_llm_backend().configure()
         return True
-    except KeyError:
-        st.error("GEMINI_API_KEY not found in Streamlit secrets. Please add it to .streamlit/secrets.toml")
+    except LLMError as e:
+        st.error(str(e))
         return False
     except Exception as e:
         st.error(f"An error occurred during Gemini configuration: {e}")
@@ -63,17 +231,631 @@ def clean_json_string(json_string):
 
     return cleaned_string
 
+# --- Routing State and Telemetry ---
+_routing_lock = threading.Lock()
+_model_health = {} # (stage, model) -> deque of (latency_s, ok)
+_routing_decisions = Counter() # (stage, model, reason) -> count
+_routing_failovers = Counter() # (stage, from_model, to_model) -> count
+_recent_routing_decisions = deque(maxlen=50)
+
+def _route_for(stage):
+    return STAGE_ROUTES.get(stage, {"model": DEFAULT_MODEL_NAME, "fallbacks": [], "timeout": None,
+                                    "max_output_tokens": None, "p95_threshold_s": None})
+
+def _record_model_call(stage, model_name, latency_s, ok):
+    with _routing_lock:
+        samples = _model_health.setdefault((stage, model_name), deque(maxlen=ROUTING_WINDOW_SIZE))
+        samples.append((latency_s, ok))
+
+def _model_stats(stage, model_name):
+    """Returns (sample count, p95 latency in seconds, error rate) for a stage/model pair."""
+    with _routing_lock:
+        samples = list(_model_health.get((stage, model_name), ()))
+    if not samples:
+        return 0, None, 0.0
+    latencies = [latency for latency, _ in samples]
+    errors = sum(1 for _, ok in samples if not ok)
+    return len(samples), percentile(latencies, 95), errors / len(samples)
+
+def _degraded_reason(stage, model_name, route):
+    """Returns "p95_latency" or "error_rate" if the model is unhealthy for this stage, else None."""
+    count, p95, error_rate = _model_stats(stage, model_name)
+    if count < ROUTING_MIN_SAMPLES:
+        return None
+    if error_rate > ROUTING_ERROR_RATE_THRESHOLD:
+        return "error_rate"
+    if route.get("p95_threshold_s") and p95 > route["p95_threshold_s"]:
+        return "p95_latency"
+    return None
+
+def choose_models(stage=None, model_name=None):
+    """
+    Picks the ordered list of models to try for a call, applying the adaptive policy.
+
+    Returns:
+        tuple: (list of model names, primary first, reason string for telemetry).
+    """
+    if model_name:
+        return [model_name], "explicit"
+    route = _route_for(stage)
+    chain = [route["model"], *route["fallbacks"]]
+    reason = _degraded_reason(stage, route["model"], route)
+    if reason is None:
+        return chain, "primary"
+    if random.random() < ROUTING_PROBE_FRACTION:
+        return chain, f"probe:{reason}"
+
+    healthy = [m for m in route["fallbacks"] if _degraded_reason(stage, m, route) is None]
+    if not healthy:
+        return chain, f"primary:all_degraded:{reason}"
+    fastest = min(healthy, key=lambda m: _model_stats(stage, m)[1] or 0.0)
+    return [fastest] + [m for m in chain if m != fastest], f"adaptive:{reason}"
+
+def _record_routing_decision(stage, chosen_model, reason, attempted):
+    with _routing_lock:
+        _routing_decisions[(stage, chosen_model, reason)] += 1
+        for failed_model in attempted[:-1]:
+            _routing_failovers[(stage, failed_model, attempted[-1])] += 1
+        _recent_routing_decisions.append({
+            "time": time.time(), "stage": stage, "model": chosen_model,
+            "reason": reason, "attempted": list(attempted)
+        })
+    if len(attempted) > 1 or reason not in ("primary", "explicit"):
+        logger.info("Routing %s -> %s (%s, attempted %s)", stage, chosen_model, reason, attempted)
+
+def get_routing_telemetry():
+    """
+    Returns a JSON-serializable snapshot of routing state: per stage/model health
+    (calls, p95 latency, error rate), decision counts by reason, failovers and the
+    most recent decisions.
+    """
+    with _routing_lock:
+        health_keys = list(_model_health)
+        decisions = dict(_routing_decisions)
+        failovers = dict(_routing_failovers)
+        recent = list(_recent_routing_decisions)
+    health = {}
+    for stage, model_name in health_keys:
+        count, p95, error_rate = _model_stats(stage, model_name)
+        health.setdefault(str(stage), {})[model_name] = {
+            "calls": count,
+            "p95_s": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(error_rate, 3),
+        }
+    return {
+        "health": health,
+        "decisions": [{"stage": st_, "model": m, "reason": r, "count": c} for (st_, m, r), c in decisions.items()],
+        "failovers": [{"stage": st_, "from": a, "to": b, "count": c} for (st_, a, b), c in failovers.items()],
+        "recent": recent,
+    }
+
+def reset_routing_state():
+    with _routing_lock:
+        _model_health.clear()
+        _routing_decisions.clear()
+        _routing_failovers.clear()
+        _recent_routing_decisions.clear()
+
+
+# --- Circuit Breaker ---
+class CircuitBreaker:
+    """Error-rate circuit breaker shared by every LLM call in the process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = CIRCUIT_CLOSED
+        self._outcomes = deque(maxlen=BREAKER_WINDOW_SIZE) # True = ok
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._transitions = Counter() # (from, to) -> count
+        self._recent_transitions = deque(maxlen=20)
+        self._rejected = 0
+        self._stale_served = 0
+
+    def _transition(self, new_state, reason):
+        # Caller holds the lock.
+        self._transitions[(self.state, new_state)] += 1
+        self._recent_transitions.append({"time": time.time(), "from": self.state, "to": new_state, "reason": reason})
+        logger.warning("Circuit breaker %s -> %s (%s)", self.state, new_state, reason)
+        self.state = new_state
+        if new_state == CIRCUIT_OPEN:
+            self._opened_at = time.monotonic()
+        elif new_state == CIRCUIT_HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def retry_in_s(self):
+        if self.state != CIRCUIT_OPEN:
+            return 0.0
+        return max(0.0, BREAKER_OPEN_S - (time.monotonic() - self._opened_at))
+
+    def acquire(self):
+        """
+        Asks to make a call. Returns a ticket (CIRCUIT_CLOSED, or CIRCUIT_HALF_OPEN for a
+        probe) to pass to release(), or raises CircuitOpenError to fail fast.
+        """
+        with self._lock:
+            if self.state == CIRCUIT_OPEN and self.retry_in_s() <= 0:
+                self._transition(CIRCUIT_HALF_OPEN, f"open for {BREAKER_OPEN_S}s")
+            if self.state == CIRCUIT_CLOSED:
+                return CIRCUIT_CLOSED
+            if self.state == CIRCUIT_HALF_OPEN and self._probes_in_flight < BREAKER_HALF_OPEN_MAX_PROBES:
+                self._probes_in_flight += 1
+                return CIRCUIT_HALF_OPEN
+            self._rejected += 1
+            retry_in_s = self.retry_in_s()
+        raise CircuitOpenError(f"The AI service is temporarily unavailable (circuit breaker open); "
+                               f"retrying in about {max(retry_in_s, 1):.0f}s.", retry_in_s=retry_in_s)
+
+    def release(self, ticket, ok):
+        """Records the outcome of a call admitted by acquire(). ok=None (cancelled) records nothing."""
+        with self._lock:
+            if ticket == CIRCUIT_HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if self.state != CIRCUIT_HALF_OPEN or ok is None:
+                    return
+                if not ok:
+                    self._transition(CIRCUIT_OPEN, "half-open probe failed")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= BREAKER_CLOSE_AFTER_PROBES:
+                    self._transition(CIRCUIT_CLOSED, f"{self._probe_successes} probes succeeded")
+                return
+            if ok is None or self.state != CIRCUIT_CLOSED:
+                return
+            self._outcomes.append(ok)
+            errors = self._outcomes.count(False)
+            if len(self._outcomes) >= BREAKER_MIN_CALLS and errors / len(self._outcomes) > BREAKER_ERROR_RATE_THRESHOLD:
+                self._transition(CIRCUIT_OPEN, f"error rate {errors}/{len(self._outcomes)}")
+
+    def record_stale_served(self):
+        with self._lock:
+            self._stale_served += 1
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "error_rate": round(self._outcomes.count(False) / calls, 3) if calls else 0.0,
+                "calls_in_window": calls,
+                "retry_in_s": round(self.retry_in_s(), 1),
+                "rejected": self._rejected,
+                "stale_served": self._stale_served,
+                "transitions": [{"from": a, "to": b, "count": c} for (a, b), c in self._transitions.items()],
+                "recent_transitions": list(self._recent_transitions),
+            }
+
+_circuit_breaker = CircuitBreaker()
+
+def get_circuit_breaker_state():
+    """CIRCUIT_CLOSED, CIRCUIT_OPEN or CIRCUIT_HALF_OPEN."""
+    return _circuit_breaker.state
+
+def get_circuit_breaker_stats():
+    """JSON-serializable breaker state, error rate, rejections and transition counts."""
+    return _circuit_breaker.snapshot()
+
+def reset_circuit_breaker():
+    global _circuit_breaker
+    _circuit_breaker = CircuitBreaker()
+
+
+# --- Degraded Responses ---
+# Callers that want to know whether they were served degraded results (stale cache
+# entries, fallbacks) wrap their calls in collect_degraded_notes(). The notes list is
+# shared with contexts copied from it, e.g. background jobs submitted inside the block.
+_degraded_notes = contextvars.ContextVar("degraded_notes", default=None)
+
+@contextmanager
+def collect_degraded_notes():
+    """
+    Yields a list that receives a short, user-facing note for every degraded result
+    served inside the block. Notes also reach an enclosing collector.
+    """
+    outer = _degraded_notes.get()
+    notes = []
+    token = _degraded_notes.set(notes)
+    try:
+        yield notes
+    finally:
+        _degraded_notes.reset(token)
+        if outer is not None:
+            outer.extend(notes)
+
+def note_degraded(message):
+    """Records a degraded-result note in the active collector, if any."""
+    notes = _degraded_notes.get()
+    if notes is not None and message not in notes:
+        notes.append(message)
+
+def _serve_stale_or_raise(prompt_text, scope, expect_json, use_cache, error):
+    """Returns the stale cached response for the prompt (noting it as degraded), or raises `error`."""
+    stale = get_cached_response(prompt_text, scope, expect_json, max_age_s=None) if use_cache else None
+    if stale is None:
+        raise error
+    if isinstance(error, BudgetExceededError):
+        note_degraded("Your AI usage limit has been reached; showing earlier (cached) results.")
+    else:
+        _circuit_breaker.record_stale_served()
+        note_degraded("The AI service is unavailable; showing earlier (cached) results.")
+    logger.warning("Serving stale cached response: %s", error)
+    return stale
+
+def _check_budget():
+    """Raises BudgetExceededError if the current session or the process may not call the model."""
+    if token_budget.admit_call() == token_budget.LEVEL_REFUSED:
+        raise BudgetExceededError("The AI usage limit has been reached; only saved and local results are available for now.")
+
+def _record_usage(stage, usage, prompt_text, generated_text):
+    """
+    Charges a model call to the token budget. `usage` is filled in by the backend from the
+    API's usage metadata; without it, a successful call is charged an estimate.
+    """
+    if usage:
+        token_budget.record_usage(usage.get("prompt_tokens", 0), usage.get("output_tokens", 0), stage)
+    elif generated_text is not None:
+        token_budget.record_usage(token_budget.estimate_tokens(prompt_text),
+                                  token_budget.estimate_tokens(generated_text), stage)
+
+
+# --- Model Calls ---
+def _generation_config(expect_json, max_output_tokens):
+    if not max_output_tokens:
+        return DEFAULT_GENERATION_CONFIG if expect_json else None # Only set mime type if expecting JSON
+    return genai.types.GenerationConfig(
+        max_output_tokens=max_output_tokens,
+        response_mime_type="application/json" if expect_json else None
+    )
+
+def _build_model(model_name, expect_json, max_output_tokens=None):
+    return genai.GenerativeModel(
+        model_name,
+        safety_settings=DEFAULT_SAFETY_SETTINGS,
+        generation_config=_generation_config(expect_json, max_output_tokens)
+    )
+
+def _request_options(timeout):
+    return {"timeout": timeout} if timeout else None
+
+def _fill_usage(usage, response):
+    """Copies a response's usage_metadata token counts into `usage` (if given)."""
+    if usage is None:
+        return
+    try:
+        metadata = response.usage_metadata
+    except Exception:
+        return # Not available (e.g. a stream abandoned before any chunk)
+    if metadata:
+        usage["prompt_tokens"] = metadata.prompt_token_count or 0
+        usage["output_tokens"] = metadata.candidates_token_count or 0
+
+def _response_text(response):
+    """
+    The generated text of a Gemini response. Raises LLMResponseError if there is none: no
+    candidates (blocked prompt), or a candidate without parts (stopped for SAFETY,
+    RECITATION, MAX_TOKENS, ...), where `response.text` itself would raise ValueError.
+    """
+    if not response.candidates:
+        message = "Gemini API returned no candidates in the response."
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
+            message += f" Prompt Feedback: {response.prompt_feedback}"
+        raise LLMResponseError(message)
+    candidate = response.candidates[0]
+    finish_reason = getattr(candidate.finish_reason, "name", candidate.finish_reason)
+    content = getattr(candidate, "content", None)
+    if not content or not content.parts:
+        raise LLMResponseError(f"Gemini API returned an empty response (finish reason: {finish_reason}).")
+    try:
+        return response.text
+    except ValueError as e:
+        raise LLMResponseError(f"Gemini API response has no usable text (finish reason: {finish_reason}): {e}") from e
+
+
+# --- LLM Backends ---
+# A backend turns (model name, prompt) into response text. Routing, fallbacks, caching
+# and JSON parsing stay in generate_response / generate_response_async, so a stand-in
+# backend (fake_llm.py for offline runs and load tests) exercises the same code paths.
+class GeminiBackend:
+    """Calls the Gemini API. The default backend."""
+    name = "gemini"
+
+    def configure(self):
+        ensure_gemini_configured()
+
+    def generate(self, model_name, prompt_text, expect_json, route, cancel_check=None, usage=None):
+        """
+        Calls one model synchronously. With a cancel_check, the response is streamed and
+        the call is abandoned (LLMCancelled) as soon as cancel_check() returns True, so a
+        cancelled job stops consuming output tokens.
+        Token counts from the response's usage_metadata are stored in the `usage` dict.
+        """
+        model = _build_model(model_name, expect_json, route["max_output_tokens"])
+        request_options = _request_options(route["timeout"])
+        if cancel_check is None:
+            response = model.generate_content(prompt_text, request_options=request_options)
+            _fill_usage(usage, response)
+            return _response_text(response)
+
+        response = model.generate_content(prompt_text, stream=True, request_options=request_options)
+        try:
+            for _ in response:
+                if cancel_check():
+                    raise LLMCancelled("Gemini call cancelled.")
+        finally:
+            _fill_usage(usage, response) # Tokens streamed before a cancel are billed too
+        return _response_text(response)
+
+    async def generate_async(self, model_name, prompt_text, expect_json, route, usage=None):
+        model = _build_model(model_name, expect_json, route["max_output_tokens"])
+        response = await model.generate_content_async(prompt_text, request_options=_request_options(route["timeout"]))
+        _fill_usage(usage, response)
+        return _response_text(response)
+
+
+# Set TRAVEL_AI_LLM_BACKEND=fake to run the app and the API fully offline (see fake_llm.py),
+# or to record/replay to capture real traffic to a cassette and serve it back (see cassettes.py).
+LLM_BACKEND = os.environ.get("TRAVEL_AI_LLM_BACKEND", "gemini")
+
+_llm_backend = None
+_llm_backend_lock = threading.Lock()
+
+def get_llm_backend():
+    """The process-wide LLM backend, created on first use from LLM_BACKEND."""
+    global _llm_backend
+    with _llm_backend_lock:
+        if _llm_backend is None:
+            if LLM_BACKEND == "fake":
+                import fake_llm # Imported lazily; only needed for offline runs
+                _llm_backend = fake_llm.FakeLLMBackend.from_env()
+            elif LLM_BACKEND in ("record", "replay"):
+                import cassettes
+                _llm_backend = cassettes.backend_from_env(LLM_BACKEND)
+            else:
+                _llm_backend = GeminiBackend()
+        return _llm_backend
+
+def set_llm_backend(backend):
+    """
+    Replaces the process-wide LLM backend (e.g. with fake_llm.FakeLLMBackend).
+    Passing None restores the default on next use. Returns the previous backend.
+    """
+    global _llm_backend
+    with _llm_backend_lock:
+        previous, _llm_backend = _llm_backend, backend
+    return previous
+
+def get_llm_backend_stats():
+    """Name of the active backend plus its own stats, if it keeps any (e.g. cassette replay)."""
+    backend = get_llm_backend()
+    stats = backend.stats() if hasattr(backend, "stats") else {}
+    return {"name": backend.name, **stats}
+
+def _cache_scope(model_name, stage):
+    # Routed calls are cached per stage, since the model that answers may change between calls.
+    if model_name:
+        return model_name
+    return f"stage:{stage}" if stage else DEFAULT_MODEL_NAME
+
+def _process_response(generated_text, expect_json):
+    """
+    Turns the generated text into parsed JSON (or text).
+    Raises LLMResponseError if the JSON cannot be parsed.
+    """
+    if not expect_json:
+        return generated_text # Return raw text if not expecting JSON
+
+    cleaned_text = clean_json_string(generated_text)
+    try:
+        return json.loads(cleaned_text)
+    except json.JSONDecodeError as e:
+        raise LLMResponseError(f"LLM did not return valid JSON after cleaning. Error: {e}", raw_output=cleaned_text)
+
+def _breaker_outcome(error):
+    # Unusable answers prove the service is up; only transport/API errors count as failures.
+    return None if isinstance(error, LLMResponseError) else False
+
+def generate_response(prompt_text: str,
+                      model_name: str = None,
+                      expect_json: bool = True,
+                      use_cache: bool = True,
+                      stage: str = None,
+                      cancel_check=None):
+    """
+    UI-independent version of get_gemini_response.
+
+    Args:
+        model_name (str): Forces a specific model. If None, the model is chosen from
+                          STAGE_ROUTES for `stage` (DEFAULT_MODEL_NAME when stage is None)
+                          and the route's fallback chain is tried on failure.
+        stage (str): The planner stage the prompt belongs to, used for routing.
+        cancel_check (callable): Optional; polled while the response streams in.
+                                 Returning True abandons the call (see job_runner.py).
+
+    Returns:
+        str or dict or list: The processed response from Gemini.
+
+        If every model fails, the circuit breaker is open or the token budget (see
+        token_budget.py) is spent, an expired cached response
+        for the prompt is returned instead when there is one (noted via note_degraded).
+
+    Raises:
+        LLMCancelled: If cancel_check asked for the call to stop.
+        CircuitOpenError: If the circuit breaker is open and nothing is cached.
+        BudgetExceededError: If the token budget is spent and nothing is cached.
+        LLMError: If the API is not configured, or every model in the chain fails.
+    """
+    scope = _cache_scope(model_name, stage)
+    if use_cache:
+        cached = get_cached_response(prompt_text, scope, expect_json)
+        if cached is not None:
+            return cached
+
+    backend = get_llm_backend()
+    backend.configure()
+    try:
+        _check_budget()
+        ticket = _circuit_breaker.acquire()
+    except (BudgetExceededError, CircuitOpenError) as e:
+        return _serve_stale_or_raise(prompt_text, scope, expect_json, use_cache, e)
+    try:
+        result = _call_models(backend, prompt_text, model_name, expect_json, stage, cancel_check)
+    except LLMCancelled:
+        _circuit_breaker.release(ticket, ok=None)
+        raise
+    except LLMError as e:
+        _circuit_breaker.release(ticket, ok=_breaker_outcome(e))
+        return _serve_stale_or_raise(prompt_text, scope, expect_json, use_cache, e)
+    except BaseException:
+        _circuit_breaker.release(ticket, ok=None) # e.g. KeyboardInterrupt; says nothing about the service
+        raise
+    _circuit_breaker.release(ticket, ok=True)
+    if use_cache:
+        _store_cached_response(prompt_text, scope, expect_json, result)
+    return result
+
+def _call_models(backend, prompt_text, model_name, expect_json, stage, cancel_check):
+    """
+    Tries the routed model chain. Returns the processed response or raises the last
+    LLMError (the last LLMResponseError, if any model answered).
+    """
+    route = _route_for(stage)
+    models, reason = choose_models(stage, model_name)
+    attempted = []
+    last_error = None
+    for candidate in models:
+        if cancel_check is not None and cancel_check():
+            raise LLMCancelled("Gemini call cancelled.")
+        attempted.append(candidate)
+        started = time.perf_counter()
+        usage = {}
+        generated_text = None
+        try:
+            try:
+                generated_text = backend.generate(candidate, prompt_text, expect_json, route, cancel_check, usage=usage)
+            except LLMError:
+                raise # Includes LLMCancelled
+            except Exception as e:
+                raise LLMError(f"Error communicating with Gemini API: {e}") from e
+            finally:
+                _record_usage(stage, usage, prompt_text, generated_text)
+            result = _process_response(generated_text, expect_json)
+        except LLMCancelled:
+            raise # Not the model's fault; keep it out of the health stats
+        except LLMError as e:
+            _record_model_call(stage, candidate, time.perf_counter() - started, ok=False)
+            if not isinstance(last_error, LLMResponseError):
+                last_error = e # An unusable answer from any model shows the service is up
+            continue
+        _record_model_call(stage, candidate, time.perf_counter() - started, ok=True)
+        _record_routing_decision(stage, candidate, reason, attempted)
+        return result
+
+    _record_routing_decision(stage, None, reason, attempted)
+    raise last_error
+
+async def generate_response_async(prompt_text: str,
+                                  model_name: str = None,
+                                  expect_json: bool = True,
+                                  use_cache: bool = True,
+                                  stage: str = None):
+    """
+    Non-blocking version of generate_response for asyncio callers (e.g. the HTTP API).
+    Shares the response cache, routing state and circuit breaker with the synchronous path.
+
+    Raises:
+        CircuitOpenError: If the circuit breaker is open and nothing is cached.
+        BudgetExceededError: If the token budget is spent and nothing is cached.
+        LLMError: If the API is not configured, or every model in the chain fails.
+    """
+    scope = _cache_scope(model_name, stage)
+    if use_cache:
+        cached = get_cached_response(prompt_text, scope, expect_json)
+        if cached is not None:
+            return cached
+
+    backend = get_llm_backend()
+    backend.configure()
+    try:
+        _check_budget()
+        ticket = _circuit_breaker.acquire()
+    except (BudgetExceededError, CircuitOpenError) as e:
+        return _serve_stale_or_raise(prompt_text, scope, expect_json, use_cache, e)
+    try:
+        result = await _call_models_async(backend, prompt_text, model_name, expect_json, stage)
+    except LLMError as e:
+        _circuit_breaker.release(ticket, ok=_breaker_outcome(e))
+        return _serve_stale_or_raise(prompt_text, scope, expect_json, use_cache, e)
+    except BaseException:
+        _circuit_breaker.release(ticket, ok=None) # Task cancelled; says nothing about the service
+        raise
+    _circuit_breaker.release(ticket, ok=True)
+    if use_cache:
+        _store_cached_response(prompt_text, scope, expect_json, result)
+    return result
+
+async def _call_models_async(backend, prompt_text, model_name, expect_json, stage):
+    route = _route_for(stage)
+    models, reason = choose_models(stage, model_name)
+    attempted = []
+    last_error = None
+    for candidate in models:
+        attempted.append(candidate)
+        started = time.perf_counter()
+        usage = {}
+        generated_text = None
+        try:
+            try:
+                generated_text = await backend.generate_async(candidate, prompt_text, expect_json, route, usage=usage)
+            except LLMError:
+                raise
+            except Exception as e:
+                raise LLMError(f"Error communicating with Gemini API: {e}") from e
+            finally:
+                _record_usage(stage, usage, prompt_text, generated_text)
+            result = _process_response(generated_text, expect_json)
+        except LLMError as e:
+            _record_model_call(stage, candidate, time.perf_counter() - started, ok=False)
+            if not isinstance(last_error, LLMResponseError):
+                last_error = e # An unusable answer from any model shows the service is up
+            continue
+        _record_model_call(stage, candidate, time.perf_counter() - started, ok=True)
+        _record_routing_decision(stage, candidate, reason, attempted)
+        return result
+
+    _record_routing_decision(stage, None, reason, attempted)
+    raise last_error
+
+async def get_gemini_response_async(prompt_text: str,
+                                    model_name: str = None,
+                                    expect_json: bool = True,
+                                    stage: str = None):
+    """
+    Async counterpart of get_gemini_response for headless callers: logs failures
+    instead of reporting them in the Streamlit UI, and returns None on error.
+    """
+    try:
+        return await generate_response_async(prompt_text, model_name=model_name, expect_json=expect_json, stage=stage)
+    except LLMError as e:
+        logger.warning("Gemini call failed: %s", e)
+        return None
+
 def get_gemini_response(prompt_text: str,
-                        model_name: str = DEFAULT_MODEL_NAME,
-                        expect_json: bool = True):
+                        model_name: str = None,
+                        expect_json: bool = True,
+                        stage: str = None):
     """
     Sends a prompt to the Gemini API and returns the response.
 
     Args:
         prompt_text (str): The prompt to send to the LLM.
-        model_name (str): The Gemini model to use.
+        model_name (str): The Gemini model to use. If None, the model is routed by `stage`
+                          (see STAGE_ROUTES), falling back to DEFAULT_MODEL_NAME.
         expect_json (bool): If True, sets response_mime_type to application/json
                             and attempts to parse the response as JSON.
+        stage (str): The planner stage the prompt belongs to (e.g. "cities"), used for routing.
 
     Returns:
         str or dict or list: The processed response from Gemini (parsed JSON if expect_json is True and successful),
@@ -83,46 +865,15 @@ def get_gemini_response(prompt_text: str,
         return None
 
     try:
-        model = genai.GenerativeModel(
-            model_name,
-            safety_settings=DEFAULT_SAFETY_SETTINGS,
-            generation_config=DEFAULT_GENERATION_CONFIG if expect_json else None # Only set mime type if expecting JSON
-        )
-
-        # Log the prompt being sent (optional, for debugging)
-        # st.write("--- DEBUG: Sending Prompt to Gemini ---")
-        # st.text(prompt_text)
-        # st.write("--- END DEBUG ---")
-
-        response = model.generate_content(prompt_text)
-
-        if response.candidates:
-            generated_text = response.text
-            # st.write("--- DEBUG: Raw LLM Output ---") # For debugging
-            # st.text(generated_text)
-            # st.write("--- END DEBUG ---")
-
-            if expect_json:
-                cleaned_text = clean_json_string(generated_text)
-                try:
-                    return json.loads(cleaned_text)
-                except json.JSONDecodeError as e:
-                    st.error(f"LLM did not return valid JSON after cleaning. Error: {e}")
-                    st.caption("Cleaned LLM output that failed to parse:")
-                    st.code(cleaned_text, language="text")
-                    return None
-            else:
-                return generated_text # Return raw text if not expecting JSON
-        else:
-            st.warning("Gemini API returned no candidates in the response.")
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                st.warning(f"Prompt Feedback: {response.prompt_feedback}")
-            return None
-
-    except Exception as e:
-        st.error(f"Error communicating with Gemini API: {e}")
-        # Consider more detailed logging for production if needed
-        # print(f"Full Gemini API error details: {e}")
+        return generate_response(prompt_text, model_name=model_name, expect_json=expect_json, stage=stage)
+    except (CircuitOpenError, BudgetExceededError) as e:
+        st.warning(str(e))
+        return None
+    except LLMError as e:
+        st.error(str(e))
+        if e.raw_output is not None:
+            st.caption("Cleaned LLM output that failed to parse:")
+            st.code(e.raw_output, language="text")
         return None
 
 if __name__ == "__main__":
@@ -0,0 +1,492 @@
+# load_test.py
+"""
+Concurrent-session load test for the Streamlit app, fully offline.
+
+Starts `streamlit run app.py` with the fake LLM backend (fake_llm.py, configurable
+latency) and simulates N users walking through the wizard (inputs, trip type,
+cities, attractions, restaurants, plan, one adjustment) with randomized think
+times between actions. Each simulated user is a minimal browser client speaking
+Streamlit's websocket protocol, so every click is a real script rerun on the
+server process being measured. The user count is ramped up step by step; for each
+step the report gives throughput, rerun latency percentiles, the server's peak
+thread count and memory, and the first step that saturates the server is reported
+as the saturation point.
+
+To compare versions on real model output instead, record a cassette once (needs a
+Gemini key) and replay it offline (see cassettes.py). Recording and replaying walk a
+fixed pool of origins (CASSETTE_ORIGINS) with pinned trip dates, so every replayed
+prompt was recorded: a recording walks each origin once, a replay cycles through them
+with the server's response cache off. Replays are strict by default: a prompt missing
+from the cassette fails its call (and so the walk) instead of being answered with the
+closest recording, and is listed under "prompt_drift" in the report:
+
+    python load_test.py --users 1 --step-seconds 1800 --record run.jsonl.gz
+    python load_test.py --users 1,2,4,8 --replay run.jsonl.gz --replay-latency
+
+Usage:
+    python load_test.py --users 1,2,4,8,16 --step-seconds 60 --latency-ms 800 --think-time 2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from perf_utils import summarize_latencies
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# A step is saturated when throughput grows by less than this share of the user increase
+# (e.g. doubling users yields under 1.5x the walks), or p95 of the interactive reruns
+# (those that do not wait for the LLM) exceeds the SLO.
+SATURATION_SCALING_THRESHOLD = 0.5
+DEFAULT_P95_SLO_MS = 1000.0
+INTERACTIVE_ACTIONS = {"load", "select_cities", "select_attractions", "restaurant_stage", "select_restaurants"}
+
+# How long one interaction may take, including reruns while a background job is polled.
+RERUN_TIMEOUT_S = 300
+SERVER_START_TIMEOUT_S = 60
+
+# Origins and trip dates (as sent by the date widgets) walked when recording or replaying
+# a cassette. Replayed prompts must match recorded ones exactly, so neither may depend
+# on the user, the step or the day of the run.
+CASSETTE_ORIGINS = ["Lisbon", "Madrid", "Paris", "Amsterdam", "Berlin", "Vienna", "Prague", "Rome",
+                    "Athens", "Copenhagen", "Dublin", "Edinburgh"]
+CASSETTE_TRIP_DATES = ("2030/06/01", "2030/06/07")
+
+# Values of ForwardMsg.ScriptFinishedStatus.
+_FINISHED_EARLY_FOR_RERUN = 2
+
+
+class WalkFailed(Exception):
+    """A simulated user could not complete the wizard (script exception or missing widget)."""
+
+
+# --- Server process ---
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port, latency_ms, plan_latency_ms=None, jitter=0.25, error_rate=0.0,
+                 record=None, replay=None, replay_latency=False, replay_strict=True, drift_log=None):
+    """
+    Starts the app on `port` with the fake LLM backend, or recording to / replaying from
+    a cassette (see cassettes.py) with the response cache off. Returns the Popen.
+    """
+    env = {**os.environ,
+           "TRAVEL_AI_LLM_BACKEND": "fake",
+           "TRAVEL_AI_FAKE_LATENCY_MS": str(latency_ms),
+           "TRAVEL_AI_FAKE_JITTER": str(jitter),
+           "TRAVEL_AI_FAKE_ERROR_RATE": str(error_rate)}
+    if plan_latency_ms is not None:
+        env["TRAVEL_AI_FAKE_PLAN_LATENCY_MS"] = str(plan_latency_ms)
+    if record:
+        env.update(TRAVEL_AI_LLM_BACKEND="record", TRAVEL_AI_CASSETTE=os.path.abspath(record),
+                   TRAVEL_AI_RESPONSE_CACHE_TTL_S="0")
+    elif replay:
+        env.update(TRAVEL_AI_LLM_BACKEND="replay", TRAVEL_AI_CASSETTE=os.path.abspath(replay),
+                   TRAVEL_AI_REPLAY_LATENCY="1" if replay_latency else "0",
+                   TRAVEL_AI_REPLAY_STRICT="1" if replay_strict else "0",
+                   TRAVEL_AI_RESPONSE_CACHE_TTL_S="0")
+        if drift_log:
+            env["TRAVEL_AI_CASSETTE_DRIFT_LOG"] = drift_log
+    return subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+         "--server.port", str(port), "--server.address", "127.0.0.1", "--browser.gatherUsageStats", "false"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_for_server(base_url, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Streamlit server exited with code {process.returncode}")
+            try:
+                async with http.get(f"{base_url}/_stcore/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError("Streamlit server did not become healthy in time")
+
+async def warm_up(base_url):
+    """One untimed page load, so module imports on the first script run do not count as load."""
+    async with aiohttp.ClientSession() as http:
+        async with StreamlitSession(http, base_url) as session:
+            await session.rerun()
+
+def process_usage(pid):
+    """(thread count, RSS bytes) of a process from /proc, or (None, None) where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+async def sample_usage(pid, peaks, stop, interval_s=0.2):
+    """Records the peak thread count and RSS of `pid` into `peaks` until `stop` is set."""
+    while not stop.is_set():
+        threads, rss = process_usage(pid)
+        if threads is not None:
+            peaks["threads"] = max(peaks.get("threads", 0), threads)
+            peaks["rss_bytes"] = max(peaks.get("rss_bytes", 0), rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- Simulated browser session ---
+class StreamlitSession:
+    """
+    A minimal Streamlit browser client: sends reruns with widget states over the
+    websocket and keeps the elements of the last completed script run.
+    """
+    def __init__(self, http, base_url):
+        self._http = http
+        self._url = base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self._ws = None
+        self._widget_values = {} # widget id -> (value field, value); sent on every rerun like the browser
+        self.elements = [] # (element type, element proto) of the last run, in delivery order
+
+    async def __aenter__(self):
+        self._ws = await self._http.ws_connect(self._url, protocols=("streamlit",), max_msg_size=0)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    async def rerun(self, values=None, trigger=None, timeout=RERUN_TIMEOUT_S):
+        """
+        Sets widget values ({widget id: (field, value)}), optionally fires a button trigger,
+        and waits until the script (including any st.rerun() chain) has finished.
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        self._widget_values.update(values or {})
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = ""
+        for widget_id, (field, value) in self._widget_values.items():
+            state = message.rerun_script.widget_states.widgets.add(id=widget_id)
+            if field == "string_array_value":
+                state.string_array_value.data.extend(value)
+            else:
+                setattr(state, field, value)
+        if trigger:
+            message.rerun_script.widget_states.widgets.add(id=trigger, trigger_value=True)
+        await self._ws.send_bytes(message.SerializeToString())
+        await asyncio.wait_for(self._receive_run(), timeout)
+
+    async def _receive_run(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        elements = {}
+        while True:
+            raw = await self._ws.receive()
+            if raw.type != aiohttp.WSMsgType.BINARY:
+                raise WalkFailed(f"Websocket closed ({raw.type.name})")
+            msg = ForwardMsg()
+            msg.ParseFromString(raw.data)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                elements = {}
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element_type = msg.delta.new_element.WhichOneof("type")
+                element = getattr(msg.delta.new_element, element_type)
+                if element_type == "exception":
+                    raise WalkFailed(f"{element.type}: {element.message}")
+                elements[tuple(msg.metadata.delta_path)] = (element_type, element)
+            elif kind == "script_finished" and msg.script_finished != _FINISHED_EARLY_FOR_RERUN:
+                self.elements = list(elements.values())
+                return
+
+    def widgets(self, element_type, label_part=""):
+        return [element for kind, element in self.elements
+                if kind == element_type and label_part in getattr(element, "label", "")]
+
+    def widget(self, element_type, label_part):
+        found = self.widgets(element_type, label_part)
+        if not found:
+            raise WalkFailed(f"No {element_type} labelled '{label_part}'")
+        return found[0]
+
+
+# --- Simulated users ---
+class StepResults:
+    """Rerun latencies and walk outcomes for one step (updated from a single event loop)."""
+    def __init__(self):
+        self.latencies_ms = defaultdict(list)
+        self.walks = 0
+        self.failures = []
+
+
+class VirtualUser:
+    """One simulated planner: walks the wizard in a fresh browser session until the step ends."""
+    def __init__(self, user_id, http, base_url, think_time_s, deadline, results, rng, origins, trip_dates=None):
+        self.user_id = user_id
+        self.http = http
+        self.base_url = base_url
+        self.think_time_s = think_time_s
+        self.deadline = deadline
+        self.results = results
+        self.rng = rng
+        self.origins = origins # Shared by all users of the run
+        self.trip_dates = trip_dates # (start, end) to set instead of the app's defaults
+        self.walks = 0
+
+    async def _think(self):
+        if self.think_time_s > 0:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.think_time_s)
+
+    async def _act(self, session, action, values=None, trigger_label=None):
+        """Thinks, then performs one interaction and records its latency."""
+        await self._think()
+        trigger = session.widget("button", trigger_label).id if trigger_label else None
+        started = time.perf_counter()
+        await session.rerun(values, trigger)
+        self.results.latencies_ms[action].append((time.perf_counter() - started) * 1000)
+
+    async def walk(self, origin_name):
+        async with StreamlitSession(self.http, self.base_url) as session:
+            started = time.perf_counter()
+            await session.rerun()
+            self.results.latencies_ms["load"].append((time.perf_counter() - started) * 1000)
+
+            # With the fake backend, origins are unique across the whole run (all users and
+            # steps), so the server's process-wide response cache does not turn later walks
+            # into cache hits. Cassette runs reuse a fixed pool with the cache off instead.
+            inputs = {session.widget("text_input", "Starting Destination").id: ("string_value", origin_name)}
+            if self.trip_dates:
+                for label, value in zip(("Trip Start Date", "Trip End Date"), self.trip_dates):
+                    inputs[session.widget("date_input", label).id] = ("string_array_value", [value])
+            await self._act(session, "trip_types", inputs, trigger_label="Next Step")
+            await self._act(session, "cities", trigger_label="Suggest Cities")
+
+            cities = session.widget("multiselect", "Select the cities")
+            await self._act(session, "select_cities", {cities.id: ("string_array_value", list(cities.options[:2]))})
+            await self._act(session, "attractions", trigger_label="Suggest Attractions")
+
+            attractions = {w.id: ("string_array_value", list(w.options[:2]))
+                           for w in session.widgets("multiselect", "Select attractions")}
+            await self._act(session, "select_attractions", attractions)
+            await self._act(session, "restaurant_stage", trigger_label="Restaurant Options")
+
+            include = session.widget("checkbox", "restaurant")
+            await self._act(session, "restaurants", {include.id: ("bool_value", True)})
+            restaurants = {w.id: ("string_array_value", list(w.options[:1]))
+                           for w in session.widgets("multiselect", "Select restaurants")}
+            await self._act(session, "select_restaurants", restaurants)
+            await self._act(session, "itinerary", trigger_label="Generate Travel Plan")
+            if not session.widgets("button", "Adjust Plan"):
+                raise WalkFailed("No travel plan was generated")
+
+            adjustment = session.widget("text_area", "What would you like to change")
+            await self._act(session, "adjust", {adjustment.id: ("string_value", "Make day 2 more relaxing")},
+                            trigger_label="Adjust Plan")
+
+    async def run(self):
+        while time.monotonic() < self.deadline:
+            origin_name = next(self.origins, None)
+            if origin_name is None:
+                break # A recording has walked every origin
+            try:
+                await self.walk(origin_name)
+                self.walks += 1
+                self.results.walks += 1
+            except (WalkFailed, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.results.failures.append(f"user {self.user_id}: {type(e).__name__}: {e}")
+                await asyncio.sleep(max(self.think_time_s, 0.5))
+
+
+# --- Steps ---
+async def run_step(base_url, server_pid, users, step_seconds, think_time_s, origins, trip_dates=None, seed=None):
+    """
+    Runs `users` simulated users for step_seconds (plus the time to finish their last walk).
+    `origins` yields the starting destination of each walk; the step also ends when it is
+    exhausted. `trip_dates` optionally pins the trip dates.
+    """
+    results = StepResults()
+    rng = random.Random(seed)
+    peaks = {}
+    stop_sampling = asyncio.Event()
+    sampler = asyncio.create_task(sample_usage(server_pid, peaks, stop_sampling))
+
+    started = time.monotonic()
+    deadline = started + step_seconds
+    async with aiohttp.ClientSession() as http:
+        virtual_users = [VirtualUser(i, http, base_url, think_time_s, deadline, results, random.Random(rng.random()),
+                                     origins, trip_dates)
+                         for i in range(users)]
+        tasks = []
+        for user in virtual_users:
+            tasks.append(asyncio.create_task(user.run()))
+            await asyncio.sleep(min(think_time_s, 1.0) / users) # Stagger arrivals
+        await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    stop_sampling.set()
+    await sampler
+
+    all_latencies = [value for values in results.latencies_ms.values() for value in values]
+    interactive = [value for action, values in results.latencies_ms.items() if action in INTERACTIVE_ACTIONS
+                   for value in values]
+    return {
+        "users": users,
+        "elapsed_s": round(elapsed, 1),
+        "walks": results.walks,
+        "failed_walks": len(results.failures),
+        "walks_per_minute": round(results.walks / elapsed * 60, 2),
+        "reruns_per_second": round(len(all_latencies) / elapsed, 2),
+        "rerun_latency_ms": summarize_latencies(all_latencies),
+        "interactive_latency_ms": summarize_latencies(interactive),
+        "latency_ms_by_action": {action: summarize_latencies(values) for action, values in results.latencies_ms.items()},
+        "server_peak_threads": peaks.get("threads"),
+        "server_peak_rss_mb": round(peaks["rss_bytes"] / 2**20, 1) if peaks.get("rss_bytes") else None,
+        "failures": results.failures[:10],
+    }
+
+def find_saturation(steps, p95_slo_ms=DEFAULT_P95_SLO_MS):
+    """
+    Returns {"users": ..., "reason": ...} for the first saturated step, or None if every
+    step scaled. A step is saturated if walks fail, the p95 of interactive reruns exceeds
+    the SLO, or throughput stops scaling with the number of users.
+    """
+    previous = None
+    for step in steps:
+        interactive_p95 = step["interactive_latency_ms"].get("p95", 0.0)
+        if step["failed_walks"]:
+            return {"users": step["users"], "reason": f"{step['failed_walks']} failed walks"}
+        if interactive_p95 > p95_slo_ms:
+            return {"users": step["users"], "reason": f"interactive p95 {interactive_p95} ms > {p95_slo_ms} ms"}
+        if previous and previous["walks_per_minute"] > 0:
+            expected_gain = step["users"] / previous["users"] - 1
+            actual_gain = step["walks_per_minute"] / previous["walks_per_minute"] - 1
+            if expected_gain > 0 and actual_gain < SATURATION_SCALING_THRESHOLD * expected_gain:
+                return {"users": step["users"],
+                        "reason": f"throughput grew {actual_gain:.0%} for {expected_gain:.0%} more users"}
+        previous = step
+    return None
+
+async def run_load_test(user_steps, step_seconds=60, think_time_s=2.0, latency_ms=800, plan_latency_ms=None,
+                        jitter=0.25, error_rate=0.0, p95_slo_ms=DEFAULT_P95_SLO_MS, seed=None,
+                        stop_at_saturation=True, port=None, record=None, replay=None, replay_latency=False,
+                        replay_strict=True):
+    """
+    Starts the app with the fake LLM backend (or recording to `record` / replaying
+    `replay`, cassette paths) and ramps through user_steps (e.g. [1, 2, 4, 8]).
+    A recording walks each of CASSETTE_ORIGINS once; a replay cycles through them.
+
+    Returns:
+        dict: The configuration, one report per step, the saturation point (None if the
+              server kept scaling up to the last step), the largest user count that
+              did not saturate it and, when replaying, the prompts missing from the cassette.
+    """
+    port = port or _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    drift_log = None
+    if replay:
+        fd, drift_log = tempfile.mkstemp(prefix="travel-ai-drift-", suffix=".jsonl")
+        os.close(fd)
+    server = start_server(port, latency_ms, plan_latency_ms, jitter, error_rate,
+                          record=record, replay=replay, replay_latency=replay_latency,
+                          replay_strict=replay_strict, drift_log=drift_log)
+    trip_dates = None
+    if record:
+        origins, trip_dates = iter(CASSETTE_ORIGINS), CASSETTE_TRIP_DATES
+    elif replay:
+        origins, trip_dates = itertools.cycle(CASSETTE_ORIGINS), CASSETTE_TRIP_DATES
+    else:
+        origins = (f"Testville {n}" for n in itertools.count())
+    steps = []
+    saturation = None
+    try:
+        await wait_for_server(base_url, server)
+        await warm_up(base_url)
+        for users in user_steps:
+            step = await run_step(base_url, server.pid, users, step_seconds, think_time_s, origins, trip_dates,
+                                  seed=seed)
+            steps.append(step)
+            print(f"[load-test] {users:>4} users: {step['walks_per_minute']:>7} walks/min, "
+                  f"{step['reruns_per_second']:>6} reruns/s, interactive p95 {step['interactive_latency_ms'].get('p95')} ms, "
+                  f"{step['server_peak_threads']} threads, {step['server_peak_rss_mb']} MB, "
+                  f"{step['failed_walks']} failed", file=sys.stderr)
+            saturation = find_saturation(steps, p95_slo_ms)
+            if saturation and stop_at_saturation:
+                break
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    prompt_drift = None
+    if drift_log:
+        with open(drift_log, encoding="utf-8") as f:
+            prompt_drift = [json.loads(line) for line in f if line.strip()]
+        os.remove(drift_log)
+
+    if saturation is None:
+        max_sustained_users = steps[-1]["users"] if steps else None
+    else:
+        max_sustained_users = max((s["users"] for s in steps if s["users"] < saturation["users"]), default=0)
+    if record or replay:
+        llm = {"record": record} if record else {"replay": replay, "replay_latency": replay_latency,
+                                                 "replay_strict": replay_strict}
+        llm.update(origins=len(CASSETTE_ORIGINS), trip_dates=list(CASSETTE_TRIP_DATES))
+    else:
+        llm = {"fake": True, "latency_ms": latency_ms, "jitter": jitter, "error_rate": error_rate,
+               "plan_latency_ms": plan_latency_ms if plan_latency_ms is not None else 3 * latency_ms}
+    report = {
+        "config": {"step_seconds": step_seconds, "think_time_s": think_time_s, "p95_slo_ms": p95_slo_ms, "llm": llm},
+        "steps": steps,
+        "saturation": saturation,
+        "max_sustained_users": max_sustained_users,
+    }
+    if prompt_drift is not None:
+        report["prompt_drift"] = {"count": len(prompt_drift), "prompts": prompt_drift}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with simulated concurrent users (offline).")
+    parser.add_argument("--users", default="1,2,4,8,16", help="Comma-separated user counts to ramp through")
+    parser.add_argument("--step-seconds", type=float, default=60, help="How long each step keeps starting new walks")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds a user waits between actions")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Fake LLM latency for suggestion stages")
+    parser.add_argument("--plan-latency-ms", type=float, help="Fake LLM latency for plan generation (default 3x)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Fake LLM latency jitter (+/- fraction)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake LLM calls that fail")
+    parser.add_argument("--p95-slo-ms", type=float, default=DEFAULT_P95_SLO_MS, help="p95 target for interactive reruns")
+    parser.add_argument("--seed", type=int, help="Random seed for think times")
+    parser.add_argument("--port", type=int, help="Port for the app server (default: a free port)")
+    parser.add_argument("--keep-going", action="store_true", help="Run every step even after saturation")
+    parser.add_argument("--report", help="Optional path to write the JSON report to")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="Use the real Gemini API and record its traffic to CASSETTE")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="Replay model responses from CASSETTE instead of the fake backend")
+    parser.add_argument("--replay-latency", action="store_true", help="With --replay, wait the recorded latencies")
+    parser.add_argument("--replay-lenient", action="store_true",
+                        help="With --replay, answer prompts missing from the cassette with the closest recording")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(
+        [int(n) for n in args.users.split(",") if n.strip()], step_seconds=args.step_seconds,
+        think_time_s=args.think_time, latency_ms=args.latency_ms, plan_latency_ms=args.plan_latency_ms,
+        jitter=args.jitter, error_rate=args.error_rate, p95_slo_ms=args.p95_slo_ms, seed=args.seed,
+        stop_at_saturation=not args.keep_going, port=args.port,
+        record=args.record, replay=args.replay, replay_latency=args.replay_latency,
+        replay_strict=not args.replay_lenient))
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
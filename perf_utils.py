@@ -0,0 +1,28 @@
+# perf_utils.py
+"""
+Small helpers for latency statistics shared by the batch, routing and load-test tools.
+"""
+
+def percentile(values, pct):
+    """
+    Returns the pct-th percentile (0-100) of `values` using linear interpolation,
+    or None if `values` is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize_latencies(values):
+    """Returns count, mean and p50/p90/p95/p99 for a list of latencies (rounded to 0.1)."""
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean": round(sum(values) / len(values), 1)}
+    for pct in (50, 90, 95, 99):
+        summary[f"p{pct}"] = round(percentile(values, pct), 1)
+    return summary
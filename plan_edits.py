@@ -0,0 +1,227 @@
+# plan_edits.py
+"""
+Local fast path for simple, structural plan adjustments.
+
+Recognizes a small set of mechanical edits in the "Adjust Your Plan" text and applies
+them directly to `itinerary_days`, without an ADJUST_PLAN_PROMPT round trip:
+
+    swap day 2 and 3              (also "swap day 2 with day 3")
+    remove the Louvre             (optionally "... from day 2")
+    move dinner at X to day 4     (optionally "... to day 4 afternoon")
+    add a free afternoon on day 5 (morning / afternoon / evening / day)
+
+Anything that does not match one of these patterns exactly, or whose target cannot be
+found unambiguously in the plan (in exactly one slot, holding little more than the
+target), returns None so the caller falls through to the LLM.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+from perf_utils import summarize_latencies
+
+ACTIVITY_SLOTS = ("morning_activity", "afternoon_activity", "evening_meal")
+SLOT_WORDS = {
+    "morning": ("morning_activity",),
+    "afternoon": ("afternoon_activity",),
+    "evening": ("evening_meal",),
+    "night": ("evening_meal",),
+    "day": ("morning_activity", "afternoon_activity"),
+}
+FREE_SLOT_TEXT = {
+    "morning_activity": "Free morning",
+    "afternoon_activity": "Free afternoon",
+    "evening_meal": "Free evening – local dining exploration",
+}
+
+# Leading words that describe an activity rather than name it ("dinner at X", "the visit to Y").
+_TARGET_PREFIX = re.compile(r"^(?:the\s+)?(?:(?:visit|trip|tour)\s+(?:to|of)\s+|(?:dinner|lunch|breakfast|meal)\s+at\s+)?(?:the\s+)?")
+
+# Words a slot may contain besides the target for the edit to still take the whole slot
+# ("Visit the Louvre" is just the Louvre; "Louvre, then the Tuileries Garden" is not).
+_FILLER_WORDS = {"a", "an", "the", "to", "of", "at", "in", "visit", "visiting", "explore", "exploring",
+                 "tour", "trip", "see", "dinner", "lunch", "breakfast", "meal"}
+
+_DAY = r"day\s*(\d+)"
+_INTENTS = []
+
+
+class PlanEdit:
+    """A locally applied edit: the new plan and the positions of the days it changed."""
+    __slots__ = ("kind", "description", "plan", "day_updates")
+
+    def __init__(self, kind, description, plan, day_updates):
+        self.kind = kind
+        self.description = description
+        self.plan = plan
+        self.day_updates = day_updates
+
+
+def _intent(pattern):
+    def register(handler):
+        _INTENTS.append((re.compile(pattern), handler))
+        return handler
+    return register
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^\w\s'&-]", " ", str(text or "").casefold()).split())
+
+def _day_index(days, day_number):
+    """Position of "Day N" in the plan (by its label, else by position), or None."""
+    for i, day in enumerate(days):
+        match = re.search(r"\bday\s*(\d+)\b", str(day.get("day_number", "")), re.IGNORECASE)
+        if match and int(match.group(1)) == day_number:
+            return i
+    if 1 <= day_number <= len(days):
+        return day_number - 1
+    return None
+
+def _target_pattern(target):
+    target = _TARGET_PREFIX.sub("", _normalize(target)).strip()
+    return re.compile(rf"(?<!\w){re.escape(target)}(?!\w)") if len(target) >= 3 else None
+
+def _find_target(days, target, day_filter=None):
+    """All (day index, slot) pairs whose text mentions `target` as whole words."""
+    pattern = _target_pattern(target)
+    if pattern is None:
+        return []
+    matches = []
+    for i, day in enumerate(days):
+        if day_filter is not None and i != day_filter:
+            continue
+        for slot in ACTIVITY_SLOTS:
+            if pattern.search(_normalize(day.get(slot, ""))):
+                matches.append((i, slot))
+    return matches
+
+def _find_single_target(days, target, day_filter=None):
+    """
+    The one (day index, slot) mentioning `target`, or None if there is no match, more than
+    one, or the slot holds more than the target (editing it would drop the rest).
+    """
+    matches = _find_target(days, target, day_filter)
+    if len(matches) != 1:
+        return None
+    i, slot = matches[0]
+    rest = _target_pattern(target).sub(" ", _normalize(days[i][slot])).split()
+    return matches[0] if set(rest) <= _FILLER_WORDS else None
+
+
+# --- Intents ---
+# Each handler takes the day list and the regex match, and returns {day index: new day}
+# plus a short description, or None if the edit cannot be applied confidently.
+@_intent(rf"^(?:please\s+)?swap\s+{_DAY}\s+(?:and|with)\s+(?:day\s*)?(\d+)$")
+def _swap_days(days, match):
+    first, second = _day_index(days, int(match.group(1))), _day_index(days, int(match.group(2)))
+    if first is None or second is None or first == second:
+        return None
+    new_first = {**days[second], "day_number": days[first].get("day_number")}
+    new_second = {**days[first], "day_number": days[second].get("day_number")}
+    return {first: new_first, second: new_second}, f"Swapped {days[first].get('day_number')} and {days[second].get('day_number')}"
+
+@_intent(rf"^(?:please\s+)?(?:remove|delete|drop|skip|cancel)\s+(.+?)(?:\s+(?:from|on)\s+{_DAY})?$")
+def _remove_activity(days, match):
+    day_filter = None
+    if match.group(2):
+        day_filter = _day_index(days, int(match.group(2)))
+        if day_filter is None:
+            return None
+    target = _find_single_target(days, match.group(1), day_filter)
+    if target is None:
+        return None
+    i, slot = target
+    removed = days[i][slot]
+    return {i: {**days[i], slot: FREE_SLOT_TEXT[slot]}}, f"Removed {removed}"
+
+@_intent(rf"^(?:please\s+)?move\s+(.+?)\s+to\s+{_DAY}(?:\s+(?:in\s+the\s+)?(morning|afternoon|evening|night))?$")
+def _move_activity(days, match):
+    target = _find_single_target(days, match.group(1))
+    destination = _day_index(days, int(match.group(2)))
+    if target is None or destination is None:
+        return None
+    source, source_slot = target
+    destination_slot = SLOT_WORDS[match.group(3)][0] if match.group(3) else source_slot
+    if (source, source_slot) == (destination, destination_slot):
+        return None
+    moved, displaced = days[source][source_slot], days[destination].get(destination_slot)
+    displaced_is_free = not displaced or displaced in FREE_SLOT_TEXT.values()
+    # An occupied destination slot is swapped into the freed slot, but only within the
+    # same location; anything else needs the LLM to re-plan.
+    if not displaced_is_free and days[source].get("location") != days[destination].get("location"):
+        return None
+    updates = {source: dict(days[source])}
+    updates.setdefault(destination, dict(days[destination]))
+    updates[source][source_slot] = FREE_SLOT_TEXT[source_slot] if displaced_is_free else displaced
+    updates[destination][destination_slot] = moved
+    return updates, f"Moved {moved} to {days[destination].get('day_number')}"
+
+@_intent(rf"^(?:please\s+)?(?:add|make|give\s+me|i\s+want)\s+(?:a\s+|an\s+)?free\s+(morning|afternoon|evening|night|day)\s+(?:on|for)\s+{_DAY}$")
+def _add_free_time(days, match):
+    index = _day_index(days, int(match.group(2)))
+    if index is None:
+        return None
+    day = dict(days[index])
+    displaced = []
+    for slot in SLOT_WORDS[match.group(1)]:
+        current = day.get(slot)
+        if current and current not in FREE_SLOT_TEXT.values():
+            displaced.append(str(current))
+        day[slot] = FREE_SLOT_TEXT[slot]
+    description = f"Added a free {match.group(1)} on {days[index].get('day_number')}"
+    if displaced:
+        # Kept in the day's notes rather than silently dropped, so it can be fitted back in.
+        moved = "; ".join(displaced)
+        day["notes"] = " ".join(filter(None, [str(day.get("notes") or "").strip(), f"Skipped for free time: {moved}."]))
+        description += f" (moved {moved} to the day's notes)"
+    return {index: day}, description
+
+
+# --- Fast path stats ---
+_stats_lock = threading.Lock()
+_fast_path_stats = {"requests": 0, "applied": 0, "fallthrough": 0}
+_fast_path_latencies_ms = deque(maxlen=1000)
+
+def get_fast_path_stats():
+    """Coverage (share of adjustment requests handled locally) and local parse/apply latency."""
+    with _stats_lock:
+        stats = dict(_fast_path_stats)
+        latencies = list(_fast_path_latencies_ms)
+    stats["coverage"] = round(stats["applied"] / stats["requests"], 3) if stats["requests"] else None
+    stats["latency_ms"] = summarize_latencies(latencies)
+    return stats
+
+
+def try_local_edit(plan, request):
+    """
+    Applies `request` to `plan` locally if it is one of the supported structural edits.
+
+    Returns:
+        PlanEdit, or None if the request should go to the LLM instead.
+        The input plan is not modified.
+    """
+    started = time.perf_counter()
+    edit = None
+    days = plan.get("itinerary_days") if isinstance(plan, dict) else None
+    if not isinstance(days, list) or not all(isinstance(day, dict) for day in days):
+        days = None  # Not a plan this module can edit; let the LLM deal with it.
+    text = _normalize(request).rstrip(".")
+    if days:
+        for pattern, handler in _INTENTS:
+            match = pattern.match(text)
+            if not match:
+                continue
+            outcome = handler(days, match)
+            if outcome is not None:
+                day_updates, description = outcome
+                new_days = list(days)
+                for index, day in day_updates.items():
+                    new_days[index] = day
+                edit = PlanEdit(handler.__name__.strip("_"), description, {**plan, "itinerary_days": new_days}, day_updates)
+            break
+
+    with _stats_lock:
+        _fast_path_stats["requests"] += 1
+        _fast_path_stats["applied" if edit else "fallthrough"] += 1
+        _fast_path_latencies_ms.append((time.perf_counter() - started) * 1000)
+    return edit
@@ -0,0 +1,189 @@
+# plan_history.py
+"""
+Version history for a session's travel plan.
+
+Each version is an immutable tuple of frozen day objects. A new version reuses the
+day objects of its predecessor wherever the day is unchanged (also when days were
+only reordered), so N versions of a D-day plan cost roughly D + (changed days) day
+objects rather than N * D. Every version records which day positions changed relative
+to its parent, so undo/redo is O(1) and a diff between two versions only looks at the
+positions that actually changed.
+"""
+from types import MappingProxyType
+
+# Maximum number of versions kept per session; the oldest are dropped first.
+PLAN_HISTORY_MAX_VERSIONS = 20
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+def _day_key(day):
+    """Hashable content key used to find an identical day in the previous version."""
+    return repr(sorted(day.items())) if isinstance(day, dict) else repr(day)
+
+
+class PlanVersion:
+    """One immutable plan version. `changed` holds the day positions that differ from the parent."""
+    __slots__ = ("general_notes", "days", "changed", "label", "extra")
+
+    def __init__(self, general_notes, days, changed, label, extra):
+        self.general_notes = general_notes
+        self.days = days
+        self.changed = changed
+        self.label = label
+        self.extra = extra
+
+    def to_plan(self):
+        """Returns a plain, mutable plan dict (the travel_plan_raw format)."""
+        plan = _thaw(self.extra)
+        plan["general_notes"] = self.general_notes
+        plan["itinerary_days"] = [_thaw(day) for day in self.days]
+        return plan
+
+
+class PlanHistory:
+    """
+    Bounded undo/redo history of plan versions with structural sharing of unchanged days.
+    """
+    def __init__(self, max_versions=PLAN_HISTORY_MAX_VERSIONS):
+        self.max_versions = max_versions
+        self._versions = []
+        self._cursor = -1
+
+    def __len__(self):
+        return len(self._versions)
+
+    @property
+    def current(self):
+        return self._versions[self._cursor] if self._versions else None
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    def labels(self):
+        return [version.label for version in self._versions]
+
+    def _append(self, version):
+        # A new version discards the redo branch.
+        del self._versions[self._cursor + 1:]
+        self._versions.append(version)
+        if len(self._versions) > self.max_versions:
+            del self._versions[:len(self._versions) - self.max_versions]
+        self._cursor = len(self._versions) - 1
+        return version
+
+    def commit(self, plan, label=""):
+        """
+        Adds a full plan (e.g. an LLM response) as the newest version, sharing day
+        objects with the current version where the content is identical.
+        """
+        parent = self.current
+        parent_days = parent.days if parent else ()
+        reusable = {}
+        for day in parent_days:
+            reusable.setdefault(_day_key(_thaw(day)), day)
+
+        days = []
+        for raw_day in plan.get("itinerary_days", []):
+            days.append(reusable.get(_day_key(raw_day)) or _freeze(raw_day))
+        days = tuple(days)
+
+        changed = frozenset(
+            i for i in range(max(len(days), len(parent_days)))
+            if i >= len(days) or i >= len(parent_days) or days[i] is not parent_days[i]
+        )
+        extra = {k: v for k, v in plan.items() if k not in ("general_notes", "itinerary_days")}
+        return self._append(PlanVersion(plan.get("general_notes", ""), days, changed, label, _freeze(extra)))
+
+    def commit_edit(self, day_updates, general_notes=None, new_length=None, label=""):
+        """
+        Adds a version that differs from the current one only at the given positions,
+        without comparing unchanged days.
+
+        Args:
+            day_updates (dict): Day position -> new day dict.
+            general_notes (str): Replacement general notes (None keeps the current ones).
+            new_length (int): Truncates the day list to this length (None keeps it).
+        """
+        parent = self.current
+        days = list(parent.days)
+        for index, day in day_updates.items():
+            if index < len(days):
+                days[index] = _freeze(day)
+            else:
+                days.append(_freeze(day))
+        if new_length is not None:
+            del days[new_length:]
+        changed = set(day_updates)
+        changed.update(range(len(days), len(parent.days)))
+        return self._append(PlanVersion(
+            parent.general_notes if general_notes is None else general_notes,
+            tuple(days), frozenset(changed), label, parent.extra
+        ))
+
+    def current_plan(self):
+        return self.current.to_plan() if self.current else None
+
+    def can_undo(self):
+        return self._cursor > 0
+
+    def can_redo(self):
+        return self._cursor < len(self._versions) - 1
+
+    def undo(self):
+        """Moves to the previous version and returns it as a plan dict (None if there is none)."""
+        if not self.can_undo():
+            return None
+        self._cursor -= 1
+        return self.current_plan()
+
+    def redo(self):
+        """Moves to the next version and returns it as a plan dict (None if there is none)."""
+        if not self.can_redo():
+            return None
+        self._cursor += 1
+        return self.current_plan()
+
+    def diff(self, from_index=None, to_index=None):
+        """
+        Lists the days that differ between two versions (defaults: previous and current).
+        Only positions recorded as changed in the versions between them are inspected.
+
+        Returns:
+            list of dict: {"index", "before", "after"} per changed day (None where a day
+                          was added or removed), ordered by position.
+        """
+        to_index = self._cursor if to_index is None else to_index
+        from_index = to_index - 1 if from_index is None else from_index
+        if from_index < 0 or to_index < 0 or from_index == to_index:
+            return []
+        low, high = sorted((from_index, to_index))
+        candidates = set()
+        for version in self._versions[low + 1:high + 1]:
+            candidates |= version.changed
+
+        before, after = self._versions[from_index], self._versions[to_index]
+        changes = []
+        for i in sorted(candidates):
+            old_day = before.days[i] if i < len(before.days) else None
+            new_day = after.days[i] if i < len(after.days) else None
+            if old_day is not new_day:
+                changes.append({
+                    "index": i,
+                    "before": _thaw(old_day) if old_day is not None else None,
+                    "after": _thaw(new_day) if new_day is not None else None,
+                })
+        return changes
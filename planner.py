@@ -0,0 +1,492 @@
+# planner.py
+"""
+UI-independent planning core.
+
+Holds the stage logic of the travel wizard (prompt building, response validation,
+option collection and the fallback itinerary) so that it can be shared by the
+Streamlit app (app.py) and headless callers such as the HTTP API (api_server.py).
+Nothing in this module touches Streamlit.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import entities
+import token_budget
+import warm_index
+from llm_handler import collect_degraded_notes, generate_response, get_gemini_response_async, note_degraded
+from prompts import (
+    TRIP_TYPE_PROMPT, CITIES_PROMPT, ATTRACTIONS_PROMPT,
+    RESTAURANTS_PROMPT, ITINERARY_STRUCTURE_PROMPT, ADJUST_PLAN_PROMPT
+)
+
+# --- Stage names ---
+STAGE_TRIP_TYPES = "trip_types"
+STAGE_CITIES = "cities"
+STAGE_ATTRACTIONS = "attractions"
+STAGE_RESTAURANTS = "restaurants"
+STAGE_ITINERARY = "itinerary"
+STAGE_ADJUST = "adjust"
+
+DEFAULT_TRIP_TYPE_PLACEHOLDER = "e.g., Relaxing beach holiday for a couple"
+
+# How many suggestions each stage asks for (the prompts' {num_suggestions}), normally and
+# once the token budget reaches token_budget.LEVEL_FEWER.
+SUGGESTION_COUNTS = {STAGE_TRIP_TYPES: "3", STAGE_CITIES: "3-5", STAGE_ATTRACTIONS: "2-3", STAGE_RESTAURANTS: "1-2"}
+REDUCED_SUGGESTION_COUNTS = {STAGE_TRIP_TYPES: "2", STAGE_CITIES: "2-3", STAGE_ATTRACTIONS: "1-2", STAGE_RESTAURANTS: "1"}
+
+# Cities whose latest good attraction/restaurant suggestions are kept (per stage) to be
+# served, flagged as degraded, when the LLM is unavailable.
+RECENT_SUGGESTIONS_MAX_CITIES = 512
+
+
+class PlanningError(Exception):
+    """Raised by plan_trip when a stage the rest of the pipeline depends on fails."""
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+# --- User inputs ---
+def default_user_inputs():
+    return {
+        "starting_destination": "", "budget": 1000.0,
+        "time_frame_start": date.today(),
+        "time_frame_end": date.today() + timedelta(days=7),
+        "num_adults": 1, "num_children": 0,
+        "trip_type_description": DEFAULT_TRIP_TYPE_PLACEHOLDER,
+        "cities_to_visit_initial": "", "attractions_to_visit_initial": "",
+        "selected_trip_type": None, "selected_cities": [],
+        "selected_attractions": {}, "include_restaurants": False,
+        "selected_restaurants": {}
+    }
+
+def _as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+_TEXT_INPUTS = ("starting_destination", "trip_type_description", "cities_to_visit_initial",
+                "attractions_to_visit_initial")
+
+def _check_inputs(ui):
+    """Raises TypeError if a text, list or per-city field has the wrong JSON type."""
+    for key in _TEXT_INPUTS:
+        if not isinstance(ui[key], str):
+            raise TypeError(f"'{key}' must be a string.")
+    if ui["selected_trip_type"] is not None and not isinstance(ui["selected_trip_type"], str):
+        raise TypeError("'selected_trip_type' must be a string.")
+    if not isinstance(ui["include_restaurants"], bool):
+        raise TypeError("'include_restaurants' must be true or false.")
+    if not isinstance(ui["selected_cities"], list) or not all(isinstance(c, str) for c in ui["selected_cities"]):
+        raise TypeError("'selected_cities' must be a list of city names.")
+    for key in ("selected_attractions", "selected_restaurants"):
+        value = ui[key]
+        if not isinstance(value, dict) or not all(isinstance(names, list) and all(isinstance(n, str) for n in names)
+                                                  for names in value.values()):
+            raise TypeError(f"'{key}' must map each city name to a list of names.")
+
+def normalize_user_inputs(raw_inputs):
+    """
+    Builds a complete user_inputs dict (same keys as the Streamlit session state)
+    from a partial, JSON-style dict. ISO date strings are converted to dates.
+    Raises ValueError on invalid dates or counts, TypeError on fields of the wrong type.
+    """
+    ui = default_user_inputs()
+    ui.update({k: v for k, v in (raw_inputs or {}).items() if k in ui and v is not None})
+    _check_inputs(ui)
+    ui["time_frame_start"] = _as_date(ui["time_frame_start"])
+    ui["time_frame_end"] = _as_date(ui["time_frame_end"])
+    ui["budget"] = float(ui["budget"])
+    ui["num_adults"] = int(ui["num_adults"])
+    ui["num_children"] = int(ui["num_children"])
+    if ui["time_frame_start"] > ui["time_frame_end"]:
+        raise ValueError("Trip end date must be after or the same as the start date.")
+    ui["selected_cities"] = entities.unique_cities(ui["selected_cities"])
+    ui["selected_attractions"] = {city: entities.unique_attractions(names, city)
+                                  for city, names in entities.canonical_per_city(ui["selected_attractions"]).items()}
+    ui["selected_restaurants"] = entities.canonical_per_city(ui["selected_restaurants"])
+    return ui
+
+def serialize_user_inputs(ui):
+    """Returns a JSON-serializable copy of user_inputs (dates as ISO strings)."""
+    return {k: (v.isoformat() if isinstance(v, date) else v) for k, v in ui.items()}
+
+def has_custom_trip_type(ui):
+    """True if the user described their own trip type (not empty and not the placeholder)."""
+    description = ui.get("trip_type_description")
+    return bool(description and description.strip() != "" and description != DEFAULT_TRIP_TYPE_PLACEHOLDER)
+
+def calculate_num_days(start_date, end_date):
+    if start_date and end_date and start_date <= end_date:
+        return (end_date - start_date).days + 1
+    return 0
+
+def split_comma_list(text):
+    return [item.strip() for item in (text or "").split(',') if item.strip()]
+
+
+# --- Prompt building ---
+# Builders take the token budget level (token_budget.LEVEL_*): from LEVEL_COMPACT on,
+# JSON is embedded without whitespace and build_prompt drops the worked example; from
+# LEVEL_FEWER on, fewer suggestions are requested.
+def _suggestion_count(stage, level):
+    return (REDUCED_SUGGESTION_COUNTS if level >= token_budget.LEVEL_FEWER else SUGGESTION_COUNTS)[stage]
+
+def _prompt_json(value, level):
+    return json.dumps(value, separators=(",", ":")) if level >= token_budget.LEVEL_COMPACT else json.dumps(value)
+
+def _trip_types_prompt(ui, level=token_budget.LEVEL_NORMAL):
+    return TRIP_TYPE_PROMPT.format(
+        num_suggestions=_suggestion_count(STAGE_TRIP_TYPES, level),
+        budget=ui['budget'], start_date=ui['time_frame_start'].isoformat(),
+        end_date=ui['time_frame_end'].isoformat(), adults=ui['num_adults'],
+        children=ui['num_children'], trip_idea=ui.get('trip_type_description', 'any'), # Use 'any' if it was placeholder
+        start_dest=ui['starting_destination']
+    )
+
+def _cities_prompt(ui, level=token_budget.LEVEL_NORMAL):
+    return CITIES_PROMPT.format(
+        num_suggestions=_suggestion_count(STAGE_CITIES, level),
+        budget=ui['budget'], start_date=ui['time_frame_start'].isoformat(),
+        end_date=ui['time_frame_end'].isoformat(), adults=ui['num_adults'],
+        children=ui['num_children'], start_dest=ui['starting_destination'],
+        selected_trip_type=ui['selected_trip_type'],
+        initial_cities=", ".join(entities.unique_cities(split_comma_list(ui.get('cities_to_visit_initial'))))
+    )
+
+def _attractions_prompt(ui, level=token_budget.LEVEL_NORMAL):
+    return ATTRACTIONS_PROMPT.format(
+        num_suggestions=_suggestion_count(STAGE_ATTRACTIONS, level),
+        selected_trip_type=ui['selected_trip_type'],
+        selected_cities_list=entities.unique_cities(ui['selected_cities']),
+        adults=ui['num_adults'], children=ui['num_children'],
+        initial_attractions=", ".join(entities.unique_attractions(split_comma_list(ui.get('attractions_to_visit_initial'))))
+    )
+
+def _restaurants_prompt(ui, level=token_budget.LEVEL_NORMAL):
+    return RESTAURANTS_PROMPT.format(
+        num_suggestions=_suggestion_count(STAGE_RESTAURANTS, level),
+        selected_cities_list=entities.unique_cities(ui['selected_cities']),
+        selected_trip_type=ui['selected_trip_type'],
+        budget=ui['budget'], adults=ui['num_adults'], children=ui['num_children']
+    )
+
+def _itinerary_prompt(ui, level=token_budget.LEVEL_NORMAL):
+    selected_cities = entities.unique_cities(ui['selected_cities'])
+    attractions_data_for_prompt = {}
+    for city, attrs in entities.canonical_per_city(ui.get('selected_attractions', {})).items():
+        if attrs and city in selected_cities: # Ensure city is still selected
+            attractions_data_for_prompt[city] = [{"attraction_name": attr, "description": "User selected"}
+                                                 for attr in entities.unique_attractions(attrs, city)]
+
+    restaurants_data_for_prompt = {}
+    if ui.get('include_restaurants', False):
+        for city, rests in entities.canonical_per_city(ui.get('selected_restaurants', {})).items():
+            if rests and city in selected_cities:
+                restaurants_data_for_prompt[city] = [{"restaurant_name": r, "description": "User selected"} for r in rests]
+
+    return ITINERARY_STRUCTURE_PROMPT.format(
+        num_days=calculate_num_days(ui['time_frame_start'], ui['time_frame_end']),
+        start_date=ui['time_frame_start'].isoformat(),
+        end_date=ui['time_frame_end'].isoformat(),
+        selected_cities_list_str=str(selected_cities),
+        attractions_data_str=_prompt_json(attractions_data_for_prompt, level),
+        restaurants_data_str=_prompt_json(restaurants_data_for_prompt, level),
+        selected_trip_type=ui['selected_trip_type'],
+        adults=ui['num_adults'], children=ui['num_children']
+    )
+
+def _adjust_prompt(ui, current_plan=None, user_request="", level=token_budget.LEVEL_NORMAL):
+    return ADJUST_PLAN_PROMPT.format(
+        current_plan_json=_prompt_json(current_plan, level),
+        user_request=user_request
+    )
+
+PROMPT_BUILDERS = {
+    STAGE_TRIP_TYPES: _trip_types_prompt,
+    STAGE_CITIES: _cities_prompt,
+    STAGE_ATTRACTIONS: _attractions_prompt,
+    STAGE_RESTAURANTS: _restaurants_prompt,
+    STAGE_ITINERARY: _itinerary_prompt,
+    STAGE_ADJUST: _adjust_prompt,
+}
+
+def build_prompt(stage, ui, **extra):
+    """
+    Formats the prompt template for a stage, shortened according to the current session's
+    token budget level. `extra` is passed to the builder (used by the adjust stage).
+    """
+    level = token_budget.current_level()
+    prompt = PROMPT_BUILDERS[stage](ui, level=level, **extra)
+    if level >= token_budget.LEVEL_COMPACT:
+        prompt = prompt.split("\nExample:\n", 1)[0] # The format is still described in words
+    return prompt
+
+
+# --- Response validation ---
+def _valid_items(items, required_keys):
+    return [item for item in items if isinstance(item, dict) and all(k in item for k in required_keys)]
+
+def _valid_per_city(suggestions, required_keys):
+    return {city: _valid_items(items, required_keys) for city, items in suggestions.items() if isinstance(items, list)}
+
+def validate_response(stage, response):
+    """
+    Checks that an LLM response has the shape the stage expects, dropping malformed entries.
+    Returns the cleaned response, or None if it is unusable.
+    """
+    if stage == STAGE_TRIP_TYPES:
+        if isinstance(response, list):
+            return _valid_items(response, ("name", "explanation")) or None
+    elif stage == STAGE_CITIES:
+        if isinstance(response, list):
+            return _valid_items(response, ("city_name", "reason")) or None
+    elif stage == STAGE_ATTRACTIONS:
+        if isinstance(response, dict) and response:
+            return entities.canonical_per_city(_valid_per_city(response, ("attraction_name", "description")))
+    elif stage == STAGE_RESTAURANTS:
+        if isinstance(response, dict) and response:
+            return entities.canonical_per_city(
+                _valid_per_city(response, ("restaurant_name", "cuisine_type", "price_range", "description")))
+    elif stage in (STAGE_ITINERARY, STAGE_ADJUST):
+        if isinstance(response, dict) and "itinerary_days" in response:
+            return response
+    return None
+
+
+# --- Stage execution ---
+def lookup_precomputed(stage, ui):
+    """
+    Returns suggestions for the stage from the precomputed warm index, or None on a miss.
+    Only generic requests are served from the index: trip types when the user did not
+    describe a trip, and cities when the user did not list any cities of their own.
+    """
+    if stage == STAGE_TRIP_TYPES and has_custom_trip_type(ui):
+        return None
+    if stage == STAGE_CITIES and split_comma_list(ui.get('cities_to_visit_initial')):
+        return None
+    if stage not in (STAGE_TRIP_TYPES, STAGE_CITIES):
+        return None
+    return validate_response(stage, warm_index.lookup(stage, ui))
+
+
+# --- Degraded mode ---
+_PER_CITY_STAGES = (STAGE_ATTRACTIONS, STAGE_RESTAURANTS)
+_recent_per_city = OrderedDict() # (stage, city id) -> latest validated suggestions for the city
+_recent_lock = threading.Lock()
+
+def _remember_suggestions(stage, response):
+    if stage not in _PER_CITY_STAGES or not response:
+        return
+    with _recent_lock:
+        for city_name, items in response.items():
+            if items:
+                key = (stage, entities.city_id(city_name))
+                _recent_per_city[key] = items
+                _recent_per_city.move_to_end(key)
+        while len(_recent_per_city) > RECENT_SUGGESTIONS_MAX_CITIES * len(_PER_CITY_STAGES):
+            _recent_per_city.popitem(last=False)
+
+def degraded_suggestions(stage, ui):
+    """
+    Best-effort suggestions for a stage without the LLM, or None if there are none:
+    the warm index entry for the user's combination (ignoring a custom trip description
+    or initial cities) for trip types and cities, and the latest suggestions any session
+    received for each selected city for attractions and restaurants.
+    """
+    if stage in (STAGE_TRIP_TYPES, STAGE_CITIES):
+        return validate_response(stage, warm_index.lookup(stage, ui))
+    if stage in _PER_CITY_STAGES:
+        with _recent_lock:
+            found = {city_name: _recent_per_city.get((stage, entities.city_id(city_name)))
+                     for city_name in ui.get('selected_cities', [])}
+        return {city_name: items for city_name, items in found.items() if items} or None
+    return None
+
+def _local_first(stage, ui):
+    """Local suggestions instead of a model call once the session is at LEVEL_LOCAL_FIRST, or None."""
+    if token_budget.current_level() < token_budget.LEVEL_LOCAL_FIRST:
+        return None
+    local = degraded_suggestions(stage, ui)
+    if local is not None:
+        note_degraded("You are close to your AI usage limit; showing suggestions saved from earlier trips.")
+    return local
+
+def _finish_stage(stage, ui, response):
+    """Validates an LLM response, falling back to degraded_suggestions when it is unusable."""
+    validated = validate_response(stage, response)
+    if validated is not None:
+        _remember_suggestions(stage, validated)
+        return validated
+    fallback = degraded_suggestions(stage, ui)
+    if fallback is not None:
+        note_degraded("The AI service did not respond; showing suggestions saved from earlier trips.")
+    return fallback
+
+def run_stage(stage, ui, llm_call, **extra):
+    """
+    Runs one stage synchronously.
+
+    Args:
+        stage (str): One of the STAGE_* names.
+        ui (dict): The user inputs.
+        llm_call (callable): Takes a prompt and a `stage` keyword (used for model routing)
+                             and returns the parsed response or None
+                             (e.g. llm_handler.get_gemini_response).
+
+    Returns:
+        The validated response. If the call failed or the response was unusable,
+        degraded_suggestions for the stage (noted via llm_handler.note_degraded), or None.
+    """
+    precomputed = lookup_precomputed(stage, ui)
+    if precomputed is not None:
+        return precomputed
+    local = _local_first(stage, ui)
+    if local is not None:
+        return local
+    prompt = build_prompt(stage, ui, **extra)
+    return _finish_stage(stage, ui, llm_call(prompt, stage=stage))
+
+def run_stage_job(job, stage, ui, **extra):
+    """
+    Job body for job_runner.JobRunner.submit: runs a stage with the UI-free Gemini client,
+    abandoning the call as soon as the job is cancelled or past its deadline.
+    LLM errors propagate and end up in job.error; degraded-result notes end up in job.notices.
+    """
+    def llm_call(prompt, stage=None):
+        return generate_response(prompt, stage=stage, cancel_check=job.is_cancelled)
+    job.report("Waiting for the AI model...")
+    with collect_degraded_notes() as notes:
+        job.notices = notes
+        return run_stage(stage, ui, llm_call, **extra)
+
+async def arun_stage(stage, ui, llm_call=None, **extra):
+    """Async counterpart of run_stage. Defaults to the non-blocking Gemini client."""
+    precomputed = lookup_precomputed(stage, ui)
+    if precomputed is not None:
+        return precomputed
+    local = _local_first(stage, ui)
+    if local is not None:
+        return local
+    llm_call = llm_call or get_gemini_response_async
+    prompt = build_prompt(stage, ui, **extra)
+    return _finish_stage(stage, ui, await llm_call(prompt, stage=stage))
+
+
+# --- Option collection ---
+def collect_city_options(ui, city_suggestions):
+    """Initial cities first, then AI suggestions, one canonical name per city (see entities.py)."""
+    all_city_options = split_comma_list(ui.get('cities_to_visit_initial'))
+    all_city_options += [city_sugg['city_name'] for city_sugg in city_suggestions or []]
+    return entities.unique_cities(all_city_options)
+
+def collect_attraction_options(initial_attractions_list, city_attraction_suggestions, city_name=""):
+    """Initial attractions first (offered for every city), then AI suggestions for the city, without duplicates."""
+    city_attraction_options = list(initial_attractions_list)
+    city_attraction_options += [attr_sugg['attraction_name'] for attr_sugg in city_attraction_suggestions or []]
+    return entities.unique_attractions(city_attraction_options, city_name)
+
+def restaurant_option_label(rest_sugg):
+    return f"{rest_sugg['restaurant_name']} ({rest_sugg['cuisine_type']}, {rest_sugg['price_range']}) – {rest_sugg['description']}"
+
+def restaurant_name_from_label(label):
+    return label.split(" (")[0]
+
+
+# --- Fallback plan ---
+def build_fallback_plan(ui):
+    """A basic per-city outline of the user's selections, used when AI structuring fails."""
+    fallback_plan = {"general_notes": "AI structuring failed. Here's a summary of your selections:", "itinerary_days": []}
+    for city_name in ui.get('selected_cities', []):
+        day_entry = {
+            "day_number": f"Focus on {city_name}",
+            "location": city_name,
+            "morning_activity": "Explore attractions: " + ", ".join(ui.get('selected_attractions', {}).get(city_name) or ["Not specified"]),
+            "afternoon_activity": "Further exploration or leisure",
+            "evening_meal": "Try local restaurants" + (": " + ", ".join(ui.get('selected_restaurants', {}).get(city_name, [])) if ui.get('include_restaurants') and ui.get('selected_restaurants', {}).get(city_name) else ""),
+            "notes": "This is a basic outline. Adjust as needed."
+        }
+        fallback_plan["itinerary_days"].append(day_entry)
+    if not fallback_plan["itinerary_days"]:
+        fallback_plan["general_notes"] = "No items selected to display in the plan."
+    return fallback_plan
+
+
+# --- One-shot pipeline ---
+async def plan_trip(raw_inputs, llm_call=None, max_cities=3):
+    """
+    Runs the whole pipeline non-interactively: picks the first suggested trip type
+    (unless the user described one), the initial cities plus the top AI suggestions
+    up to `max_cities`, every suggested attraction and, if requested, every suggested
+    restaurant, then structures the itinerary.
+
+    Returns:
+        dict: "user_inputs" (with the selections made), "suggestions", "travel_plan",
+              "fallback_used", "degraded" (notes on stale or fallback results served
+              while the LLM was unavailable) and "stage_latency_ms" (per-stage wall time).
+
+    Raises:
+        PlanningError: If no trip type or no cities could be determined.
+    """
+    with collect_degraded_notes() as notes:
+        result = await _plan_trip(raw_inputs, llm_call, max_cities)
+    result["degraded"] = notes
+    return result
+
+async def _plan_trip(raw_inputs, llm_call, max_cities):
+    ui = normalize_user_inputs(raw_inputs)
+    suggestions = {"trip_types": [], "cities": [], "attractions": {}, "restaurants": {}}
+    stage_latency_ms = {}
+
+    async def timed(stage, **extra):
+        started = time.perf_counter()
+        try:
+            return await arun_stage(stage, ui, llm_call, **extra)
+        finally:
+            stage_latency_ms[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    if has_custom_trip_type(ui):
+        ui['selected_trip_type'] = ui['trip_type_description']
+    elif not ui.get('selected_trip_type'):
+        suggestions['trip_types'] = await timed(STAGE_TRIP_TYPES) or []
+        if not suggestions['trip_types']:
+            raise PlanningError(STAGE_TRIP_TYPES, "Could not get trip type suggestions.")
+        ui['selected_trip_type'] = suggestions['trip_types'][0]['name']
+
+    if not ui.get('selected_cities'):
+        suggestions['cities'] = await timed(STAGE_CITIES) or []
+        ui['selected_cities'] = collect_city_options(ui, suggestions['cities'])[:max_cities]
+        if not ui['selected_cities']:
+            raise PlanningError(STAGE_CITIES, "Could not get city suggestions.")
+
+    if not ui.get('selected_attractions'):
+        suggestions['attractions'] = await timed(STAGE_ATTRACTIONS) or {}
+        initial_attractions_list = split_comma_list(ui.get('attractions_to_visit_initial'))
+        ui['selected_attractions'] = {
+            city: collect_attraction_options(initial_attractions_list, suggestions['attractions'].get(city), city)
+            for city in ui['selected_cities']
+        }
+
+    if ui.get('include_restaurants') and not ui.get('selected_restaurants'):
+        suggestions['restaurants'] = await timed(STAGE_RESTAURANTS) or {}
+        ui['selected_restaurants'] = {
+            city: [r['restaurant_name'] for r in suggestions['restaurants'].get(city, [])]
+            for city in ui['selected_cities']
+        }
+
+    travel_plan = await timed(STAGE_ITINERARY)
+    fallback_used = travel_plan is None
+    if fallback_used:
+        travel_plan = build_fallback_plan(ui)
+        note_degraded("The itinerary could not be structured by the AI service; showing a basic outline instead.")
+
+    return {
+        "user_inputs": serialize_user_inputs(ui),
+        "suggestions": suggestions,
+        "travel_plan": travel_plan,
+        "fallback_used": fallback_used,
+        "stage_latency_ms": stage_latency_ms,
+    }
@@ -0,0 +1,94 @@
+# precompute_warm_index.py
+"""
+Offline job that builds the warm suggestion index (see warm_index.py).
+
+Reads a JSONL sample of real trip inputs (same format as batch_plan.py specs),
+finds the top-N (origin, season, budget band, party type) combinations, and for each
+one asks the model for trip type suggestions and then city suggestions for every
+suggested trip type. The results are written to a compact read-only index file that
+the app and the API memory-map at startup.
+
+Usage:
+    GEMINI_API_KEY=... python precompute_warm_index.py traffic.jsonl --top-n 200 --output warm_index.bin
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+import planner
+import warm_index
+from batch_plan import RateLimiter, read_specs, spec_to_inputs
+from llm_handler import get_gemini_response_async
+
+
+def top_combinations(traffic_path, top_n):
+    """
+    Counts combinations in the traffic sample.
+
+    Returns:
+        list of (combination, representative user inputs) for the top_n most frequent
+        combinations. The representative is the first request seen for the combination,
+        stripped of anything user-specific that would change the suggestion prompts.
+    """
+    counts = Counter()
+    representatives = {}
+    for _, spec in read_specs(traffic_path):
+        try:
+            ui = planner.normalize_user_inputs(spec_to_inputs(spec))
+        except (TypeError, ValueError, KeyError):
+            continue
+        if not ui["starting_destination"]:
+            continue
+        combination = warm_index.combination_for(ui)
+        counts[combination] += 1
+        if combination not in representatives:
+            ui.update(trip_type_description=planner.DEFAULT_TRIP_TYPE_PLACEHOLDER,
+                      cities_to_visit_initial="", selected_trip_type=None)
+            representatives[combination] = ui
+    return [(combination, representatives[combination]) for combination, _ in counts.most_common(top_n)]
+
+async def precompute(combinations, concurrency=4, rpm=60, llm_call=None):
+    """Runs the trip type and city stages for every combination. Returns the index entries."""
+    llm_call = llm_call or get_gemini_response_async
+    limiter = RateLimiter(rpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    entries = {}
+
+    async def run(stage, ui):
+        # Call the model directly rather than planner.arun_stage, so an existing index is not reused.
+        async with semaphore:
+            await limiter.wait()
+            response = await llm_call(planner.build_prompt(stage, ui), stage=stage)
+        return planner.validate_response(stage, response)
+
+    async def cities_for(combination, ui, trip_type):
+        cities = await run(planner.STAGE_CITIES, {**ui, "selected_trip_type": trip_type["name"]})
+        if cities:
+            entries[warm_index.make_key(planner.STAGE_CITIES, combination, trip_type["name"])] = cities
+
+    async def precompute_one(combination, ui):
+        trip_types = await run(planner.STAGE_TRIP_TYPES, ui)
+        if not trip_types:
+            print(f"[warm-index] no trip types for {combination}", file=sys.stderr)
+            return
+        entries[warm_index.make_key(planner.STAGE_TRIP_TYPES, combination)] = trip_types
+        await asyncio.gather(*(cities_for(combination, ui, trip_type) for trip_type in trip_types))
+
+    await asyncio.gather(*(precompute_one(combination, ui) for combination, ui in combinations))
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute trip type and city suggestions into a warm index file.")
+    parser.add_argument("traffic", help="JSONL sample of trip inputs used to rank combinations")
+    parser.add_argument("--top-n", type=int, default=100, help="Number of combinations to precompute")
+    parser.add_argument("--output", default=warm_index.WARM_INDEX_PATH, help="Index file to write")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum LLM calls in flight")
+    parser.add_argument("--rpm", type=int, default=60, help="Maximum LLM requests per minute (0 = unlimited)")
+    args = parser.parse_args()
+
+    combinations = top_combinations(args.traffic, args.top_n)
+    entries = asyncio.run(precompute(combinations, concurrency=args.concurrency, rpm=args.rpm))
+    warm_index.write_index(args.output, entries)
+    print(f"Wrote {len(entries)} entries for {len(combinations)} combinations to {args.output}")
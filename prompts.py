@@ -9,7 +9,7 @@ Based on the following user preferences:
 - User's initial idea for trip type: "{trip_idea}"
 - Starting destination: {start_dest}
 
-Suggest 3 distinct types of trips that would be suitable.
+Suggest {num_suggestions} distinct types of trips that would be suitable.
 For each suggested trip type, provide:
 1. A concise name for the trip type (e.g., "Relaxing Beach Getaway", "Cultural City Exploration", "Adventure Mountain Trek").
 2. A brief (1-2 sentences) explanation of why this trip type fits the user's preferences.
@@ -32,7 +32,7 @@ User preferences:
 - Confirmed trip type: "{selected_trip_type}"
 - Cities user already wants to visit: {initial_cities}
 
-Suggest 3-5 additional cities that align with these preferences.
+Suggest {num_suggestions} additional cities that align with these preferences.
 For each city, provide:
 1. City name.
 2. A brief (1-2 sentences) reason why it's a good fit for the selected trip type and other preferences.
@@ -56,7 +56,7 @@ User preferences:
 - Travelers: {adults} adults, {children} children (consider age-appropriateness if children > 0)
 - Attractions user already wants to visit: {initial_attractions}
 
-For each city in the list {selected_cities_list}, suggest 2-3 relevant attractions.
+For each city in the list {selected_cities_list}, suggest {num_suggestions} relevant attractions.
 Provide the attraction name and a short (1-sentence) description highlighting its relevance to the trip type or user profile.
 Avoid suggesting attractions already listed in '{initial_attractions}' for those cities.
 
@@ -83,7 +83,7 @@ User preferences:
 - Budget indication: {budget} (use this to infer general price range)
 - Travelers: {adults} adults, {children} children
 
-For each city in {selected_cities_list}, suggest 1-2 restaurant options that might appeal to the travelers.
+For each city in {selected_cities_list}, suggest {num_suggestions} restaurant options that might appeal to the travelers.
 For each restaurant, provide:
 1. Name
 2. Cuisine type (e.g., Italian, Local, Seafood)
@@ -0,0 +1,211 @@
+# session_memory.py
+"""
+Per-session memory accounting and compact storage of LLM suggestions.
+
+- session_memory_report() measures the deep byte size of each session_state key,
+  separating bytes the session owns from bytes it merely references in the shared store.
+- SharedSuggestionStore deduplicates suggestion payloads across sessions: identical
+  suggestions (same content) are held once per process and every session keeps a
+  reference to that one copy, with entity names interned.
+- compact_session_state() moves a session's suggestions into the shared store and
+  evicts stage payloads the current stage can no longer reach.
+
+Shared payloads must be treated as read-only by their users.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+# Compact storage is on unless TRAVEL_AI_COMPACT_STATE=0.
+COMPACT_SESSION_STATE = os.environ.get("TRAVEL_AI_COMPACT_STATE", "1") != "0"
+
+# Maximum number of distinct suggestion payloads held by the shared store.
+SHARED_STORE_MAX_ENTRIES = 2048
+
+# Keys whose values are entity names worth interning (many sessions see the same cities).
+_NAME_KEYS = {"name", "city_name", "attraction_name", "restaurant_name", "cuisine_type", "price_range"}
+
+# Which llm_suggestions entries each wizard stage can still use, either itself or via
+# one "Back" click that does not reset them. Anything else is stale: going further back
+# resets and refetches it (a response-cache hit when the inputs are unchanged).
+# "trip_types" is kept in compact form (names only) after the city stage, because the
+# city stage uses its presence to decide where "Back" leads.
+REACHABLE_SUGGESTIONS = {
+    "initial_input": set(),
+    "suggest_trip_type": {"trip_types"},
+    "suggest_cities": {"trip_types", "cities"},
+    "suggest_attractions": {"attractions"},
+    "suggest_restaurants": {"attractions", "restaurants"},
+    "generate_plan": {"restaurants"},
+}
+_EMPTY_SUGGESTIONS = {"trip_types": list, "cities": list, "attractions": dict, "restaurants": dict}
+
+
+# --- Size accounting ---
+def _deep_sizeof(obj, seen, shared_ids, totals, in_shared=False):
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    in_shared = in_shared or id(obj) in shared_ids
+    totals["shared" if in_shared else "owned"] += sys.getsizeof(obj)
+
+    if isinstance(obj, (dict, MappingProxyType)):
+        for key, value in obj.items():
+            _deep_sizeof(key, seen, shared_ids, totals, in_shared)
+            _deep_sizeof(value, seen, shared_ids, totals, in_shared)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            _deep_sizeof(item, seen, shared_ids, totals, in_shared)
+    elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return
+    else:
+        if hasattr(obj, "__dict__"):
+            _deep_sizeof(vars(obj), seen, shared_ids, totals, in_shared)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                _deep_sizeof(getattr(obj, slot), seen, shared_ids, totals, in_shared)
+
+def deep_sizeof(obj, shared_ids=frozenset()):
+    """
+    Approximate deep size of obj in bytes, as {"owned": ..., "shared": ...}.
+    Objects reachable through an id in shared_ids are counted as shared.
+    """
+    totals = {"owned": 0, "shared": 0}
+    _deep_sizeof(obj, set(), shared_ids, totals)
+    return totals
+
+def session_memory_report(state):
+    """
+    Byte size of each key in a session state mapping (e.g. st.session_state),
+    largest first, plus totals. Objects are counted once per report even if
+    several keys reference them.
+    """
+    shared_ids = get_shared_store().shared_ids()
+    seen = set()
+    per_key = {}
+    totals = {"owned": 0, "shared": 0}
+    for key in list(state.keys()):
+        key_totals = {"owned": 0, "shared": 0}
+        _deep_sizeof(state[key], seen, shared_ids, key_totals)
+        per_key[str(key)] = key_totals
+        totals["owned"] += key_totals["owned"]
+        totals["shared"] += key_totals["shared"]
+    ordered = dict(sorted(per_key.items(), key=lambda item: -(item[1]["owned"] + item[1]["shared"])))
+    return {"total_owned_bytes": totals["owned"], "total_shared_bytes": totals["shared"], "by_key": ordered}
+
+
+# --- Shared suggestion store ---
+def _intern_names(value):
+    """Copy of a suggestion payload with dict keys and entity-name values interned."""
+    if isinstance(value, dict):
+        return {
+            (sys.intern(k) if isinstance(k, str) else k):
+            (sys.intern(v) if k in _NAME_KEYS and isinstance(v, str) else _intern_names(v))
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_intern_names(v) for v in value]
+    return value
+
+
+class SharedSuggestionStore:
+    """Process-wide, content-addressed store of suggestion payloads (bounded LRU)."""
+    def __init__(self, max_entries=SHARED_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._by_digest = OrderedDict() # content digest -> payload
+        self._digest_by_id = {} # id(payload) -> content digest
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def share(self, value):
+        """Returns the shared copy of `value`, adding it to the store if its content is new."""
+        if not value:
+            return value
+        with self._lock:
+            if id(value) in self._digest_by_id:
+                return value
+        digest = hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        with self._lock:
+            existing = self._by_digest.get(digest)
+            if existing is not None:
+                self._by_digest.move_to_end(digest)
+                self._hits += 1
+                return existing
+            shared = _intern_names(value)
+            self._by_digest[digest] = shared
+            self._digest_by_id[id(shared)] = digest
+            self._misses += 1
+            while len(self._by_digest) > self.max_entries:
+                _, evicted = self._by_digest.popitem(last=False)
+                self._digest_by_id.pop(id(evicted), None)
+            return shared
+
+    def shared_ids(self):
+        with self._lock:
+            return frozenset(self._digest_by_id)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._by_digest.values())
+            stats = {"entries": len(entries), "hits": self._hits, "misses": self._misses}
+        seen = set()
+        totals = {"owned": 0, "shared": 0}
+        for payload in entries:
+            _deep_sizeof(payload, seen, frozenset(), totals)
+        stats["bytes"] = totals["owned"]
+        return stats
+
+
+_shared_store = SharedSuggestionStore()
+
+def get_shared_store():
+    return _shared_store
+
+
+# --- Compaction ---
+def _compact_trip_types(trip_types):
+    return [{"name": tt.get("name", ""), "explanation": ""} for tt in trip_types]
+
+def compact_session_state(state):
+    """
+    Compacts a session's state in place: evicts llm_suggestions entries the current
+    stage cannot reach, drops the plan and its history outside the plan stage, and
+    moves the remaining suggestions into the shared store. Safe to call on every rerun.
+    """
+    stage = state.get("stage")
+    reachable = REACHABLE_SUGGESTIONS.get(stage, set())
+    suggestions = state.get("llm_suggestions")
+    if suggestions is not None:
+        for key, empty in _EMPTY_SUGGESTIONS.items():
+            value = suggestions.get(key)
+            if not value:
+                continue
+            if key in reachable:
+                suggestions[key] = get_shared_store().share(value)
+            elif key == "trip_types" and stage != "initial_input":
+                if any(tt.get("explanation") for tt in value):
+                    value = _compact_trip_types(value)
+                suggestions[key] = get_shared_store().share(value)
+            else:
+                suggestions[key] = empty()
+
+    if stage != "generate_plan":
+        if state.get("travel_plan_raw") is not None:
+            state["travel_plan_raw"] = None
+        if state.get("plan_history") is not None:
+            state["plan_history"] = None
+
+    user_inputs = state.get("user_inputs")
+    if user_inputs:
+        for key in ("selected_cities",):
+            if user_inputs.get(key):
+                user_inputs[key] = [sys.intern(name) for name in user_inputs[key]]
+        for key in ("selected_attractions", "selected_restaurants"):
+            if user_inputs.get(key):
+                user_inputs[key] = {sys.intern(city): [sys.intern(n) for n in names]
+                                    for city, names in user_inputs[key].items()}
@@ -0,0 +1,176 @@
+# speculation.py
+"""
+Speculative city suggestions for every AI-proposed trip type.
+
+Normally the CITIES_PROMPT call starts only after the user has picked a trip type and
+clicked Next, so the trip type and city latencies add up. With speculation on
+(TRAVEL_AI_SPECULATIVE_CITIES=1), the city suggestions for all proposed trip types are
+requested in the background as soon as the trip types are shown, and the one for the
+trip type the user picks is ready (or already on its way) when the city stage opens.
+The others are cancelled, which stops their streams where the backend supports it.
+
+Speculative calls run on their own JobRunner (job_runner.py) of SPECULATION_WORKERS
+threads, so they never hold up the itinerary and adjustment jobs users are waiting on.
+Speculation costs extra tokens, so it is skipped once the session's token budget
+starts degrading, and when its workers could not start every call right away.
+Tokens spent by speculative calls are charged to the session as usual and reported
+by get_speculation_stats(), split into those whose result was used and those
+wasted on trip types the user did not pick.
+"""
+import os
+import threading
+
+import planner
+import token_budget
+from job_runner import JobRunner, JOB_DONE
+
+# Speculative city suggestions are off unless TRAVEL_AI_SPECULATIVE_CITIES=1.
+SPECULATIVE_CITIES = os.environ.get("TRAVEL_AI_SPECULATIVE_CITIES", "0") == "1"
+
+# Deadline of a speculative call.
+SPECULATION_TIMEOUT_S = 60
+
+# Worker threads for speculative calls, shared by all sessions in the process. Each
+# session speculates on every proposed trip type (3 by default) at once.
+SPECULATION_WORKERS = int(os.environ.get("TRAVEL_AI_SPECULATION_WORKERS", 16))
+
+_STAGE_PREFIX = f"speculative_{planner.STAGE_CITIES}:"
+
+
+class _Speculation:
+    """Token tally of one speculative call."""
+    __slots__ = ("session_id", "trip_type", "tokens", "wasted")
+
+    def __init__(self, session_id, trip_type):
+        self.session_id = session_id
+        self.trip_type = trip_type
+        self.tokens = 0
+        self.wasted = False
+
+    def charge(self, tokens):
+        with _lock:
+            self.tokens += tokens
+            _stats["tokens_spent"] += tokens
+            if self.wasted:
+                _stats["tokens_wasted"] += tokens # Usage reported after the cancel
+
+    def waste(self):
+        # Caller holds _lock.
+        if not self.wasted:
+            self.wasted = True
+            _stats["tokens_wasted"] += self.tokens
+
+
+_lock = threading.Lock()
+_runner = None
+_speculations = {} # job id -> _Speculation
+_stats = {"launched": 0, "used": 0, "used_while_running": 0, "failed": 0, "cancelled": 0,
+          "skipped_budget": 0, "skipped_busy": 0, "tokens_spent": 0, "tokens_wasted": 0}
+
+
+def get_speculation_runner():
+    """The process-wide JobRunner for speculative calls."""
+    global _runner
+    with _lock:
+        if _runner is None:
+            _runner = JobRunner(SPECULATION_WORKERS, thread_name_prefix="travel-ai-speculation")
+        return _runner
+
+def speculative_stage(trip_type):
+    """Job runner stage key of the speculative city call for a trip type."""
+    return _STAGE_PREFIX + trip_type
+
+def _speculate(job, speculation, ui):
+    with token_budget.track_usage(speculation.charge):
+        return planner.run_stage_job(job, planner.STAGE_CITIES, ui)
+
+def _forget_lost(runner):
+    # Speculations whose job the runner dropped (session abandoned) were wasted.
+    with _lock:
+        for job_id in [job_id for job_id in _speculations if runner.get(job_id) is None]:
+            _speculations.pop(job_id).waste()
+
+def start_city_speculation(session_id, ui, trip_types):
+    """
+    Requests city suggestions in the background for each trip type that has no
+    speculative job yet (and no warm index answer). Does nothing unless
+    SPECULATIVE_CITIES is on. Returns the number of calls started.
+    """
+    if not SPECULATIVE_CITIES:
+        return 0
+    runner = get_speculation_runner()
+    _forget_lost(runner)
+    pending = [trip_type for trip_type in trip_types
+               if runner.get_for(session_id, speculative_stage(trip_type)) is None
+               and planner.lookup_precomputed(planner.STAGE_CITIES, dict(ui, selected_trip_type=trip_type)) is None]
+    if not pending:
+        return 0
+    if token_budget.current_level() >= token_budget.LEVEL_COMPACT:
+        with _lock:
+            _stats["skipped_budget"] += 1
+        return 0
+    stats = runner.stats()
+    if stats["running"] + stats["queued"] + len(pending) > runner.max_workers:
+        with _lock:
+            _stats["skipped_busy"] += 1
+        return 0
+
+    for trip_type in pending:
+        speculation = _Speculation(session_id, trip_type)
+        job = runner.submit(session_id, speculative_stage(trip_type), _speculate, speculation,
+                            dict(ui, selected_trip_type=trip_type), timeout=SPECULATION_TIMEOUT_S)
+        with _lock:
+            _speculations[job.id] = speculation
+            _stats["launched"] += 1
+    return len(pending)
+
+def get_city_speculation(session_id, trip_type):
+    """The speculative job for a trip type (running or finished), or None."""
+    if not SPECULATIVE_CITIES:
+        return None
+    return get_speculation_runner().get_for(session_id, speculative_stage(trip_type))
+
+def use_city_speculation(job, waited=False):
+    """
+    Consumes a finished speculative job. Returns its validated city suggestions, or None
+    if it failed (the caller then fetches the cities as usual).
+    `waited` marks a job that was still running when the user reached the city stage.
+    """
+    get_speculation_runner().discard(job)
+    result = job.result if job.status == JOB_DONE else None
+    with _lock:
+        speculation = _speculations.pop(job.id, None)
+        if result is None:
+            _stats["failed"] += 1
+            if speculation is not None:
+                speculation.waste()
+        else:
+            _stats["used"] += 1
+            _stats["used_while_running"] += waited
+    return result
+
+def cancel_city_speculation(session_id, keep=None):
+    """
+    Cancels the session's speculative jobs, except the one for the trip type `keep`.
+    Their tokens are counted as wasted. Returns the number cancelled.
+    """
+    with _lock:
+        doomed = {job_id: speculation for job_id, speculation in _speculations.items()
+                  if speculation.session_id == session_id and speculation.trip_type != keep}
+        for job_id, speculation in doomed.items():
+            del _speculations[job_id]
+            speculation.waste()
+        _stats["cancelled"] += len(doomed)
+    if doomed:
+        get_speculation_runner().cancel(session_id, [speculative_stage(s.trip_type) for s in doomed.values()])
+    return len(doomed)
+
+def get_speculation_stats():
+    """Launch/use counts, hit rate and tokens spent vs. wasted on speculative city calls."""
+    with _lock:
+        stats = dict(_stats, enabled=SPECULATIVE_CITIES, in_flight=len(_speculations))
+        runner = _runner
+    stats["workers"] = runner.stats() if runner is not None else None
+    settled = stats["used"] + stats["failed"] + stats["cancelled"]
+    stats["use_rate"] = round(stats["used"] / settled, 3) if settled else None
+    return stats
@@ -0,0 +1,33 @@
+# test_entities.py
+import entities
+
+
+def test_unqualified_name_never_resolves_to_a_qualified_entity():
+    assert entities.unique_cities(["Paris, Texas"]) == ["Paris, Texas"]
+    assert entities.unique_cities(["Paris"]) == ["Paris"]
+    assert entities.city_id("Paris") == "city:paris"
+    assert entities.city_id("Paris, Texas") == "city:paris-texas"
+    assert entities.city_id("Paris, France") == "city:paris"
+
+
+def test_fuzzy_spelling_never_becomes_the_canonical_name():
+    assert entities.city("Pariss").id == "city:paris"
+    paris = entities.city("Paris")
+    assert (paris.id, paris.name) == ("city:paris", "Paris")
+    assert entities.unique_cities(["Pariss", "Paris"]) == ["Paris"]
+
+
+def test_country_qualifiers_are_normalized():
+    assert entities.city_id("Vienna, Austria") == entities.city_id("Vienna, Österreich") == "city:vienna"
+    assert entities.unique_cities(["Vienna, Austria", "Vienna, Österreich", "Wien"]) == ["Vienna"]
+    assert entities.city_key("London, UK") == entities.city_key("London (United Kingdom)") == "london"
+
+
+def test_same_name_in_different_regions_stays_separate():
+    assert entities.unique_cities(["Portland, Oregon", "Portland, Maine", "Portland"]) == [
+        "Portland, Oregon", "Portland, Maine", "Portland"]
+
+
+def test_fuzzy_matching_is_limited_to_typos():
+    assert entities.unique_attractions(["Central Park", "Central Park Zoo"]) == ["Central Park", "Central Park Zoo"]
+    assert entities.unique_attractions(["Louvre", "Musée du Louvre"], "Paris") == ["Louvre Museum"]
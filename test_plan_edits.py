@@ -0,0 +1,87 @@
+# test_plan_edits.py
+import plan_edits
+
+PLAN = {
+    "trip_name": "Paris and Rome",
+    "itinerary_days": [
+        {"day_number": "Day 1", "location": "Paris",
+         "morning_activity": "Visit the Louvre Museum, then walk through the Tuileries Garden",
+         "afternoon_activity": "Musée d'Orsay", "evening_meal": "Dinner at Le Comptoir"},
+        {"day_number": "Day 2", "location": "Paris",
+         "morning_activity": "Eiffel Tower", "afternoon_activity": "Visit the Rodin Museum",
+         "evening_meal": "Dinner at Chez Janou"},
+        {"day_number": "Day 3", "location": "Rome",
+         "morning_activity": "Colosseum", "afternoon_activity": "Vatican Museums",
+         "evening_meal": "Dinner at Roscioli"},
+    ],
+}
+
+
+def _slots(plan, day):
+    return {k: v for k, v in plan["itinerary_days"][day].items() if k in plan_edits.ACTIVITY_SLOTS}
+
+
+def test_remove_single_activity():
+    edit = plan_edits.try_local_edit(PLAN, "remove the Eiffel Tower")
+    assert edit is not None
+    assert list(edit.day_updates) == [1]
+    assert _slots(edit.plan, 1)["morning_activity"] == plan_edits.FREE_SLOT_TEXT["morning_activity"]
+    assert _slots(edit.plan, 1)["afternoon_activity"] == "Visit the Rodin Museum"
+    assert PLAN["itinerary_days"][1]["morning_activity"] == "Eiffel Tower"
+
+
+def test_remove_matching_every_day_falls_through():
+    assert plan_edits.try_local_edit(PLAN, "cancel dinner") is None
+
+
+def test_remove_matching_several_slots_falls_through():
+    assert plan_edits.try_local_edit(PLAN, "remove museum") is None
+
+
+def test_remove_part_of_a_slot_falls_through():
+    assert plan_edits.try_local_edit(PLAN, "remove the Louvre") is None
+
+
+def test_remove_from_day_needs_single_match_on_that_day():
+    assert plan_edits.try_local_edit(PLAN, "cancel dinner from day 2") is None
+    edit = plan_edits.try_local_edit(PLAN, "remove Colosseum from day 3")
+    assert edit is not None and list(edit.day_updates) == [2]
+    assert plan_edits.try_local_edit(PLAN, "remove Colosseum from day 1") is None
+
+
+def test_move_part_of_a_slot_falls_through():
+    assert plan_edits.try_local_edit(PLAN, "move the Louvre to day 2 afternoon") is None
+
+
+def test_move_single_activity():
+    edit = plan_edits.try_local_edit(PLAN, "move the Eiffel Tower to day 1 afternoon")
+    assert edit is not None
+    assert _slots(edit.plan, 0)["afternoon_activity"] == "Eiffel Tower"
+    assert _slots(edit.plan, 1)["morning_activity"] == "Musée d'Orsay"
+
+
+def test_swap_days():
+    edit = plan_edits.try_local_edit(PLAN, "swap day 1 and 3")
+    assert edit.plan["itinerary_days"][0]["location"] == "Rome"
+    assert edit.plan["itinerary_days"][0]["day_number"] == "Day 1"
+
+
+def test_add_free_time_keeps_displaced_activity_in_notes():
+    edit = plan_edits.try_local_edit(PLAN, "add a free afternoon on day 2")
+    assert edit is not None and list(edit.day_updates) == [1]
+    day = edit.plan["itinerary_days"][1]
+    assert day["afternoon_activity"] == plan_edits.FREE_SLOT_TEXT["afternoon_activity"]
+    assert "Visit the Rodin Museum" in day["notes"]
+    assert day["morning_activity"] == "Eiffel Tower"
+
+
+def test_add_free_time_to_free_slot_adds_no_note():
+    plan = plan_edits.try_local_edit(PLAN, "remove the Eiffel Tower").plan
+    edit = plan_edits.try_local_edit(plan, "add a free morning on day 2")
+    assert "notes" not in edit.plan["itinerary_days"][1]
+
+
+def test_malformed_plan_falls_through():
+    assert plan_edits.try_local_edit({"itinerary_days": ["Day 1", None]}, "swap day 1 and 2") is None
+    assert plan_edits.try_local_edit({"itinerary_days": "Day 1"}, "swap day 1 and 2") is None
+    assert plan_edits.try_local_edit(["not", "a", "plan"], "swap day 1 and 2") is None
@@ -0,0 +1,225 @@
+# token_budget.py
+"""
+Per-session and process-wide token accounting and budget enforcement.
+
+Every model call reports its token usage (Gemini's usage_metadata, or an estimate
+from a stand-in backend) through record_usage(). Usage is charged to the session
+bound to the current context (bind_session(); background jobs inherit it, see
+job_runner.py) and to a rolling process-wide window.
+
+As a session or the process approaches its budget, the planner degrades step by step
+instead of failing outright:
+
+    LEVEL_NORMAL         full prompts
+    LEVEL_COMPACT        shorter prompts (examples dropped, compact JSON)
+    LEVEL_FEWER          ... and fewer suggestions requested per stage
+    LEVEL_LOCAL_FIRST    ... and local results (warm index, suggestions saved from
+                         earlier trips, local plan edits) are preferred over a model call
+    LEVEL_REFUSED        no model calls; only cached and local results are served
+
+The level is the highest one reached by either the session's or the window's share
+of its budget (see DEGRADE_THRESHOLDS). A budget of 0 disables that limit.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+# Tokens a single session (one app visitor, one API client address or one batch trip spec) may use.
+SESSION_TOKEN_BUDGET = int(os.environ.get("TRAVEL_AI_SESSION_TOKEN_BUDGET", 150000))
+
+# Tokens the whole process may use per GLOBAL_BUDGET_WINDOW_S (rolling).
+GLOBAL_TOKEN_BUDGET = int(os.environ.get("TRAVEL_AI_GLOBAL_TOKEN_BUDGET", 20000000))
+GLOBAL_BUDGET_WINDOW_S = 3600
+
+# Sessions whose usage is tracked before the least recently active are forgotten.
+SESSION_USAGE_MAX_ENTRIES = 10000
+
+# Rough characters per token, for backends that do not report usage.
+CHARS_PER_TOKEN = 4
+
+LEVEL_NORMAL = 0
+LEVEL_COMPACT = 1
+LEVEL_FEWER = 2
+LEVEL_LOCAL_FIRST = 3
+LEVEL_REFUSED = 4
+LEVEL_NAMES = {LEVEL_NORMAL: "normal", LEVEL_COMPACT: "compact", LEVEL_FEWER: "fewer",
+               LEVEL_LOCAL_FIRST: "local_first", LEVEL_REFUSED: "refused"}
+
+# (share of budget used, level reached), highest first.
+DEGRADE_THRESHOLDS = [(1.0, LEVEL_REFUSED), (0.9, LEVEL_LOCAL_FIRST), (0.75, LEVEL_FEWER), (0.5, LEVEL_COMPACT)]
+
+_BUCKET_S = 60 # Granularity of the rolling window
+
+_session_id = contextvars.ContextVar("token_budget_session", default=None)
+_usage_trackers = contextvars.ContextVar("token_usage_trackers", default=())
+
+
+def bind_session(session_id):
+    """Charges usage in the current context (and contexts copied from it) to `session_id`."""
+    _session_id.set(session_id or None)
+
+def current_session():
+    return _session_id.get()
+
+@contextmanager
+def track_usage(callback):
+    """
+    Calls callback(tokens) for every model call charged inside the block (and in
+    contexts copied from it), e.g. to attribute tokens to one piece of work.
+    """
+    token = _usage_trackers.set(_usage_trackers.get() + (callback,))
+    try:
+        yield
+    finally:
+        _usage_trackers.reset(token)
+
+def estimate_tokens(text):
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+
+class TokenBudget:
+    """Thread-safe token ledger for sessions and the process."""
+    def __init__(self, session_budget=SESSION_TOKEN_BUDGET, global_budget=GLOBAL_TOKEN_BUDGET,
+                 window_s=GLOBAL_BUDGET_WINDOW_S):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict() # session id -> {"prompt_tokens", "output_tokens", "calls"}
+        self._window = deque() # (bucket start, tokens)
+        self._window_tokens = 0
+        self._totals = {"prompt_tokens": 0, "output_tokens": 0, "calls": 0}
+        self._by_stage = Counter() # stage -> total tokens
+        self._refused = 0
+        self._calls_by_level = Counter()
+
+    def _trim_window(self, now):
+        # Caller holds the lock.
+        while self._window and self._window[0][0] <= now - self.window_s:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def record(self, session_id, prompt_tokens, output_tokens, stage=None):
+        tokens = prompt_tokens + output_tokens
+        now = time.time()
+        with self._lock:
+            bucket = now - now % _BUCKET_S
+            if self._window and self._window[-1][0] == bucket:
+                self._window[-1] = (bucket, self._window[-1][1] + tokens)
+            else:
+                self._window.append((bucket, tokens))
+            self._window_tokens += tokens
+            self._trim_window(now)
+            for key, value in (("prompt_tokens", prompt_tokens), ("output_tokens", output_tokens), ("calls", 1)):
+                self._totals[key] += value
+            self._by_stage[stage or "unrouted"] += tokens
+            if session_id is not None:
+                usage = self._sessions.setdefault(session_id, {"prompt_tokens": 0, "output_tokens": 0, "calls": 0})
+                usage["prompt_tokens"] += prompt_tokens
+                usage["output_tokens"] += output_tokens
+                usage["calls"] += 1
+                self._sessions.move_to_end(session_id)
+                while len(self._sessions) > SESSION_USAGE_MAX_ENTRIES:
+                    self._sessions.popitem(last=False)
+
+    def _session_tokens(self, session_id):
+        # Caller holds the lock.
+        usage = self._sessions.get(session_id)
+        return usage["prompt_tokens"] + usage["output_tokens"] if usage else 0
+
+    def usage_share(self, session_id):
+        """The larger of the session's and the window's share of their budgets."""
+        with self._lock:
+            self._trim_window(time.time())
+            shares = [0.0]
+            if self.session_budget and session_id is not None:
+                shares.append(self._session_tokens(session_id) / self.session_budget)
+            if self.global_budget:
+                shares.append(self._window_tokens / self.global_budget)
+            return max(shares)
+
+    def level(self, session_id):
+        share = self.usage_share(session_id)
+        for threshold, level in DEGRADE_THRESHOLDS:
+            if share >= threshold:
+                return level
+        return LEVEL_NORMAL
+
+    def admit(self, session_id):
+        """Returns the level a model call runs at, counting refusals (LEVEL_REFUSED)."""
+        level = self.level(session_id)
+        with self._lock:
+            self._calls_by_level[LEVEL_NAMES[level]] += 1
+            if level == LEVEL_REFUSED:
+                self._refused += 1
+        return level
+
+    def session_stats(self, session_id):
+        level = self.level(session_id)
+        with self._lock:
+            usage = dict(self._sessions.get(session_id) or {"prompt_tokens": 0, "output_tokens": 0, "calls": 0})
+        used = usage["prompt_tokens"] + usage["output_tokens"]
+        return {"session_id": session_id, **usage, "tokens": used, "budget": self.session_budget or None,
+                "remaining": max(0, self.session_budget - used) if self.session_budget else None,
+                "level": LEVEL_NAMES[level]}
+
+    def snapshot(self, top_sessions=5):
+        with self._lock:
+            self._trim_window(time.time())
+            heaviest = sorted(self._sessions.items(),
+                              key=lambda item: -(item[1]["prompt_tokens"] + item[1]["output_tokens"]))[:top_sessions]
+            tokens = sorted(u["prompt_tokens"] + u["output_tokens"] for u in self._sessions.values())
+            return {
+                "session_budget": self.session_budget or None,
+                "global_budget": self.global_budget or None,
+                "window_s": self.window_s,
+                "window_tokens": self._window_tokens,
+                "global_level": LEVEL_NAMES[next((level for threshold, level in DEGRADE_THRESHOLDS
+                                                  if self.global_budget and self._window_tokens / self.global_budget >= threshold),
+                                                 LEVEL_NORMAL)],
+                "totals": dict(self._totals),
+                "tokens_by_stage": dict(self._by_stage),
+                "sessions_tracked": len(self._sessions),
+                "median_session_tokens": tokens[len(tokens) // 2] if tokens else 0,
+                "top_sessions": [{"session_id": sid, "tokens": u["prompt_tokens"] + u["output_tokens"], "calls": u["calls"]}
+                                 for sid, u in heaviest],
+                "calls_by_level": dict(self._calls_by_level),
+                "refused": self._refused,
+            }
+
+
+_budget = TokenBudget()
+
+def get_token_budget():
+    return _budget
+
+def reset_token_budget(**kwargs):
+    """Replaces the process-wide ledger (e.g. with different budgets). Returns the new one."""
+    global _budget
+    _budget = TokenBudget(**kwargs)
+    return _budget
+
+
+# --- Helpers for the current context ---
+def record_usage(prompt_tokens, output_tokens, stage=None):
+    """Charges a model call's token usage to the current session and the process window."""
+    prompt_tokens, output_tokens = int(prompt_tokens or 0), int(output_tokens or 0)
+    _budget.record(_session_id.get(), prompt_tokens, output_tokens, stage)
+    for callback in _usage_trackers.get():
+        callback(prompt_tokens + output_tokens)
+
+def current_level():
+    """The degradation level for the current session (LEVEL_* constant)."""
+    return _budget.level(_session_id.get())
+
+def admit_call():
+    """Level for a model call about to be made in the current context (counted in the stats)."""
+    return _budget.admit(_session_id.get())
+
+def get_session_budget_stats(session_id=None):
+    return _budget.session_stats(session_id if session_id is not None else _session_id.get())
+
+def get_budget_stats():
+    return _budget.snapshot()
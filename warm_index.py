@@ -0,0 +1,186 @@
+# warm_index.py
+"""
+Read-only, memory-mapped index of precomputed trip type and city suggestions.
+
+The index is produced offline by precompute_warm_index.py for the most common
+(origin, season, budget band, party type) combinations. At startup each worker
+process memory-maps the file; the pages are shared through the OS page cache, so
+the index costs no per-process heap and lookups are a binary search plus one
+zlib-decompressed JSON payload.
+
+File layout (little-endian):
+    header   b"TAWI", u16 version, u16 reserved, u32 entry count
+    table    entry count x (u64 key hash, u32 payload offset, u32 payload length), sorted by hash
+    payloads zlib-compressed JSON objects {"key": <key string>, "value": <suggestions>}
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import entities
+
+WARM_INDEX_PATH = os.environ.get(
+    "TRAVEL_AI_WARM_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_index.bin")
+)
+
+_MAGIC = b"TAWI"
+_VERSION = 3 # 3: entities.city_key keeps qualifiers that are not the curated country ("Paris, Texas")
+_HEADER = struct.Struct("<4sHHI")
+_ENTRY = struct.Struct("<QII")
+
+# Budget bands are on the total trip budget (the app's budget input).
+BUDGET_BANDS = [(1000.0, "budget"), (3000.0, "moderate"), (float("inf"), "premium")]
+
+SEASONS = {12: "winter", 1: "winter", 2: "winter", 3: "spring", 4: "spring", 5: "spring",
+           6: "summer", 7: "summer", 8: "summer", 9: "autumn", 10: "autumn", 11: "autumn"}
+
+
+# --- Keys ---
+def normalize_text(text):
+    return " ".join(str(text or "").casefold().split())
+
+def season_for(start_date):
+    return SEASONS[start_date.month]
+
+def budget_band(budget):
+    for upper, band in BUDGET_BANDS:
+        if float(budget) < upper:
+            return band
+    return BUDGET_BANDS[-1][1]
+
+def party_type(num_adults, num_children):
+    if num_children:
+        return "family"
+    if num_adults == 1:
+        return "solo"
+    if num_adults == 2:
+        return "couple"
+    return "group"
+
+def combination_for(ui):
+    """The (origin, season, budget band, party type) combination of a set of user inputs."""
+    return (
+        entities.city_key(ui["starting_destination"]),
+        season_for(ui["time_frame_start"]),
+        budget_band(ui["budget"]),
+        party_type(ui["num_adults"], ui["num_children"]),
+    )
+
+def make_key(stage, combination, trip_type=None):
+    """Index key for a stage ("trip_types" or "cities", matching planner.STAGE_*)."""
+    parts = [stage, *combination]
+    if stage == "cities":
+        parts.append(normalize_text(trip_type))
+    return "|".join(parts)
+
+def _hash_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# --- Writing ---
+def write_index(path, entries):
+    """
+    Writes `entries` (key string -> JSON-serializable value) as an index file.
+    The file is written to a temporary name and renamed, so readers never see a partial index.
+    """
+    hashed = sorted((_hash_key(key), key, value) for key, value in entries.items())
+    payloads = [zlib.compress(json.dumps({"key": key, "value": value}, separators=(",", ":")).encode("utf-8"), 9)
+                for _, key, value in hashed]
+
+    offset = _HEADER.size + _ENTRY.size * len(hashed)
+    table = bytearray()
+    for (key_hash, _, _), payload in zip(hashed, payloads):
+        table += _ENTRY.pack(key_hash, offset, len(payload))
+        offset += len(payload)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(hashed)))
+        f.write(table)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, path)
+
+
+# --- Reading ---
+class WarmIndex:
+    """A memory-mapped warm index file. Lookups are thread-safe (the mapping is read-only)."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {_VERSION} warm index file.")
+
+    def __len__(self):
+        return self.count
+
+    def get(self, key):
+        """Returns the value stored for `key`, or None if it is not in the index."""
+        key_hash = _hash_key(key)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            mid_hash = _ENTRY.unpack_from(self._mm, _HEADER.size + mid * _ENTRY.size)[0]
+            if mid_hash < key_hash:
+                low = mid + 1
+            else:
+                high = mid
+        # Walk the (rare) run of entries sharing this hash and confirm the full key.
+        while low < self.count:
+            entry_hash, offset, length = _ENTRY.unpack_from(self._mm, _HEADER.size + low * _ENTRY.size)
+            if entry_hash != key_hash:
+                break
+            record = json.loads(zlib.decompress(self._mm[offset:offset + length]))
+            if record["key"] == key:
+                return record["value"]
+            low += 1
+        return None
+
+    def close(self):
+        self._mm.close()
+
+
+_warm_index = None
+_warm_index_loaded = False
+_warm_index_lock = threading.Lock()
+_warm_index_stats = {"hits": 0, "misses": 0}
+
+def get_warm_index():
+    """Opens the process-wide warm index on first use. Returns None if no index file exists."""
+    global _warm_index, _warm_index_loaded
+    if not _warm_index_loaded:
+        with _warm_index_lock:
+            if not _warm_index_loaded:
+                if os.path.exists(WARM_INDEX_PATH):
+                    try:
+                        _warm_index = WarmIndex(WARM_INDEX_PATH)
+                    except (OSError, ValueError):
+                        _warm_index = None
+                _warm_index_loaded = True
+    return _warm_index
+
+def lookup(stage, ui):
+    """
+    Returns precomputed suggestions for a stage and user inputs, or None on a miss
+    (or when no index is available).
+    """
+    index = get_warm_index()
+    if index is None:
+        return None
+    key = make_key(stage, combination_for(ui), ui.get("selected_trip_type"))
+    value = index.get(key)
+    with _warm_index_lock:
+        _warm_index_stats["hits" if value is not None else "misses"] += 1
+    return value
+
+def get_warm_index_stats():
+    index = get_warm_index()
+    with _warm_index_lock:
+        return {"loaded": index is not None, "entries": len(index) if index else 0, **_warm_index_stats}